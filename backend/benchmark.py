@@ -0,0 +1,517 @@
+"""Benchmarks for the Tripflow API.
+
+Runs server:app in process. By default the database is an in-memory
+Motor-compatible stand-in (mongomock-motor); pass --mongo-url to benchmark
+against a real mongod instead. The serve scenario instead starts start.sh
+with each requested worker count and loads it over a real socket, so it
+needs --mongo-url.
+
+Usage:
+    python benchmark.py reorder --sizes 10 50 200 1000
+    python benchmark.py reorder --ordering rank
+    python benchmark.py trip-detail --sizes 10 100 1000
+    python benchmark.py serialize --sizes 100 1000 --rounds 20
+    python benchmark.py load --sizes 100 --clients 20 --rounds 25 --json results.json
+    python benchmark.py load --sizes 100 --compare results.json
+    python benchmark.py fanout --sizes 10 100 1000
+    python benchmark.py route --sizes 10 25 50 100
+    python benchmark.py serve --mongo-url mongodb://localhost:27017 --workers 1 2 4 --sizes 100
+"""
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import statistics
+import signal
+import subprocess
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+
+import server
+
+
+def make_database(mongo_url=None, db_name="tripflow_bench"):
+    """Return a fresh database handle, in memory unless a Mongo URL is given"""
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_url)[db_name]
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient()[db_name]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+async def seed_trip(db, activity_count, day_count=7):
+    """Insert one trip with evenly spread activities and return its id"""
+    now = datetime.now(timezone.utc)
+    trip_id = str(uuid.uuid4())
+    start = date.today()
+    await db.trips.insert_one({
+        "id": trip_id,
+        "title": f"Benchmark trip ({activity_count} activities)",
+        "date_start": start.isoformat(),
+        "date_end": (start + timedelta(days=day_count - 1)).isoformat(),
+        "currency": "INR",
+        "theme": "blue",
+        "created_at": now,
+        "updated_at": now,
+    })
+
+    days = [{
+        "id": str(uuid.uuid4()),
+        "trip_id": trip_id,
+        "date": (start + timedelta(days=i)).isoformat(),
+        "index": i + 1,
+        "notes": None,
+        "created_at": now,
+        "updated_at": now,
+    } for i in range(day_count)]
+    await db.days.insert_many(days)
+
+    activities = []
+    for i in range(activity_count):
+        day = days[i % day_count]
+        hour = 6 + (i // day_count) % 16
+        activities.append({
+            "id": str(uuid.uuid4()),
+            "trip_id": trip_id,
+            "day_id": day["id"],
+            "title": f"Activity {i}",
+            "start_time": f"{hour:02d}:00",
+            "end_time": f"{hour:02d}:45",
+            "location_text": None,
+            "category": "general",
+            "notes": None,
+            "cost": 100.0,
+            "priority": "medium",
+            "color": "#3b82f6",
+            "order_index": i // day_count,
+            "created_at": now,
+            "updated_at": now,
+        })
+    if activities:
+        await db.activities.insert_many(activities)
+    if server.ACTIVITY_ORDERING == "rank":
+        await server.migrate_activity_ranks()
+    return trip_id
+
+
+def app_client():
+    """HTTP client wired straight into the ASGI app"""
+    transport = httpx.ASGITransport(app=server.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def bench_reorder(db, args):
+    """Drop latency for a full-trip reorder payload in which one card moved"""
+    print(f"{'activities':>10} {'changed':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    async with app_client() as http:
+        for size in args.sizes:
+            trip_id = await seed_trip(db, size)
+            response = await http.get(f"/api/trips/{trip_id}")
+            activities = response.json()["activities"]
+            days = response.json()["days"]
+
+            samples = []
+            changed = 0
+            for round_number in range(args.rounds):
+                # Move the first card of one day to the end of the other, like a drag would
+                source_day, target_day = days[round_number % 2]["id"], days[(round_number + 1) % 2]["id"]
+                moved = next(a for a in activities if a["day_id"] == source_day)
+                target_count = sum(1 for a in activities if a["day_id"] == target_day)
+                moved["day_id"] = target_day
+                moved["order_index"] = target_count
+                for position, activity in enumerate(a for a in activities if a["day_id"] == source_day):
+                    activity["order_index"] = position
+
+                payload = {"updates": [
+                    {"id": a["id"], "day_id": a["day_id"], "order_index": a["order_index"]}
+                    for a in activities
+                ]}
+                started = time.perf_counter()
+                response = await http.post(f"/api/trips/{trip_id}/activities/reorder", json=payload)
+                samples.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+                changed = response.json()["changed"]
+
+            print(f"{size:>10} {changed:>8} {statistics.median(samples):>8.2f} {percentile(samples, 99):>8.2f}")
+
+
+def legacy_parse_from_mongo(item):
+    """The original key-suffix driven document parser"""
+    if isinstance(item, dict):
+        for key, value in item.items():
+            if key.endswith('_date') and isinstance(value, str):
+                try:
+                    item[key] = datetime.fromisoformat(value).date()
+                except ValueError:
+                    pass
+            elif key.endswith('_time') and isinstance(value, str):
+                try:
+                    item[key] = datetime.strptime(value, '%H:%M:%S').time()
+                except ValueError:
+                    pass
+    return item
+
+
+def legacy_render(trip, days, activities):
+    """Validate and render a trip the way the original response_model handler did"""
+    details = server.TripWithDays(
+        trip=server.Trip(**legacy_parse_from_mongo(trip)),
+        days=[server.Day(**legacy_parse_from_mongo(day)) for day in days],
+        activities=[server.Activity(**legacy_parse_from_mongo(activity)) for activity in activities]
+    )
+    return json.dumps(jsonable_encoder(details)).encode()
+
+
+def codec_render(trip, days, activities):
+    """Render a trip through the precompiled model codecs"""
+    return server.dump_json({
+        "trip": server.TRIP_CODEC.document(trip),
+        "days": [server.DAY_CODEC.document(day) for day in days],
+        "activities": [server.ACTIVITY_CODEC.document(activity) for activity in activities],
+    })
+
+
+async def legacy_trip_detail(db, trip_id):
+    """The original sequential, fully validated GET /api/trips/{trip_id} path"""
+    trip = await db.trips.find_one({"id": trip_id})
+    days = await db.days.find({"trip_id": trip_id}).sort("index", 1).to_list(1000)
+    activities = await db.activities.find({"trip_id": trip_id}).sort("order_index", 1).to_list(1000)
+    return legacy_render(trip, days, activities)
+
+
+async def uncached_trip_detail(trip_id):
+    """The current loader without the snapshot cache in front of it"""
+    return server.FastJSONResponse(await server.load_trip_details(trip_id))
+
+
+async def bench_trip_detail(db, args):
+    """Page-load latency of the trip detail loader against the original handler"""
+    print(f"{'activities':>10} {'loader':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in args.sizes:
+        trip_id = await seed_trip(db, size)
+        loaders = {
+            "legacy": lambda: legacy_trip_detail(db, trip_id),
+            "loader": lambda: uncached_trip_detail(trip_id),
+            "cached": lambda: server.get_trip_with_details(trip_id, if_none_match=None),
+        }
+        for name, load in loaders.items():
+            samples = []
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                await load()
+                samples.append((time.perf_counter() - started) * 1000)
+            print(f"{size:>10} {name:>8} {statistics.median(samples):>8.2f} {percentile(samples, 99):>8.2f}")
+
+
+async def bench_serialize(db, args):
+    """Documents per second turned into a trip detail response body, without database time"""
+    print(f"{'activities':>10} {'path':>8} {'docs/s':>12}")
+    for size in args.sizes:
+        trip_id = await seed_trip(db, size)
+        trip = await db.trips.find_one({"id": trip_id}, {"_id": 0})
+        days = await db.days.find({"trip_id": trip_id}, {"_id": 0}).to_list(None)
+        activities = await db.activities.find({"trip_id": trip_id}, {"_id": 0}).to_list(None)
+        documents = 1 + len(days) + len(activities)
+
+        for name, render in (("legacy", legacy_render), ("codec", codec_render)):
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                render(copy.deepcopy(trip), copy.deepcopy(days), copy.deepcopy(activities))
+            elapsed = time.perf_counter() - started
+            print(f"{size:>10} {name:>8} {documents * args.rounds / elapsed:>12,.0f}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadRecorder:
+    """Latency samples and error counts per flow step"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    async def request(self, http, step, method, url, **kwargs):
+        started = time.perf_counter()
+        response = await http.request(method, url, **kwargs)
+        self.samples.setdefault(step, []).append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[step] = self.errors.get(step, 0) + 1
+        return response
+
+    def summary(self, elapsed):
+        return {
+            step: {
+                "requests": len(samples),
+                "errors": self.errors.get(step, 0),
+                "throughput_rps": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50),
+                "p95_ms": percentile(samples, 95),
+                "p99_ms": percentile(samples, 99),
+                "max_ms": max(samples),
+            }
+            for step, samples in self.samples.items()
+        }
+
+
+async def planner_session(http, recorder, trip_id, rounds):
+    """One user working a trip: open it, add an activity, drag it, sync, delete it"""
+    cursor = (await recorder.request(http, "sync", "GET", f"/api/trips/{trip_id}/changes")).json()["cursor"]
+    for round_number in range(rounds):
+        details = (await recorder.request(http, "open_trip", "GET", f"/api/trips/{trip_id}")).json()
+        days = details["days"]
+        source, target = days[0]["id"], days[1 % len(days)]["id"]
+
+        created = (await recorder.request(
+            http, "add_activity", "POST", f"/api/trips/{trip_id}/days/{source}/activities",
+            json={"title": f"Load test stop {round_number}", "start_time": "12:00", "end_time": "13:00"},
+        )).json()
+
+        # Drop the new card at the top of the next day and send the whole trip, as the planner does
+        activities = [a for a in details["activities"]] + [created]
+        moved = [a for a in activities if a["day_id"] == target and a["id"] != created["id"]]
+        created["day_id"] = target
+        updates = [{"id": created["id"], "day_id": target, "order_index": 0}]
+        updates += [{"id": a["id"], "day_id": target, "order_index": i + 1} for i, a in enumerate(moved)]
+        updates += [
+            {"id": a["id"], "day_id": a["day_id"], "order_index": a["order_index"]}
+            for a in activities if a["day_id"] != target
+        ]
+        await recorder.request(http, "reorder", "POST", f"/api/trips/{trip_id}/activities/reorder", json={"updates": updates})
+
+        changes = (await recorder.request(http, "sync", "GET", f"/api/trips/{trip_id}/changes", params={"since": cursor})).json()
+        cursor = changes["cursor"]
+        await recorder.request(http, "delete_activity", "DELETE", f"/api/activities/{created['id']}")
+
+
+def print_load_summary(summary, baseline=None):
+    header = f"{'step':>16} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if baseline:
+        header += f" {'p50 vs base':>12} {'p99 vs base':>12}"
+    print(header)
+    for step, stats in summary.items():
+        line = (f"{step:>16} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>9.1f} "
+                f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+        base = (baseline or {}).get(step)
+        if base:
+            line += f" {stats['p50_ms'] / base['p50_ms']:>11.2f}x {stats['p99_ms'] / base['p99_ms']:>11.2f}x"
+        print(line)
+
+
+async def bench_load(db, args):
+    """Concurrent planner sessions against the in-process app, reported per flow step"""
+    await server.ensure_indexes()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = {run["activities"]: run["steps"] for run in json.load(handle)["runs"]}
+
+    runs = []
+    async with app_client() as http:
+        for size in args.sizes:
+            trip_ids = [await seed_trip(db, size) for _ in range(args.clients)]
+            recorder = LoadRecorder()
+            started = time.perf_counter()
+            await asyncio.gather(*(planner_session(http, recorder, trip_id, args.rounds) for trip_id in trip_ids))
+            elapsed = time.perf_counter() - started
+
+            summary = recorder.summary(elapsed)
+            total = sum(stats["requests"] for stats in summary.values())
+            print(f"\n{size} activities per trip, {args.clients} clients: {total / elapsed:.1f} req/s over {elapsed:.2f} s")
+            print_load_summary(summary, (baseline or {}).get(size))
+            runs.append({"activities": size, "elapsed_s": elapsed, "throughput_rps": total / elapsed, "steps": summary})
+
+    if args.json:
+        results = {
+            "commit": git_commit(),
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "database": "mongodb" if args.mongo_url else "in-memory",
+            "ordering": server.ACTIVITY_ORDERING,
+            "clients": args.clients,
+            "rounds": args.rounds,
+            "runs": runs,
+        }
+        with open(args.json, "w") as handle:
+            json.dump(results, handle, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+async def idle_subscriber(subscription, received):
+    """A collaborator with the trip open, noting when each event reaches it"""
+    while True:
+        await subscription.get()
+        received.append(time.perf_counter())
+
+
+async def bench_fanout(db, args):
+    """Latency from a write request to delivery at every idle subscriber of the trip"""
+    print(f"{'subscribers':>11} {'write ms':>9} {'p50 ms':>8} {'p99 ms':>8} {'last ms':>8}")
+    async with app_client() as http:
+        for size in args.sizes:
+            trip_id = await seed_trip(db, 20)
+            activity = await db.activities.find_one({"trip_id": trip_id}, {"_id": 0, "id": 1})
+            subscriptions = [server.change_hub.subscribe(trip_id) for _ in range(size)]
+            inboxes = [[] for _ in subscriptions]
+            listeners = [
+                asyncio.create_task(idle_subscriber(subscription, inbox))
+                for subscription, inbox in zip(subscriptions, inboxes)
+            ]
+
+            writes, deliveries, last = [], [], []
+            for round_number in range(args.rounds):
+                for inbox in inboxes:
+                    inbox.clear()
+                started = time.perf_counter()
+                await http.put(f"/api/activities/{activity['id']}", json={"notes": f"edit {round_number}"})
+                writes.append((time.perf_counter() - started) * 1000)
+                while sum(map(len, inboxes)) < size:
+                    await asyncio.sleep(0)
+                arrivals = [(inbox[0] - started) * 1000 for inbox in inboxes]
+                deliveries.extend(arrivals)
+                last.append(max(arrivals))
+
+            for listener in listeners:
+                listener.cancel()
+            for subscription in subscriptions:
+                subscription.close()
+            print(f"{size:>11} {statistics.median(writes):>9.2f} {percentile(deliveries, 50):>8.2f} "
+                  f"{percentile(deliveries, 99):>8.2f} {statistics.median(last):>8.2f}")
+
+
+def synthetic_day(stop_count, rng):
+    """Stops scattered over a city, each with a one to three hour window between 08:00 and 22:00"""
+    stops = []
+    for number in range(stop_count):
+        opens = rng.randint(8 * 60, 19 * 60)
+        closes = opens + rng.randint(60, 180)
+        stops.append({
+            "id": f"stop-{number}",
+            "start_time": f"{opens // 60:02d}:{opens % 60:02d}",
+            "end_time": f"{closes // 60:02d}:{closes % 60:02d}",
+            "location": {"type": "Point", "coordinates": [2.25 + rng.random() * 0.17, 48.81 + rng.random() * 0.09]},
+        })
+    return stops
+
+
+async def bench_route(db, args):
+    """Time to propose a day route (distance matrix, nearest neighbour, 2-opt), without database time"""
+    rng = random.Random(7)
+    print(f"{'stops':>6} {'p50 ms':>8} {'p99 ms':>8} {'km before':>10} {'km after':>9} {'late min':>9}")
+    for size in args.sizes:
+        samples, before, after, late = [], [], [], []
+        for _ in range(args.rounds):
+            day = synthetic_day(size, rng)
+            started = time.perf_counter()
+            proposal = server.propose_route(day)
+            samples.append((time.perf_counter() - started) * 1000)
+            before.append(proposal["current"]["distance_km"])
+            after.append(proposal["proposed"]["distance_km"])
+            late.append(proposal["proposed"]["late_minutes"])
+        print(f"{size:>6} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f} "
+              f"{statistics.mean(before):>10.1f} {statistics.mean(after):>9.1f} {statistics.mean(late):>9.1f}")
+
+
+async def wait_until_ready(http, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            if (await http.get("/api/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError("server did not become ready")
+
+
+async def bench_serve(db, args):
+    """Throughput of start.sh over a real socket as the worker count grows"""
+    if not args.mongo_url:
+        raise SystemExit("serve needs --mongo-url: worker processes cannot share the in-memory database")
+    await server.ensure_indexes()
+    trip_ids = [await seed_trip(db, args.sizes[0]) for _ in range(args.clients)]
+    print(f"{'workers':>7} {'requests':>9} {'errors':>7} {'req/s':>9} {'req/s/worker':>13} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in args.workers:
+        port = args.port + workers
+        env = {
+            **os.environ, "PORT": str(port), "WEB_CONCURRENCY": str(workers),
+            "MONGO_URL": args.mongo_url, "DB_NAME": db.name,
+            # Per-worker caches would serve stale trips once requests spread over workers
+            "TRIP_CACHE_BACKEND": "redis" if os.environ.get("REDIS_URL") else "off",
+        }
+        process = subprocess.Popen(["bash", "start.sh"], env=env, start_new_session=True,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            limits = httpx.Limits(max_connections=args.clients)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as http:
+                await wait_until_ready(http, process)
+                recorder = LoadRecorder()
+                started = time.perf_counter()
+                await asyncio.gather(*(planner_session(http, recorder, trip_id, args.rounds) for trip_id in trip_ids))
+                elapsed = time.perf_counter() - started
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+
+        samples = [sample for step in recorder.samples.values() for sample in step]
+        errors = sum(recorder.errors.values())
+        throughput = len(samples) / elapsed
+        print(f"{workers:>7} {len(samples):>9} {errors:>7} {throughput:>9.1f} {throughput / workers:>13.1f} "
+              f"{percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}")
+
+
+SCENARIOS = {
+    "reorder": bench_reorder,
+    "trip-detail": bench_trip_detail,
+    "serialize": bench_serialize,
+    "load": bench_load,
+    "fanout": bench_fanout,
+    "route": bench_route,
+    "serve": bench_serve,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tripflow backend benchmarks")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--mongo-url", default=None)
+    parser.add_argument("--ordering", choices=["dense", "rank"], default=server.ACTIVITY_ORDERING)
+    parser.add_argument("--clients", type=int, default=10, help="concurrent planner sessions (load)")
+    parser.add_argument("--json", default=None, help="write machine-readable results here (load)")
+    parser.add_argument("--compare", default=None, help="results file from an earlier run to compare with (load)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to start (serve)")
+    parser.add_argument("--port", type=int, default=8100, help="base port; each run listens on port + workers (serve)")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    server.ACTIVITY_ORDERING = args.ordering
+    server.db = make_database(args.mongo_url)
+    asyncio.run(SCENARIOS[args.scenario](server.db, args))
+
+
+if __name__ == "__main__":
+    main()
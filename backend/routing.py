@@ -0,0 +1,145 @@
+"""Day route optimizer: orders a day's stops by distance while keeping to their time windows.
+
+Pure NumPy and Python with no database access; server.py loads the stops and
+writes the proposed order back through the reorder engine.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_matrix(points: np.ndarray) -> np.ndarray:
+    """Pairwise great-circle distances in km for an (n, 2) array of [lng, lat] degrees"""
+    lng, lat = np.radians(points).T
+    half_dlat = (lat[:, None] - lat[None, :]) / 2
+    half_dlng = (lng[:, None] - lng[None, :]) / 2
+    a = np.sin(half_dlat) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(half_dlng) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def route_windows(intervals: List[Optional[Tuple[int, int]]]) -> np.ndarray:
+    """(opens, closes) in minutes for each stop; a stop without valid times (None) is always open"""
+    windows = np.empty((len(intervals), 2))
+    for position, interval in enumerate(intervals):
+        windows[position] = interval if interval is not None else (-np.inf, np.inf)
+    return windows
+
+def route_lateness(order: List[int], travel: List[List[float]], windows: List[List[float]],
+                   start: int = 1, clock: Optional[float] = None, late: float = 0.0,
+                   limit: float = float("inf")) -> float:
+    """Minutes late over a route, optionally resumed at position start from a known clock.
+
+    A stop is reached no earlier than its start time; arriving after its end
+    time counts as late. Time spent at a stop is not modelled, since an
+    activity only records the window it should happen in. Gives up as soon
+    as the total passes limit.
+    """
+    if clock is None:
+        clock = windows[order[0]][0]
+    for position in range(start, len(order)):
+        stop = order[position]
+        clock = max(clock + travel[order[position - 1]][stop], windows[stop][0])
+        if clock > windows[stop][1]:
+            late += clock - windows[stop][1]
+            if late > limit:
+                return late
+    return late
+
+def route_schedule(order: List[int], travel: List[List[float]], windows: List[List[float]]) -> Tuple[List[float], List[float]]:
+    """Arrival clock and minutes late so far at each position of a route"""
+    clocks, lates = [windows[order[0]][0]], [0.0]
+    for previous, stop in zip(order, order[1:]):
+        clocks.append(max(clocks[-1] + travel[previous][stop], windows[stop][0]))
+        lates.append(lates[-1] + max(0.0, clocks[-1] - windows[stop][1]))
+    return clocks, lates
+
+def route_length(order: List[int], distances: np.ndarray) -> float:
+    return float(distances[order[:-1], order[1:]].sum())
+
+def nearest_neighbour_route(distances: np.ndarray, windows: List[List[float]]) -> List[int]:
+    """Greedy route: start with the earliest window, then go to the nearest stop that can wait.
+
+    Only stops opening before the earliest deadline still ahead are
+    candidates, so the greedy walk never strands a stop that closes early.
+    """
+    unvisited = set(range(len(distances)))
+    current = min(unvisited, key=lambda stop: (windows[stop][0], windows[stop][1], stop))
+    order = [current]
+    unvisited.discard(current)
+    while unvisited:
+        deadline = min(windows[stop][1] for stop in unvisited)
+        candidates = [stop for stop in unvisited if windows[stop][0] <= deadline]
+        current = min(candidates, key=lambda stop: (distances[current, stop], stop))
+        order.append(current)
+        unvisited.discard(current)
+    return order
+
+def two_opt(order: List[int], distances: np.ndarray, travel: List[List[float]], windows: List[List[float]]) -> List[int]:
+    """Improve an open route with segment reversals that shorten it without making it later.
+
+    The distance change of every reversal is computed at once with NumPy,
+    and candidates are tried best first until one keeps to the time windows.
+    Only the part of the route from the reversal on is re-timed.
+    """
+    n = len(order)
+    positions = np.arange(n)
+    improvable = np.triu(np.ones((n, n), dtype=bool), k=1)
+    for _ in range(n * n):
+        clocks, lates = route_schedule(order, travel, windows)
+        # Pad with a zero row and column on each side so the route's open ends cost nothing
+        padded = np.zeros((n + 2, n + 2))
+        padded[1:-1, 1:-1] = distances[np.ix_(order, order)]
+        # Reversing order[i:j + 1] trades edges (i-1, i) and (j, j+1) for (i-1, j) and (i, j+1)
+        removed = padded[positions, positions + 1][:, None] + padded[positions + 1, positions + 2][None, :]
+        added = padded[positions[:, None], positions[None, :] + 1] + padded[positions[:, None] + 1, positions[None, :] + 2]
+        delta = np.where(improvable, added - removed, 0.0).ravel()
+        shorter = np.flatnonzero(delta < -1e-9)
+
+        for flat in shorter[np.argsort(delta[shorter])]:
+            i, j = divmod(int(flat), n)
+            candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+            if i == 0:
+                late = route_lateness(candidate, travel, windows, limit=lates[-1] + 1e-9)
+            else:
+                late = route_lateness(candidate, travel, windows, i, clocks[i - 1], lates[i - 1], lates[-1] + 1e-9)
+            if late <= lates[-1] + 1e-9:
+                order = candidate
+                break
+        else:
+            return order
+    return order
+
+def solve_route(activities: List[dict], intervals: List[Optional[Tuple[int, int]]], speed_kmh: float) -> dict:
+    """Proposed visit order for one day's activities, given in their current order.
+
+    intervals holds each activity's (start, end) minute of the day, or None
+    when it has no usable times. Activities with coordinates are routed with
+    nearest neighbour followed by 2-opt at speed_kmh between stops;
+    activities without keep their slots. The current order is kept unless
+    the proposal is less late, or as late and shorter.
+    """
+    located = [slot for slot, activity in enumerate(activities) if (activity.get("location") or {}).get("coordinates")]
+    stops = [activities[slot] for slot in located]
+    current = list(range(len(stops)))
+    proposed = current
+    current_cost = proposed_cost = (0.0, 0.0)
+    if len(stops) > 1:
+        distances = haversine_matrix(np.array([stop["location"]["coordinates"] for stop in stops], dtype=float))
+        # Plain lists: the timing loops index them one element at a time
+        travel = (distances / speed_kmh * 60).tolist()
+        windows = route_windows([intervals[slot] for slot in located]).tolist()
+        current_cost = (route_lateness(current, travel, windows), route_length(current, distances))
+        proposed = two_opt(nearest_neighbour_route(distances, windows), distances, travel, windows)
+        proposed_cost = (route_lateness(proposed, travel, windows), route_length(proposed, distances))
+        if proposed_cost >= current_cost:
+            proposed, proposed_cost = current, current_cost
+
+    ordered = list(activities)
+    for slot, stop in zip(located, proposed):
+        ordered[slot] = stops[stop]
+    return {
+        "order": [activity["id"] for activity in ordered],
+        "current": {"late_minutes": current_cost[0], "distance_km": current_cost[1]},
+        "proposed": {"late_minutes": proposed_cost[0], "distance_km": proposed_cost[1]},
+        "unlocated": [activity["id"] for activity in activities if activity not in stops],
+    }
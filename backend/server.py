@@ -1,71 +1,696 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from motor.frameworks import asyncio as motor_asyncio_framework
+import orjson
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, DeleteOne, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import io
+import csv
+import json
+import base64
+import heapq
+import math
+import re
+import asyncio
 import logging
+import threading
+import contextvars
+from contextlib import asynccontextmanager
+import time as clock
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Annotated, Dict, List, Optional, Tuple
 import uuid
-from datetime import datetime, date, time, timezone
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime, date, time, timedelta, timezone
+
+from routing import solve_route
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Database instrumentation: every command is attributed to the request that issued it
+class RequestStats:
+    """DB commands and DB time spent on behalf of one request"""
+
+    def __init__(self):
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        # Listener callbacks run on Motor's executor threads
+        with self._lock:
+            self.db_commands += 1
+            self.db_seconds += seconds
+
+
+current_request_stats = contextvars.ContextVar("current_request_stats", default=None)
+
+class DBCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self.totals = defaultdict(lambda: [0, 0.0])  # command name -> [count, seconds]
+        self._lock = threading.Lock()
+
+    def _record(self, event) -> None:
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            totals = self.totals[event.command_name]
+            totals[0] += 1
+            totals[1] += seconds
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.record(seconds)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+db_command_listener = DBCommandListener()
+
+# Motor runs each operation on a thread pool without copying contextvars; run it
+# in a copy of the caller's context so the listener can see the current request
+_motor_run_on_executor = motor_asyncio_framework.run_on_executor
+
+def _run_on_executor_in_context(loop, fn, *args, **kwargs):
+    return _motor_run_on_executor(loop, contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+motor_asyncio_framework.run_on_executor = _run_on_executor_in_context
+
+# MongoDB connection, opened in the app lifespan so every worker process builds its
+# own pool after the fork; a worker holds up to MONGO_MAX_POOL_SIZE connections
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
 db_name = os.environ.get('DB_NAME', 'tripflow_dev')
-db = client[db_name]
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '0'))
+# Wire compression, e.g. "zstd,snappy,zlib"; empty sends uncompressed messages
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+def mongo_client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [db_command_listener],
+    }
+    if MONGO_SOCKET_TIMEOUT_MS > 0:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+# Startup warm-up: pool connections opened and recent trips loaded into the
+# snapshot cache before the worker reports ready
+WARM_CONNECTIONS = int(os.environ.get('WARM_CONNECTIONS', str(MONGO_MIN_POOL_SIZE)))
+WARM_TRIPS = int(os.environ.get('WARM_TRIPS', '20'))
+READINESS_TIMEOUT_SECONDS = float(os.environ.get('READINESS_TIMEOUT_SECONDS', '2'))
+
+# Admission control: expensive routes run at most ADMISSION_CONCURRENCY requests at once
+# and queue ADMISSION_QUEUE_SIZE more for up to ADMISSION_QUEUE_SECONDS before shedding
+# them with 503; each client gets RATE_LIMIT_PER_SECOND requests (bursts of
+# RATE_LIMIT_BURST) before 429s, 0 disables the rate limit
+ADMISSION_CONCURRENCY = int(os.environ.get('ADMISSION_CONCURRENCY', '32'))
+ADMISSION_QUEUE_SIZE = int(os.environ.get('ADMISSION_QUEUE_SIZE', '64'))
+ADMISSION_QUEUE_SECONDS = float(os.environ.get('ADMISSION_QUEUE_SECONDS', '2'))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get('ADMISSION_RETRY_AFTER_SECONDS', '1'))
+RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND', '0'))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', str(max(RATE_LIMIT_PER_SECOND * 2, 1))))
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get('RATE_LIMIT_MAX_CLIENTS', '10000'))
+# Clients are told apart by the connection's peer address. Behind a proxy, set this
+# to the header the proxy appends the client address to (e.g. x-forwarded-for); only
+# do so when every request passes through that proxy, since clients can forge it
+RATE_LIMIT_CLIENT_HEADER = os.environ.get('RATE_LIMIT_CLIENT_HEADER', '').lower()
+REORDER_MAX_BYTES = int(os.environ.get('REORDER_MAX_BYTES', str(1024 * 1024)))
+
+# Activity ordering: "dense" renumbers order_index on every move, "rank" keeps a
+# sparse lexicographic rank key per activity so a move only rewrites that activity
+ACTIVITY_ORDERING = os.environ.get('ACTIVITY_ORDERING', 'dense')
+MAX_RANK_LENGTH = int(os.environ.get('MAX_RANK_LENGTH', '24'))
+
+# Trip snapshot cache: "memory" (per process), "redis" (shared between workers) or "off"
+TRIP_CACHE_BACKEND = os.environ.get('TRIP_CACHE_BACKEND', 'memory')
+# Worker processes start.sh runs; a per-process cache would serve each worker's stale
+# snapshots (and 304s) for the others' writes, so several workers never use one
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+MEMORY_CACHE_DISABLED = TRIP_CACHE_BACKEND == 'memory' and WEB_CONCURRENCY > 1
+if MEMORY_CACHE_DISABLED:
+    TRIP_CACHE_BACKEND = 'off'
+TRIP_CACHE_TTL = float(os.environ.get('TRIP_CACHE_TTL', '60'))
+TRIP_CACHE_MAX_BYTES = int(os.environ.get('TRIP_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Change fan-out: "memory" reaches subscribers of this process only, "redis" relays
+# events between workers; each subscriber buffers at most SUBSCRIBER_QUEUE_SIZE events
+CHANGE_BROKER = os.environ.get('CHANGE_BROKER', 'memory')
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('SUBSCRIBER_QUEUE_SIZE', '64'))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', '15'))
+# A dropped Redis subscription is retried after this many seconds, doubling up to the max
+CHANGE_BROKER_RETRY_SECONDS = float(os.environ.get('CHANGE_BROKER_RETRY_SECONDS', '1'))
+CHANGE_BROKER_RETRY_MAX_SECONDS = float(os.environ.get('CHANGE_BROKER_RETRY_MAX_SECONDS', '30'))
+
+# Multi-document writes (trip provisioning etc.) run in a transaction when enabled;
+# MongoDB only supports transactions on replica sets and sharded clusters
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'false').lower() == 'true'
+MAX_TRIP_DAYS = int(os.environ.get('MAX_TRIP_DAYS', '366'))
+
+# Records validated and written per insert_many during a bulk import
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+
+# Itinerary templates never change once saved, so each worker keeps recently used
+# ones in memory; TEMPLATE_CACHE_TTL only bounds how long a deleted one lingers
+TEMPLATE_CACHE_TTL = float(os.environ.get('TEMPLATE_CACHE_TTL', '300'))
+TEMPLATE_CACHE_MAX_BYTES = int(os.environ.get('TEMPLATE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Delta sync: how far back a cursor may reach before a full snapshot is sent
+# (tombstones are kept this long), and how much clock slack re-sent changes cover
+SYNC_TOMBSTONE_TTL = int(os.environ.get('SYNC_TOMBSTONE_TTL', str(7 * 24 * 3600)))
+SYNC_LOOKBACK_SECONDS = float(os.environ.get('SYNC_LOOKBACK_SECONDS', '5'))
+
+# Batch PATCH: at most PATCH_MAX_UPDATES edits per request, of which PATCH_CONCURRENCY
+# are in flight against the pool at once
+PATCH_MAX_UPDATES = int(os.environ.get('PATCH_MAX_UPDATES', '500'))
+PATCH_CONCURRENCY = int(os.environ.get('PATCH_CONCURRENCY', '8'))
+
+# Schedule conflicts: "off", or "reject" to refuse writes that make activities overlap
+CONFLICT_CHECK = os.environ.get('CONFLICT_CHECK', 'off')
+
+# Budget rollups are rebuilt from the activities every this many seconds (0 turns it off)
+ROLLUP_RECONCILE_SECONDS = float(os.environ.get('ROLLUP_RECONCILE_SECONDS', '0'))
+
+# Trip deletion: deleted trips are tombstoned at once and their days and activities
+# purged in the background, REAPER_BATCH_SIZE documents at a time. A much rarer sweep
+# removes children left without a trip once they are ORPHAN_GRACE_SECONDS old
+REAPER_INTERVAL_SECONDS = float(os.environ.get('REAPER_INTERVAL_SECONDS', '60'))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', '500'))
+ORPHAN_SWEEP_SECONDS = float(os.environ.get('ORPHAN_SWEEP_SECONDS', str(24 * 3600)))
+ORPHAN_GRACE_SECONDS = float(os.environ.get('ORPHAN_GRACE_SECONDS', '3600'))
+
+# Route optimizer: average travel speed between stops, used to check time windows
+ROUTE_SPEED_KMH = float(os.environ.get('ROUTE_SPEED_KMH', '30'))
+
+# Requests slower than this many milliseconds are logged with their DB usage (0 turns it off)
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
+
+# Query plan self-check at startup: "off", "warn" (log COLLSCANs) or "strict" (refuse to start)
+INDEX_CHECK = os.environ.get('INDEX_CHECK', 'warn')
+
+# JSON rendering
+def dump_json(content) -> bytes:
+    """Serialize with orjson; OPT_UTC_Z writes UTC datetimes the way Pydantic does"""
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_up(app)
+    try:
+        yield
+    finally:
+        await shut_down(app)
 
 # Create the main app without a prefix
 app = FastAPI(
     title="Tripflow API",
     description="AI-Powered Trip Planning Platform API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan,
 )
 
-# Add CORS middleware first - before any routes
+# Metrics, rendered in the Prometheus text exposition format
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+INF_BOUND = 'le="+Inf"'
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: List[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # label values -> per-bucket counts, sum and count
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        slot = bisect_left(self.buckets, value)
+        if slot < len(self.buckets):
+            series["buckets"][slot] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                bound_label = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names, labels, bound_label)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(self.label_names, labels, INF_BOUND)} {series['count']}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, labels)} {series['count']}")
+        return lines
+
+def render_counter(name: str, help_text: str, label_names: Tuple[str, ...], values: dict, kind: str = "counter") -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in values.items():
+        lines.append(f"{name}{_label_text(label_names, labels)} {value}")
+    return lines
+
+
+REQUEST_LABELS = ("method", "route", "status")
+request_latency = Histogram(
+    "tripflow_http_request_duration_seconds", "Request latency by route.", REQUEST_LABELS,
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0],
+)
+request_db_commands = Histogram(
+    "tripflow_http_request_db_commands", "MongoDB commands issued per request.", REQUEST_LABELS,
+    [0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000],
+)
+request_db_seconds = Histogram(
+    "tripflow_http_request_db_seconds", "Time spent in MongoDB commands per request.", REQUEST_LABELS,
+    [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+)
+
+class MetricsMiddleware:
+    """Record latency and DB usage per route, and log requests slower than SLOW_REQUEST_MS"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status = [500]
+        event_stream = [False]
+        started = clock.perf_counter()
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                # Starlette appends "; charset=utf-8", so match the media type only
+                event_stream[0] = any(
+                    name.lower() == b"content-type" and value.lower().startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = clock.perf_counter() - started
+            current_request_stats.reset(token)
+            if event_stream[0]:
+                # Subscriptions stay open for as long as the client watches the trip
+                return
+            # The route template, not the raw path, keeps label cardinality bounded
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched", str(status[0]))
+            request_latency.observe(labels, elapsed)
+            request_db_commands.observe(labels, stats.db_commands)
+            request_db_seconds.observe(labels, stats.db_seconds)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request: %s %s -> %s in %.1f ms (%d DB commands, %.1f ms in DB)",
+                    scope["method"], scope["path"], status[0], elapsed * 1000,
+                    stats.db_commands, stats.db_seconds * 1000,
+                )
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in (request_latency, request_db_commands, request_db_seconds):
+        lines.extend(histogram.render())
+    with db_command_listener._lock:
+        totals = dict(db_command_listener.totals)
+    lines.extend(render_counter(
+        "tripflow_db_commands_total", "MongoDB commands by command name.", ("command",),
+        {(name, ): count for name, (count, _) in totals.items()},
+    ))
+    lines.extend(render_counter(
+        "tripflow_db_command_seconds_total", "Time spent in MongoDB commands by command name.", ("command",),
+        {(name, ): seconds for name, (_, seconds) in totals.items()},
+    ))
+    cache = trip_cache.stats()
+    for counter in ("hits", "misses", "evictions"):
+        lines.extend(render_counter(
+            f"tripflow_trip_cache_{counter}_total", f"Trip snapshot cache {counter}.", (), {(): cache[counter]},
+        ))
+    fanout = change_hub.stats()
+    lines.extend(render_counter(
+        "tripflow_change_subscribers", "Open change subscriptions in this process.", (),
+        {(): fanout["subscribers"]}, kind="gauge",
+    ))
+    for counter in ("published", "delivered", "dropped"):
+        lines.extend(render_counter(
+            f"tripflow_change_events_{counter}_total", f"Change events {counter}.", (), {(): fanout[counter]},
+        ))
+    gates = admission.gates
+    lines.extend(render_counter(
+        "tripflow_admission_in_flight", "Requests running per admission-controlled route.", ("route",),
+        {(gate.name, ): gate.active for gate in gates}, kind="gauge",
+    ))
+    lines.extend(render_counter(
+        "tripflow_admission_queue_depth", "Requests waiting for a slot per route.", ("route",),
+        {(gate.name, ): len(gate.waiters) for gate in gates}, kind="gauge",
+    ))
+    lines.extend(render_counter(
+        "tripflow_admission_shed_total", "Requests shed with 503 per route and reason.", ("route", "reason"),
+        {(gate.name, reason): count for gate in gates for reason, count in gate.shed.items()},
+    ))
+    lines.extend(render_counter(
+        "tripflow_rate_limited_total", "Requests refused with 429 by the per-client rate limit.", (),
+        {(): admission.counters["rate_limited"]},
+    ))
+    lines.extend(render_counter(
+        "tripflow_payload_rejected_total", "Reorder requests refused with 413 for their size.", (),
+        {(): admission.counters["payload_rejected"]},
+    ))
+    return "\n".join(lines) + "\n"
+
+class RouteGate:
+    """Concurrency limit for one route, with a bounded FIFO of requests waiting for a slot"""
+
+    def __init__(self, name: str, method: str, pattern: str, limit: int, queue_size: int):
+        self.name = name
+        self.method = method
+        self.pattern = re.compile(pattern)
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiters = deque()
+        self.shed = {"queue_full": 0, "timeout": 0}
+
+    def matches(self, method: str, path: str) -> bool:
+        return method == self.method and self.pattern.fullmatch(path) is not None
+
+    async def acquire(self, timeout: float) -> Optional[str]:
+        """Take a slot, or return why the request is shed"""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return None
+        if len(self.waiters) >= self.queue_size:
+            self.shed["queue_full"] += 1
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self.shed["timeout"] += 1
+            return "timeout"
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the client went away
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        return None
+
+    def release(self) -> None:
+        # Hand the slot straight to the oldest waiter still waiting
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+class AdmissionControl:
+    """Route gates, per-client token buckets and rejection counts, shared with /api/metrics"""
+
+    def __init__(self):
+        self.gates = [
+            RouteGate("trip_detail", "GET", r"/api/trips/[^/]+", ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE),
+            RouteGate("trip_listing", "GET", r"/api/trips", ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE),
+            RouteGate("reorder", "POST", r"/api/(trips/[^/]+/)?activities/reorder", ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE),
+            RouteGate("activity_patch", "PATCH", r"/api/trips/[^/]+/activities", ADMISSION_CONCURRENCY, ADMISSION_QUEUE_SIZE),
+        ]
+        self.buckets = OrderedDict()  # client -> TokenBucket, least recently seen first
+        self.counters = {"rate_limited": 0, "payload_rejected": 0}
+
+    def client_key(self, scope) -> str:
+        if RATE_LIMIT_CLIENT_HEADER:
+            for name, value in scope["headers"]:
+                if name.decode("latin-1") == RATE_LIMIT_CLIENT_HEADER:
+                    return value.decode("latin-1").split(",")[-1].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def take_token(self, key: str) -> float:
+        """Spend one of the client's tokens; returns 0, or the seconds until one is available"""
+        now = clock.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(RATE_LIMIT_BURST, now)
+            if len(self.buckets) > RATE_LIMIT_MAX_CLIENTS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket.tokens = min(RATE_LIMIT_BURST, bucket.tokens + (now - bucket.updated) * RATE_LIMIT_PER_SECOND)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / RATE_LIMIT_PER_SECOND
+
+    def gate_for(self, method: str, path: str) -> Optional[RouteGate]:
+        return next((gate for gate in self.gates if gate.matches(method, path)), None)
+
+
+admission = AdmissionControl()
+
+class AdmissionMiddleware:
+    """Per-client rate limit, reorder payload cap and per-route concurrency limits.
+
+    Runs before routing, so gated routes are matched on method and path.
+    Shed requests get 503 and rate-limited ones 429, both with Retry-After,
+    so that a burst queues briefly and then fails fast instead of piling up
+    coroutines and Mongo connections.
+    """
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not scope["path"].startswith("/api/") \
+                or scope["path"] == "/api/metrics" or scope["path"].startswith("/api/health"):
+            await self.app(scope, receive, send)
+            return
+
+        if RATE_LIMIT_PER_SECOND > 0:
+            wait = self.control.take_token(self.control.client_key(scope))
+            if wait:
+                self.control.counters["rate_limited"] += 1
+                await self.reject(send, 429, "Too many requests", math.ceil(wait))
+                return
+
+        gate = self.control.gate_for(scope["method"], scope["path"])
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        if gate.name == "reorder":
+            body = await read_body(receive, REORDER_MAX_BYTES)
+            if body is None:
+                self.control.counters["payload_rejected"] += 1
+                await self.reject(send, 413, f"Reorder payload exceeds {REORDER_MAX_BYTES} bytes")
+                return
+            receive = replay_body(body, receive)
+
+        reason = await gate.acquire(ADMISSION_QUEUE_SECONDS)
+        if reason is not None:
+            await self.reject(send, 503, "Server busy, retry shortly", ADMISSION_RETRY_AFTER_SECONDS)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+    @staticmethod
+    async def reject(send, status: int, detail: str, retry_after: Optional[int] = None) -> None:
+        headers = [(b"content-type", b"application/json")]
+        if retry_after is not None:
+            headers.append((b"retry-after", str(max(retry_after, 1)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": dump_json({"detail": detail})})
+
+async def read_body(receive, limit: int) -> Optional[bytes]:
+    """Buffer a request body, or return None as soon as it grows past limit bytes"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        size += len(message.get("body", b""))
+        if size > limit:
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+def replay_body(body: bytes, receive):
+    """A receive callable that yields an already buffered body, then defers to the client"""
+    delivered = False
+
+    async def replay():
+        nonlocal delivered
+        if delivered:
+            return await receive()
+        delivered = True
+        return {"type": "http.request", "body": body, "more_body": False}
+    return replay
+
+
+# The middleware added last runs first: metrics see every response, and CORS
+# headers are added to requests that admission control turns away
+app.add_middleware(AdmissionMiddleware, control=admission)
+
+# Add CORS middleware before any routes
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins for now
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Retry-After"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Helper functions for MongoDB serialization
-def prepare_for_mongo(data):
-    """Convert Python objects to MongoDB-compatible format"""
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, date) and not isinstance(value, datetime):
-                data[key] = value.isoformat()
-            elif isinstance(value, time):
-                data[key] = value.strftime('%H:%M:%S')
-    return data
-
-def parse_from_mongo(item):
-    """Parse MongoDB data back to Python objects"""
-    if isinstance(item, dict):
-        for key, value in item.items():
-            if key.endswith('_date') and isinstance(value, str):
-                try:
-                    item[key] = datetime.fromisoformat(value).date()
-                except:
-                    pass
-            elif key.endswith('_time') and isinstance(value, str):
-                try:
-                    item[key] = datetime.strptime(value, '%H:%M:%S').time()
-                except:
-                    pass
-    return item
+
+# Rank keys for "rank" ordering mode. Digits are ordered by ASCII value, so
+# MongoDB's plain string sort agrees with the fractional value of each key.
+RANK_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+RANK_BASE = len(RANK_DIGITS)
+_RANK_VALUES = {digit: value for value, digit in enumerate(RANK_DIGITS)}
+
+def rank_between(before: Optional[str] = None, after: Optional[str] = None) -> str:
+    """Return a rank key strictly between two keys (None means open-ended)"""
+    before = before or ""
+    bounded = after is not None
+    digits = []
+    position = 0
+    while True:
+        low = _RANK_VALUES[before[position]] if position < len(before) else 0
+        high = _RANK_VALUES[after[position]] if bounded and position < len(after) else RANK_BASE
+        if high - low > 1:
+            digits.append(RANK_DIGITS[(low + high) // 2])
+            return "".join(digits)
+        digits.append(RANK_DIGITS[low])
+        if high > low:
+            bounded = False
+        position += 1
+
+def spaced_ranks(count: int) -> List[str]:
+    """Return count evenly spaced, ascending rank keys"""
+    width = 1
+    while RANK_BASE ** width <= count:
+        width += 1
+    step = RANK_BASE ** width // (count + 1)
+    ranks = []
+    for slot in range(1, count + 1):
+        value = slot * step
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, RANK_BASE)
+            digits.append(RANK_DIGITS[digit])
+        # Trailing zeros carry no value and would leave no room below the key
+        ranks.append("".join(reversed(digits)).rstrip(RANK_DIGITS[0]))
+    return ranks
+
+def longest_increasing_run(keys: List[Optional[str]]) -> set:
+    """Positions of a longest strictly increasing subsequence of keys, skipping None"""
+    tails = []
+    tail_positions = []
+    previous = {}
+    for position, key in enumerate(keys):
+        if key is None:
+            continue
+        slot = bisect_left(tails, key)
+        previous[position] = tail_positions[slot - 1] if slot else None
+        if slot == len(tails):
+            tails.append(key)
+            tail_positions.append(position)
+        else:
+            tails[slot] = key
+            tail_positions[slot] = position
+
+    kept = set()
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        kept.add(position)
+        position = previous[position]
+    return kept
+
+def order_activities(activities: List[dict]) -> List[dict]:
+    """Return activities in response order with dense per-day order_index values.
+
+    In rank mode the stored order_index is not maintained, so positions are
+    derived from the rank-sorted query result.
+    """
+    if ACTIVITY_ORDERING != "rank":
+        return activities
+    positions = defaultdict(int)
+    for activity in activities:
+        activity["order_index"] = positions[activity["day_id"]]
+        positions[activity["day_id"]] += 1
+    return sorted(activities, key=lambda activity: activity["order_index"])
 
 # Pydantic Models
+class GeoPoint(BaseModel):
+    """GeoJSON point, stored as is so the 2dsphere index can use it"""
+    type: str = Field("Point", pattern="^Point$")
+    coordinates: Tuple[Annotated[float, Field(ge=-180, le=180)], Annotated[float, Field(ge=-90, le=90)]]  # [lng, lat]
+
 class Activity(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     trip_id: str
@@ -74,12 +699,15 @@ class Activity(BaseModel):
     start_time: str  # Store as string "HH:MM"
     end_time: str    # Store as string "HH:MM"
     location_text: Optional[str] = None
+    location: Optional[GeoPoint] = None
     category: Optional[str] = "general"
     notes: Optional[str] = None
     cost: Optional[float] = 0.0
     priority: Optional[str] = "medium"
     color: Optional[str] = "#3b82f6"
     order_index: int = 0
+    rank: Optional[str] = None
+    revision: int = 0  # Bumped by every edit; Trip.version counts changes to the whole trip
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -88,6 +716,7 @@ class ActivityCreate(BaseModel):
     start_time: str
     end_time: str
     location_text: Optional[str] = None
+    location: Optional[GeoPoint] = None
     category: Optional[str] = "general"
     notes: Optional[str] = None
     cost: Optional[float] = 0.0
@@ -99,6 +728,7 @@ class ActivityUpdate(BaseModel):
     start_time: Optional[str] = None
     end_time: Optional[str] = None
     location_text: Optional[str] = None
+    location: Optional[GeoPoint] = None
     category: Optional[str] = None
     notes: Optional[str] = None
     cost: Optional[float] = None
@@ -106,6 +736,13 @@ class ActivityUpdate(BaseModel):
     color: Optional[str] = None
     day_id: Optional[str] = None
     order_index: Optional[int] = None
+    revision: Optional[int] = None  # Revision the edit was based on; a stale one is rejected
+
+class ActivityPatch(ActivityUpdate):
+    id: str
+
+class ActivityPatchRequest(BaseModel):
+    updates: List[ActivityPatch] = Field(..., max_length=PATCH_MAX_UPDATES)
 
 class Day(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -114,6 +751,7 @@ class Day(BaseModel):
     index: int  # Day 1, Day 2, etc.
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class DayCreate(BaseModel):
     date: str
@@ -127,6 +765,7 @@ class Trip(BaseModel):
     date_end: str    # Store as ISO date string
     currency: Optional[str] = "INR"
     theme: Optional[str] = "blue"
+    version: int = 0  # Bumped by every write to the trip's days or activities
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -142,6 +781,1784 @@ class TripWithDays(BaseModel):
     days: List[Day]
     activities: List[Activity]
 
+class ActivityOrderUpdate(BaseModel):
+    id: str
+    order_index: int
+    day_id: Optional[str] = None
+
+class ReorderRequest(BaseModel):
+    updates: List[ActivityOrderUpdate]
+
+# MongoDB serialization
+class ModelCodec:
+    """Conversions between a model and its MongoDB documents, worked out once per model.
+
+    Every field is stored as is: the models keep dates as ISO strings and
+    times as "HH:MM" strings, and datetimes go to BSON dates. Documents read
+    back were written by this service, so they are trusted instead of
+    validated again.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        fields = model.model_fields
+        self.projection = {"_id": 0, **{name: 1 for name in fields}}
+        self.defaults = {
+            name: field.default
+            for name, field in fields.items()
+            if not field.is_required() and field.default_factory is None
+        }
+
+    def to_mongo(self, data) -> dict:
+        """Document for a model instance, or for a partial dict of its fields"""
+        if isinstance(data, BaseModel):
+            data = data.model_dump()
+        return data
+
+    def document(self, document: dict) -> dict:
+        """Complete a stored document in place so it is ready to render as JSON"""
+        for name, value in self.defaults.items():
+            document.setdefault(name, value)
+        return document
+
+
+TRIP_CODEC = ModelCodec(Trip)
+DAY_CODEC = ModelCodec(Day)
+ACTIVITY_CODEC = ModelCodec(Activity)
+
+# Trip detail loader
+async def load_trip_details(trip_id: str) -> Optional[dict]:
+    """Fetch a trip with its days and activities as a JSON-ready TripWithDays dict.
+
+    The days and activities queries run concurrently and only fetch response
+    fields; the documents are trusted as written by this service instead of
+    re-validated. Returns None when the trip does not exist.
+    """
+    # Read the trip (and so its version) before its children: writers bump the
+    # version after writing, so the version can only ever lag the data
+    trip = await db.trips.find_one({"id": trip_id, **LIVE_TRIP}, TRIP_CODEC.projection)
+    if not trip:
+        return None
+
+    sort_key = "rank" if ACTIVITY_ORDERING == "rank" else "order_index"
+    days, activities = await asyncio.gather(
+        db.days.find({"trip_id": trip_id}, DAY_CODEC.projection).sort("index", 1).to_list(None),
+        db.activities.find({"trip_id": trip_id}, ACTIVITY_CODEC.projection).sort(sort_key, 1).to_list(None),
+    )
+
+    return {
+        "trip": TRIP_CODEC.document(trip),
+        "days": [DAY_CODEC.document(day) for day in days],
+        "activities": [ACTIVITY_CODEC.document(activity) for activity in order_activities(activities)],
+    }
+
+# Trip snapshot cache
+class SnapshotCache:
+    """Cache of serialized TripWithDays snapshots keyed by trip id.
+
+    reserve() hands out a token before a snapshot is loaded; set() drops the
+    snapshot if its key was invalidated in the meantime, so a slow read can
+    never re-cache data that a concurrent write already replaced. A fill that
+    takes longer than the TTL is dropped as well, which lets the per-key
+    invalidation records expire.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        """Return the (etag, body) pair cached for key, if any"""
+        return None
+
+    async def reserve(self, key: str):
+        return None
+
+    async def set(self, key: str, etag: str, body: bytes, token=None) -> None:
+        pass
+
+    async def delete(self, key: str) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": TRIP_CACHE_BACKEND, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class MemorySnapshotCache(SnapshotCache):
+    """Per-process LRU cache with a TTL and a bound on the total bytes held"""
+
+    def __init__(self, ttl: float, max_bytes: int):
+        super().__init__()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._invalidations = 0
+        # key -> (invalidation number, when), oldest first; kept for one TTL
+        self._generations = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < clock.monotonic():
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def _generation(self, key: str) -> int:
+        entry = self._generations.get(key)
+        return entry[0] if entry is not None else 0
+
+    async def reserve(self, key: str):
+        return self._generation(key), clock.monotonic()
+
+    async def set(self, key: str, etag: str, body: bytes, token=None) -> None:
+        if token is not None:
+            generation, reserved_at = token
+            if generation != self._generation(key) or clock.monotonic() - reserved_at > self.ttl:
+                return
+        if len(body) > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = (clock.monotonic() + self.ttl, etag, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        now = clock.monotonic()
+        self._invalidations += 1
+        self._generations.pop(key, None)
+        self._generations[key] = (self._invalidations, now)
+        # Any fill reserved before an older invalidation has outlived the TTL by now
+        while self._generations:
+            oldest, (_, invalidated_at) = next(iter(self._generations.items()))
+            if now - invalidated_at <= self.ttl:
+                break
+            del self._generations[oldest]
+        self._discard(key)
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({"entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes})
+        return stats
+
+
+# Stores the snapshot only if the key's generation is still the one reserved
+REDIS_SET_IF_CURRENT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return 1
+"""
+
+class RedisSnapshotCache(SnapshotCache):
+    """Cache shared by every worker; Redis expiry and maxmemory policy bound its size.
+
+    Every invalidation bumps a per-trip generation key, and set() only writes
+    when that generation still matches the reserved one, checked atomically
+    in a Lua script, so no worker can re-cache a snapshot another replaced.
+    """
+
+    def __init__(self, url: str, ttl: float):
+        super().__init__()
+        # Optional dependency, only needed when TRIP_CACHE_BACKEND=redis
+        import redis.asyncio as redis
+        self.ttl = ttl
+        self.redis = redis.from_url(url)
+        self._set_if_current = self.redis.register_script(REDIS_SET_IF_CURRENT)
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        value = await self.redis.get(f"tripflow:trip:{key}")
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, body = value.split(b"\n", 1)
+        return etag.decode(), body
+
+    async def reserve(self, key: str):
+        generation = await self.redis.get(f"tripflow:trip-generation:{key}")
+        return (generation or b"0").decode(), clock.monotonic()
+
+    async def set(self, key: str, etag: str, body: bytes, token=None) -> None:
+        value = etag.encode() + b"\n" + body
+        if token is None:
+            await self.redis.set(f"tripflow:trip:{key}", value, px=int(self.ttl * 1000))
+            return
+        generation, reserved_at = token
+        if clock.monotonic() - reserved_at > self.ttl:
+            return
+        await self._set_if_current(
+            keys=[f"tripflow:trip:{key}", f"tripflow:trip-generation:{key}"],
+            args=[generation, value, int(self.ttl * 1000)],
+        )
+
+    async def delete(self, key: str) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.incr(f"tripflow:trip-generation:{key}")
+            # Outlives any fill still allowed to complete
+            pipe.pexpire(f"tripflow:trip-generation:{key}", int(self.ttl * 2000))
+            pipe.delete(f"tripflow:trip:{key}")
+            await pipe.execute()
+
+def make_snapshot_cache() -> SnapshotCache:
+    if TRIP_CACHE_BACKEND == "memory":
+        return MemorySnapshotCache(TRIP_CACHE_TTL, TRIP_CACHE_MAX_BYTES)
+    if TRIP_CACHE_BACKEND == "redis":
+        return RedisSnapshotCache(REDIS_URL, TRIP_CACHE_TTL)
+    return SnapshotCache()
+
+
+trip_cache = make_snapshot_cache()
+
+# Change fan-out
+class Subscription:
+    """One listener's bounded queue of change events for a trip.
+
+    A listener that falls a full queue behind loses its backlog and gets a
+    single resync event instead, so a slow client never holds up a write or
+    grows memory; it catches up through /changes like any reconnecting client.
+    """
+
+    def __init__(self, hub: "ChangeHub", trip_id: str, size: int):
+        self.hub = hub
+        self.trip_id = trip_id
+        self.queue = asyncio.Queue(maxsize=size)
+
+    def offer(self, event: dict) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.hub.dropped += self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "trip_id": self.trip_id, "ids": []})
+            return False
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """The next event, or None once timeout seconds pass without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+class ChangeBroker:
+    """Carries change events to every worker's hub; this base only reaches its own process"""
+
+    def __init__(self):
+        self.deliver = None
+        self.resync = None  # Tells every subscriber to resync after events may have been missed
+
+    async def publish(self, event: dict) -> None:
+        self.deliver(event)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+class RedisChangeBroker(ChangeBroker):
+    """Relays events over a Redis channel so subscribers on any worker hear every write"""
+
+    channel = "tripflow:changes"
+
+    def __init__(self, url: str):
+        super().__init__()
+        # Optional dependency, only needed when CHANGE_BROKER=redis
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+        self._listener = None
+
+    async def publish(self, event: dict) -> None:
+        await self.redis.publish(self.channel, dump_json(event))
+
+    async def start(self) -> None:
+        # The first subscription is made here so that a worker without Redis fails to start
+        self._listener = asyncio.create_task(self._listen(await self._subscribe()))
+
+    async def _subscribe(self):
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        return pubsub
+
+    async def _listen(self, pubsub) -> None:
+        """Hand channel messages to the hub, resubscribing with backoff whenever the connection drops.
+
+        Events published while the subscription was down are lost, so once
+        it is back every subscriber is told to resync through /changes.
+        """
+        delay = CHANGE_BROKER_RETRY_SECONDS
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = await self._subscribe()
+                    logger.info("Change broker resubscribed to %s", self.channel)
+                    delay = CHANGE_BROKER_RETRY_SECONDS
+                    self.resync()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.deliver(orjson.loads(message["data"]))
+                logger.warning("Change broker subscription to %s ended; resubscribing in %.0f s", self.channel, delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change broker lost its Redis subscription; resubscribing in %.0f s", delay)
+            if pubsub is not None:
+                try:
+                    # aclose() is redis-py 5; older releases only have reset()
+                    await (pubsub.aclose() if hasattr(pubsub, "aclose") else pubsub.reset())
+                except Exception:
+                    pass  # The connection is already gone
+                pubsub = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CHANGE_BROKER_RETRY_MAX_SECONDS)
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+
+class ChangeHub:
+    """Per-trip subscriber registry; delivery never blocks the writer"""
+
+    def __init__(self, broker: ChangeBroker, queue_size: int):
+        self.broker = broker
+        self.broker.deliver = self.deliver
+        self.broker.resync = self.resync
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, trip_id: str) -> Subscription:
+        subscription = Subscription(self, trip_id, self.queue_size)
+        self.subscribers[trip_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        listeners = self.subscribers.get(subscription.trip_id)
+        if listeners is not None:
+            listeners.discard(subscription)
+            if not listeners:
+                del self.subscribers[subscription.trip_id]
+
+    async def publish(self, event: dict) -> None:
+        self.published += 1
+        await self.broker.publish(event)
+
+    def deliver(self, event: dict) -> None:
+        for subscription in list(self.subscribers.get(event["trip_id"], ())):
+            if subscription.offer(event):
+                self.delivered += 1
+
+    def resync(self) -> None:
+        for trip_id, listeners in list(self.subscribers.items()):
+            for subscription in list(listeners):
+                subscription.offer({"type": "resync", "trip_id": trip_id, "ids": []})
+
+    def stats(self) -> dict:
+        return {
+            "broker": CHANGE_BROKER,
+            "trips": len(self.subscribers),
+            "subscribers": sum(len(listeners) for listeners in self.subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+def make_change_broker() -> ChangeBroker:
+    if CHANGE_BROKER == "redis":
+        return RedisChangeBroker(REDIS_URL)
+    return ChangeBroker()
+
+
+change_hub = ChangeHub(make_change_broker(), SUBSCRIBER_QUEUE_SIZE)
+
+async def touch_trips(*trip_ids: str, change: str = "changed", ids: Optional[List[str]] = None) -> None:
+    """Record a write to these trips' days or activities.
+
+    Bumps each trip's version with $inc, drops the cached snapshots and tells
+    subscribers what changed. Called after the write itself, so a reader that
+    sees the new version always finds the new data.
+    """
+    trip_ids = list(set(trip_ids))
+    if not trip_ids:
+        return
+    await db.trips.update_many({"id": {"$in": trip_ids}}, {"$inc": {"version": 1}})
+    for trip_id in trip_ids:
+        await trip_cache.delete(trip_id)
+    await publish_changes(trip_ids, change, ids or [])
+
+async def publish_changes(trip_ids: List[str], change: str, ids: List[str]) -> None:
+    """Compact events only say what moved; subscribers pull the data through /changes"""
+    at = datetime.now(timezone.utc)
+    for trip_id in trip_ids:
+        try:
+            await change_hub.publish({"type": change, "trip_id": trip_id, "ids": ids, "at": at})
+        except Exception:
+            # The write has landed; subscribers still converge on their next sync
+            logger.exception("Could not publish %s for trip %s", change, trip_id)
+
+async def stream_trip_events(trip_id: str):
+    """Server-sent events for one trip, with a comment line as heartbeat"""
+    # Subscribing inside the generator ties cleanup to the response that streams it
+    subscription = change_hub.subscribe(trip_id)
+    try:
+        yield f"retry: {int(EVENT_HEARTBEAT_SECONDS * 1000)}\n\n".encode()
+        while True:
+            event = await subscription.get(EVENT_HEARTBEAT_SECONDS)
+            if event is None:
+                yield b": keep-alive\n\n"
+            else:
+                yield b"data: " + dump_json(event) + b"\n\n"
+    finally:
+        subscription.close()
+
+async def bump_trip_listing_version() -> None:
+    # Only trips being created or deleted change the listing; per-trip versions are left out of it
+    await db.counters.update_one({"_id": "trips"}, {"$inc": {"version": 1}}, upsert=True)
+
+def trip_etag(version: int) -> str:
+    return f'"trip-{version}"'
+
+def trip_listing_etag(version: int) -> str:
+    return f'"trips-{version}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the current entity tag"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+# Transactions
+async def run_transaction(work):
+    """Await work(session) inside a transaction when MONGO_TRANSACTIONS is on, else with no session"""
+    if not MONGO_TRANSACTIONS:
+        return await work(None)
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            return await work(session)
+
+# Trip deletion
+# Filter every read of a trip carries; a set deleted_at marks a tombstoned trip
+LIVE_TRIP = {"deleted_at": None}
+reaper_stats = {"trips_reaped": 0, "orphans_purged": 0}
+
+async def require_live_trip(trip_id: str) -> None:
+    if not await db.trips.find_one({"id": trip_id, **LIVE_TRIP}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+async def purge_children(trip_id: str, collection: str, extra: Optional[dict] = None, progress: bool = False) -> int:
+    """Delete a trip's documents from collection in batches of REAPER_BATCH_SIZE.
+
+    Each batch is a separate delete, so other requests interleave with a
+    large purge, and a crash leaves only fewer documents to purge next time.
+    """
+    scope = {"trip_id": trip_id, **(extra or {})}
+    purged = 0
+    while True:
+        batch = await db[collection].find(scope, {"_id": 1}).limit(REAPER_BATCH_SIZE).to_list(None)
+        if not batch:
+            return purged
+        result = await db[collection].delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+        purged += result.deleted_count
+        if progress:
+            await db.trips.update_one({"id": trip_id}, {"$inc": {f"purged.{collection}": result.deleted_count}})
+
+async def reap_trip(trip_id: str) -> None:
+    """Purge a tombstoned trip's activities, then its days, then the trip itself"""
+    for collection in ("activities", "days"):
+        await purge_children(trip_id, collection, progress=True)
+    await asyncio.gather(
+        db.rollups.delete_many({"trip_id": trip_id}),
+        db.tombstones.delete_many({"trip_id": trip_id}),
+    )
+    # Goes last, so an interrupted reap is picked up again by the next pass
+    result = await db.trips.delete_one({"id": trip_id, "deleted_at": {"$type": "date"}})
+    reaper_stats["trips_reaped"] += result.deleted_count
+
+async def sweep_orphans() -> int:
+    """Purge days and activities whose trip document is gone, as the old cascading delete could leave.
+
+    Imports write children before their trip, so only children older than
+    ORPHAN_GRACE_SECONDS are touched. The $sort + $group on trip_id walks
+    the trip_id index one key per trip (a DISTINCT_SCAN) rather than every
+    document, and the orphaned trip ids are streamed from a cursor instead
+    of being collected into one result.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ORPHAN_GRACE_SECONDS)
+    purged = 0
+    for collection in ("activities", "days"):
+        orphans = db[collection].aggregate([
+            {"$sort": {"trip_id": 1}},
+            {"$group": {"_id": "$trip_id", "trip_id": {"$first": "$trip_id"}}},
+            {"$lookup": {"from": "trips", "localField": "_id", "foreignField": "id", "as": "trip"}},
+            {"$match": {"trip": {"$size": 0}}},
+            {"$project": {"_id": 1}},
+        ], batchSize=REAPER_BATCH_SIZE)
+        async for orphan in orphans:
+            purged += await purge_children(orphan["_id"], collection, {"created_at": {"$lt": cutoff}})
+    reaper_stats["orphans_purged"] += purged
+    return purged
+
+async def reap_deleted_trips() -> None:
+    for trip in await db.trips.find({"deleted_at": {"$type": "date"}}, {"_id": 0, "id": 1}).to_list(None):
+        await reap_trip(trip["id"])
+
+async def reap_periodically() -> None:
+    while True:
+        try:
+            await reap_deleted_trips()
+        except Exception:
+            logger.exception("Trip reaper pass failed")
+        await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+
+async def sweep_orphans_periodically() -> None:
+    while True:
+        await asyncio.sleep(ORPHAN_SWEEP_SECONDS)
+        try:
+            orphans = await sweep_orphans()
+            if orphans:
+                logger.info("Purged %d orphaned days and activities", orphans)
+        except Exception:
+            logger.exception("Orphan sweep failed")
+
+# Trip provisioning
+def expand_trip_days(trip: Trip) -> List[Day]:
+    """One Day per calendar date from date_start to date_end inclusive"""
+    try:
+        start = date.fromisoformat(trip.date_start)
+        end = date.fromisoformat(trip.date_end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_start and date_end must be ISO dates")
+    count = (end - start).days + 1
+    if count < 1:
+        raise HTTPException(status_code=400, detail="date_end must not be before date_start")
+    if count > MAX_TRIP_DAYS:
+        raise HTTPException(status_code=400, detail=f"Trips are limited to {MAX_TRIP_DAYS} days")
+    return [
+        Day(trip_id=trip.id, date=(start + timedelta(days=offset)).isoformat(), index=offset + 1)
+        for offset in range(count)
+    ]
+
+async def provision_trip(trip: Trip, days: List[Day]) -> None:
+    """Write a trip and its days in one insert_many.
+
+    Without a transaction the days go in first: until the trip document
+    exists they belong to no visible trip, and if anything fails they are
+    removed again, so a failure never leaves a half-built trip behind.
+    """
+    async def write(session):
+        if days:
+            await db.days.insert_many([DAY_CODEC.to_mongo(day) for day in days], session=session)
+        await db.trips.insert_one(TRIP_CODEC.to_mongo(trip), session=session)
+
+    try:
+        await run_transaction(write)
+    except Exception:
+        if not MONGO_TRANSACTIONS:
+            await db.days.delete_many({"trip_id": trip.id})
+        raise
+    await bump_trip_listing_version()
+
+
+# Export
+EXPORT_CSV_COLUMNS = [
+    "day_index", "date", "order_index", "title", "start_time", "end_time",
+    "location_text", "category", "notes", "cost", "priority", "color",
+]
+
+async def iter_trip_activities(days: List[dict]):
+    """Yield a trip's activities one day at a time, in display order.
+
+    Each day is read through its own (day_id, order) index range, so at most
+    one day's activities are held in memory.
+    """
+    sort_key = "rank" if ACTIVITY_ORDERING == "rank" else "order_index"
+    for day in days:
+        activities = await db.activities.find(
+            {"day_id": day["id"]}, ACTIVITY_CODEC.projection
+        ).sort(sort_key, 1).to_list(None)
+        for position, activity in enumerate(activities):
+            activity["order_index"] = position
+        if activities:
+            yield activities
+
+async def export_ndjson(trip: dict, days: List[dict]):
+    yield dump_json({"type": "trip", **TRIP_CODEC.document(trip)}) + b"\n"
+    for day in days:
+        yield dump_json({"type": "day", **DAY_CODEC.document(dict(day))}) + b"\n"
+    async for day_activities in iter_trip_activities(days):
+        yield b"".join(
+            dump_json({"type": "activity", **ACTIVITY_CODEC.document(activity)}) + b"\n"
+            for activity in day_activities
+        )
+
+async def export_csv(trip: dict, days: List[dict]):
+    days_by_id = {day["id"]: day for day in days}
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    async for day_activities in iter_trip_activities(days):
+        for activity in day_activities:
+            day = days_by_id[activity["day_id"]]
+            writer.writerow({**activity, "day_index": day["index"], "date": day["date"]})
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def ics_escape(text: Optional[str]) -> str:
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def ics_line(line: str) -> str:
+    """Fold a content line at 75 octets as RFC 5545 requires"""
+    encoded = line.encode()
+    chunks = []
+    while len(encoded) > 75:
+        cut = 75 if not chunks else 74
+        # Never split a UTF-8 sequence
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+    chunks.append(encoded.decode())
+    return "\r\n ".join(chunks) + "\r\n"
+
+def parse_clock(value: Optional[str]) -> Optional[time]:
+    """Parse an activity's "HH:MM" (or "HH:MM:SS") time, None when it is not a time"""
+    for pattern in ('%H:%M', '%H:%M:%S'):
+        try:
+            return datetime.strptime(value or "", pattern).time()
+        except ValueError:
+            continue
+    return None
+
+def ics_event(activity: dict, day: dict) -> str:
+    start_clock = parse_clock(activity.get("start_time"))
+    end_clock = parse_clock(activity.get("end_time"))
+    try:
+        day_date = date.fromisoformat(day["date"])
+    except ValueError:
+        return ""
+    if start_clock is None:
+        return ""
+    start = datetime.combine(day_date, start_clock)
+    end = datetime.combine(day_date, end_clock) if end_clock is not None else start
+    if end < start:
+        # Ends after midnight
+        end += timedelta(days=1)
+    stamp = activity.get("updated_at") or datetime.now(timezone.utc)
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{activity['id']}@tripflow",
+        f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{start.strftime('%Y%m%dT%H%M%S')}",
+        f"DTEND:{end.strftime('%Y%m%dT%H%M%S')}",
+        f"SUMMARY:{ics_escape(activity.get('title'))}",
+    ]
+    if activity.get("location_text"):
+        lines.append(f"LOCATION:{ics_escape(activity['location_text'])}")
+    if activity.get("notes"):
+        lines.append(f"DESCRIPTION:{ics_escape(activity['notes'])}")
+    if activity.get("category"):
+        lines.append(f"CATEGORIES:{ics_escape(activity['category'])}")
+    lines.append("END:VEVENT")
+    return "".join(ics_line(line) for line in lines)
+
+async def export_ics(trip: dict, days: List[dict]):
+    days_by_id = {day["id"]: day for day in days}
+    header = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Tripflow//Trip Export//EN",
+              f"X-WR-CALNAME:{ics_escape(trip['title'])}"]
+    yield "".join(ics_line(line) for line in header).encode()
+    async for day_activities in iter_trip_activities(days):
+        yield "".join(ics_event(activity, days_by_id[activity["day_id"]]) for activity in day_activities).encode()
+    yield ics_line("END:VCALENDAR").encode()
+
+EXPORT_FORMATS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv"),
+    "ics": (export_ics, "text/calendar"),
+}
+
+# Import
+class ImportedDay(DayCreate):
+    id: str  # The source system's id, only used to attach activities
+
+class ImportedActivity(ActivityCreate):
+    day_id: str  # Source day id
+
+
+_IMPORTED_TRIPS = TypeAdapter(List[TripCreate])
+_IMPORTED_DAYS = TypeAdapter(List[ImportedDay])
+_IMPORTED_ACTIVITIES = TypeAdapter(List[ImportedActivity])
+
+async def iter_ndjson(request: Request):
+    """Yield (line number, record) pairs from a streamed NDJSON request body"""
+    pending = b""
+    line_number = 0
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if pending.strip():
+        yield line_number + 1, pending
+
+def validate_batch(adapter: TypeAdapter, batch: List[Tuple[int, dict]]) -> list:
+    """Validate a batch of records at once, reporting failures by input line"""
+    try:
+        return adapter.validate_python([record for _, record in batch])
+    except ValidationError as error:
+        problems = [
+            {"line": batch[issue["loc"][0]][0], "field": ".".join(str(part) for part in issue["loc"][1:]), "error": issue["msg"]}
+            for issue in error.errors()
+        ]
+        raise HTTPException(status_code=422, detail=problems)
+
+async def import_trip(request: Request) -> Tuple[Trip, int, int]:
+    """Create a trip from an NDJSON export: one trip record, then day records, then activity records.
+
+    Records are validated and written in batches of IMPORT_BATCH_SIZE with
+    fresh ids. The trip document is written last and children are removed
+    again if anything fails, so a broken import never shows up.
+    """
+    trip = None
+    day_ids = {}
+    positions = defaultdict(int)
+    pending_days, pending_activities = [], []
+    counts = {"days": 0, "activities": 0}
+
+    async def flush_days():
+        days = []
+        for imported in validate_batch(_IMPORTED_DAYS, pending_days):
+            day = Day(trip_id=trip.id, **imported.dict(exclude={"id"}))
+            day_ids[imported.id] = day.id
+            days.append(DAY_CODEC.to_mongo(day))
+        pending_days.clear()
+        if days:
+            await db.days.insert_many(days, ordered=False)
+            counts["days"] += len(days)
+
+    async def flush_activities():
+        activities = []
+        for (line, _), imported in zip(pending_activities, validate_batch(_IMPORTED_ACTIVITIES, pending_activities)):
+            if imported.day_id not in day_ids:
+                raise HTTPException(status_code=422, detail=[{"line": line, "field": "day_id", "error": "Unknown day"}])
+            day_id = day_ids[imported.day_id]
+            activity = Activity(trip_id=trip.id, day_id=day_id, order_index=positions[day_id], **imported.dict(exclude={"day_id"}))
+            positions[day_id] += 1
+            activities.append(ACTIVITY_CODEC.to_mongo(activity))
+        pending_activities.clear()
+        if activities:
+            await db.activities.insert_many(activities, ordered=False)
+            counts["activities"] += len(activities)
+
+    try:
+        async for line, raw in iter_ndjson(request):
+            try:
+                record = json.loads(raw)
+                kind = record.pop("type")
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise HTTPException(status_code=422, detail=[{"line": line, "error": "Expected a JSON object with a type"}])
+
+            if kind == "trip" and trip is None:
+                trip = Trip(**validate_batch(_IMPORTED_TRIPS, [(line, record)])[0].dict())
+            elif trip is None:
+                raise HTTPException(status_code=422, detail=[{"line": line, "error": "The first record must be the trip"}])
+            elif kind == "day":
+                pending_days.append((line, record))
+                if len(pending_days) >= IMPORT_BATCH_SIZE:
+                    await flush_days()
+            elif kind == "activity":
+                # Activities may only refer to days that have been written
+                await flush_days()
+                pending_activities.append((line, record))
+                if len(pending_activities) >= IMPORT_BATCH_SIZE:
+                    await flush_activities()
+            else:
+                raise HTTPException(status_code=422, detail=[{"line": line, "error": f"Unexpected {kind} record"}])
+
+        if trip is None:
+            raise HTTPException(status_code=422, detail="The import contains no trip record")
+        await flush_days()
+        await flush_activities()
+        if ACTIVITY_ORDERING == "rank":
+            await migrate_activity_ranks(trip.id)
+        await db.trips.insert_one(TRIP_CODEC.to_mongo(trip))
+    except Exception:
+        if trip is not None:
+            await db.activities.delete_many({"trip_id": trip.id})
+            await db.days.delete_many({"trip_id": trip.id})
+        raise
+
+    await bump_trip_listing_version()
+    return trip, counts["days"], counts["activities"]
+
+
+# Trip cloning and templates
+class TripCopy(BaseModel):
+    title: Optional[str] = None  # Defaults to the source's title
+    date_start: Optional[str] = None  # Every date moves by the same offset; defaults to the source's dates
+
+class TemplateCreate(BaseModel):
+    trip_id: str
+    name: str
+    description: Optional[str] = None
+
+
+ITINERARY_TRIP_PROJECTION = {"_id": 0, "title": 1, "date_start": 1, "date_end": 1, "currency": 1, "theme": 1}
+ITINERARY_DAY_PROJECTION = {"_id": 0, "id": 1, "date": 1, "index": 1, "notes": 1}
+ITINERARY_ACTIVITY_PROJECTION = {"_id": 0, "day_id": 1, **{name: 1 for name in ActivityCreate.model_fields}}
+TEMPLATE_SUMMARY_PROJECTION = {"_id": 0, "snapshot": 0}
+
+template_cache = MemorySnapshotCache(TEMPLATE_CACHE_TTL, TEMPLATE_CACHE_MAX_BYTES)
+
+async def load_itinerary(trip_id: str) -> Optional[dict]:
+    """A live trip's copyable content: trip settings, days, and activities in display order"""
+    trip = await db.trips.find_one({"id": trip_id, **LIVE_TRIP}, ITINERARY_TRIP_PROJECTION)
+    if trip is None:
+        return None
+    sort_key = "rank" if ACTIVITY_ORDERING == "rank" else "order_index"
+    days, activities = await asyncio.gather(
+        db.days.find({"trip_id": trip_id}, ITINERARY_DAY_PROJECTION).sort("index", ASCENDING).to_list(None),
+        db.activities.find({"trip_id": trip_id}, ITINERARY_ACTIVITY_PROJECTION).sort(sort_key, ASCENDING).to_list(None),
+    )
+    return {"trip": trip, "days": days, "activities": activities}
+
+def copy_itinerary(itinerary: dict, copy: TripCopy) -> Tuple[Trip, List[dict], List[dict]]:
+    """New trip, day and activity documents for an itinerary, with fresh ids and shifted dates.
+
+    Activities keep their order but get compact positions (and rank keys in
+    rank mode) per day, whatever gaps the source had built up.
+    """
+    source = itinerary["trip"]
+    try:
+        offset = date.fromisoformat(copy.date_start) - date.fromisoformat(source["date_start"]) if copy.date_start else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_start must be an ISO date")
+
+    def shift(value: str) -> str:
+        return (date.fromisoformat(value) + offset).isoformat() if offset else value
+
+    trip = Trip(
+        title=copy.title or source["title"], date_start=shift(source["date_start"]), date_end=shift(source["date_end"]),
+        currency=source.get("currency", "INR"), theme=source.get("theme", "blue"),
+    )
+    day_ids = {}
+    days = []
+    for source_day in itinerary["days"]:
+        day = Day(trip_id=trip.id, date=shift(source_day["date"]), index=source_day["index"], notes=source_day.get("notes"))
+        day_ids[source_day["id"]] = day.id
+        days.append(DAY_CODEC.to_mongo(day))
+
+    by_day = defaultdict(list)
+    for source_activity in itinerary["activities"]:
+        # Activities of days the trip no longer has stay behind
+        if source_activity["day_id"] in day_ids:
+            by_day[day_ids[source_activity["day_id"]]].append(source_activity)
+    activities = []
+    for day_id, day_activities in by_day.items():
+        ranks = spaced_ranks(len(day_activities)) if ACTIVITY_ORDERING == "rank" else [None] * len(day_activities)
+        for position, (source_activity, rank) in enumerate(zip(day_activities, ranks)):
+            fields = {name: value for name, value in source_activity.items() if name != "day_id"}
+            activity = Activity(trip_id=trip.id, day_id=day_id, order_index=position, rank=rank, **fields)
+            activities.append(ACTIVITY_CODEC.to_mongo(activity))
+    return trip, days, activities
+
+async def write_itinerary(trip: Trip, days: List[dict], activities: List[dict]) -> None:
+    """Insert a copied trip with one insert_many per collection.
+
+    As in provision_trip the trip document goes last, so without a
+    transaction a failed copy is never visible; its children are removed.
+    """
+    async def write(session):
+        if days:
+            await db.days.insert_many(days, session=session)
+        if activities:
+            await db.activities.insert_many(activities, session=session)
+        await db.trips.insert_one(TRIP_CODEC.to_mongo(trip), session=session)
+
+    try:
+        await run_transaction(write)
+    except Exception:
+        if not MONGO_TRANSACTIONS:
+            await asyncio.gather(
+                db.activities.delete_many({"trip_id": trip.id}),
+                db.days.delete_many({"trip_id": trip.id}),
+            )
+        raise
+    await bump_trip_listing_version()
+    await reconcile_rollups(trip.id)
+
+async def instantiate_itinerary(itinerary: dict, copy: TripCopy) -> dict:
+    trip, days, activities = copy_itinerary(itinerary, copy)
+    await write_itinerary(trip, days, activities)
+    return {"trip": trip, "days": len(days), "activities": len(activities)}
+
+async def load_template(template_id: str) -> Optional[bytes]:
+    """A template document serialized as JSON, from the cache when this worker has used it recently"""
+    cached = await template_cache.get(template_id)
+    if cached is not None:
+        return cached[1]
+    template = await db.templates.find_one({"id": template_id}, {"_id": 0})
+    if template is None:
+        return None
+    body = dump_json(template)
+    await template_cache.set(template_id, template_id, body)
+    return body
+
+
+# Trip listing
+TRIP_LISTING_ORDER = [("created_at", DESCENDING), ("id", DESCENDING)]
+TRIP_LISTING_PROJECTION = {name: value for name, value in TRIP_CODEC.projection.items() if name != "version"}
+
+def listed_trip(trip: dict) -> dict:
+    """A trip as the listing renders it, without the version that days and activities move on"""
+    document = TRIP_CODEC.document(trip)
+    del document["version"]
+    return document
+
+def encode_listing_cursor(trip: dict) -> str:
+    """Keyset cursor pointing just past this trip in listing order"""
+    key = json.dumps([trip["created_at"].isoformat(), trip["id"]])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def listing_filter(cursor: Optional[str]) -> dict:
+    """Filter selecting the trips after a keyset cursor (newest first, ties broken by id)"""
+    if not cursor:
+        return {}
+    try:
+        created_at, trip_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": trip_id}},
+    ]}
+
+
+# Activity search, backed by the activities text index
+SEARCH_FILTERS = ("trip_id", "category", "priority")
+
+def encode_search_cursor(result: dict) -> str:
+    """Keyset cursor pointing just past this result in relevance order"""
+    key = json.dumps([result["score"], result["id"]])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def search_pipeline(query: str, filters: dict, cursor: Optional[str], limit: int) -> List[dict]:
+    """Matches ranked by text score, best first with ties broken by id, starting after the cursor.
+
+    $text is answered from the index, so the work grows with the number of
+    matches rather than with the number of activities stored.
+    """
+    pipeline = [
+        {"$match": {"$text": {"$search": query}, **filters}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        try:
+            score, activity_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            score = float(score)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "id": {"$gt": activity_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"score": -1, "id": 1}},
+        {"$limit": limit},
+        {"$project": {**ACTIVITY_CODEC.projection, "score": 1}},
+    ]
+    return pipeline
+
+async def stream_trips(cursor: Optional[str], limit: Optional[int]):
+    """Yield trips as NDJSON lines straight off the Motor cursor"""
+    trips = db.trips.find({**listing_filter(cursor), **LIVE_TRIP}, TRIP_LISTING_PROJECTION)
+    trips = trips.sort(TRIP_LISTING_ORDER).batch_size(500)
+    if limit:
+        trips = trips.limit(limit)
+    async for trip in trips:
+        yield dump_json(listed_trip(trip)) + b"\n"
+
+# Delta sync
+def sync_cursor(version: int, moment: datetime) -> str:
+    """Opaque cursor: the trip version plus the server time the changes were read at"""
+    return f"{version}.{int(moment.timestamp() * 1000)}"
+
+def parse_sync_cursor(cursor: Optional[str]) -> Optional[Tuple[int, datetime]]:
+    try:
+        version, millis = cursor.split(".")
+        return int(version), datetime.fromtimestamp(int(millis) / 1000, timezone.utc)
+    except (AttributeError, ValueError, OverflowError, OSError):
+        return None
+
+async def record_tombstones(trip_id: str, kind: str, ids: List[str]) -> None:
+    """Remember deletions ("days" or "activities") so delta sync can report them until they expire"""
+    now = datetime.now(timezone.utc)
+    if ids:
+        await db.tombstones.insert_many(
+            [{"trip_id": trip_id, "kind": kind, "id": deleted_id, "deleted_at": now} for deleted_id in ids]
+        )
+
+async def load_trip_changes(trip_id: str, since: Optional[str]) -> Optional[dict]:
+    """Days and activities upserted or deleted since a cursor, or a full snapshot.
+
+    Changes are found through updated_at and tombstones. The window starts
+    SYNC_LOOKBACK_SECONDS before the cursor so a write stamped just before the
+    previous read but landing after it is still delivered; clients apply
+    upserts and deletions idempotently. Returns None when the trip does not exist.
+    """
+    read_at = datetime.now(timezone.utc)
+    trip = await db.trips.find_one({"id": trip_id, **LIVE_TRIP}, TRIP_CODEC.projection)
+    if not trip:
+        return None
+    version = trip.get("version", 0)
+    cursor = sync_cursor(version, read_at)
+
+    parsed = parse_sync_cursor(since)
+    if parsed is None or parsed[1] < read_at - timedelta(seconds=SYNC_TOMBSTONE_TTL):
+        details = await load_trip_details(trip_id)
+        if details is None:
+            return None
+        details.update({"cursor": cursor, "full": True, "deleted": {"days": [], "activities": []}})
+        return details
+
+    since_version, since_at = parsed
+    changes = {
+        "cursor": cursor,
+        "full": False,
+        "trip": TRIP_CODEC.document(trip),
+        "days": [],
+        "activities": [],
+        "deleted": {"days": [], "activities": []},
+    }
+    if since_version == version:
+        # Versions are bumped after every write lands, so nothing has changed
+        return changes
+
+    window = {"trip_id": trip_id, "updated_at": {"$gte": since_at - timedelta(seconds=SYNC_LOOKBACK_SECONDS)}}
+    days, activities, tombstones = await asyncio.gather(
+        db.days.find(window, DAY_CODEC.projection).sort("index", 1).to_list(None),
+        db.activities.find(window, ACTIVITY_CODEC.projection).to_list(None),
+        db.tombstones.find(
+            {"trip_id": trip_id, "deleted_at": window["updated_at"]}, {"_id": 0, "kind": 1, "id": 1}
+        ).to_list(None),
+    )
+
+    if ACTIVITY_ORDERING == "rank" and activities:
+        # Positions are derived from rank keys, so report them for every touched day
+        touched = await db.activities.find(
+            {"day_id": {"$in": list({activity["day_id"] for activity in activities})}},
+            {"_id": 0, "id": 1, "day_id": 1},
+        ).sort("rank", 1).to_list(None)
+        positions = {activity["id"]: activity["order_index"] for activity in order_activities(touched)}
+        changes["positions"] = positions
+        for activity in activities:
+            activity["order_index"] = positions.get(activity["id"], activity.get("order_index", 0))
+
+    changes["days"] = [DAY_CODEC.document(day) for day in days]
+    changes["activities"] = [ACTIVITY_CODEC.document(activity) for activity in activities]
+    upserted = {document["id"] for document in days + activities}
+    for tombstone in tombstones:
+        # A deleted id that shows up as upserted was never really gone (ids are never reused)
+        if tombstone["id"] not in upserted:
+            changes["deleted"][tombstone["kind"]].append(tombstone["id"])
+    return changes
+
+# Schedule conflicts
+MINUTES_PER_DAY = 24 * 60
+SCHEDULE_FIELDS = ("day_id", "start_time", "end_time")
+
+def day_number(day: dict) -> int:
+    """Position of a day on the trip timeline; consecutive dates get consecutive numbers"""
+    try:
+        return date.fromisoformat(day["date"]).toordinal()
+    except (KeyError, TypeError, ValueError):
+        return day.get("index", 0)
+
+def activity_interval(activity: dict, day_start: int) -> Optional[Tuple[int, int]]:
+    """Minutes of the trip timeline an activity occupies, as a half-open interval.
+
+    An end time earlier than the start time runs past midnight into the next
+    day, so 23:00-01:00 overlaps an activity at 00:30 the day after.
+    """
+    start, end = parse_clock(activity.get("start_time")), parse_clock(activity.get("end_time"))
+    if start is None or end is None:
+        return None
+    start_minute = start.hour * 60 + start.minute
+    end_minute = end.hour * 60 + end.minute
+    if end_minute < start_minute:
+        end_minute += MINUTES_PER_DAY
+    return day_start + start_minute, day_start + end_minute
+
+def trip_timeline(days: List[dict], activities: List[dict]) -> List[Tuple[int, int, str]]:
+    day_starts = {day["id"]: day_number(day) * MINUTES_PER_DAY for day in days}
+    intervals = []
+    for activity in activities:
+        day_start = day_starts.get(activity.get("day_id"))
+        interval = activity_interval(activity, day_start) if day_start is not None else None
+        if interval is not None:
+            intervals.append((interval[0], interval[1], activity["id"]))
+    return intervals
+
+def find_overlaps(intervals: List[Tuple[int, int, str]]) -> List[Tuple[str, str, int]]:
+    """Every overlapping pair with its overlap in minutes, in O(n log n + k) for k pairs.
+
+    Intervals are swept by start time while the ones still running sit in a
+    heap keyed by end time; whatever is left in the heap when an interval
+    starts overlaps it, so each pair is found exactly once.
+    """
+    running = []
+    pairs = []
+    for start, end, item in sorted(intervals):
+        if end <= start:
+            continue
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        pairs.extend((other, item, min(end, other_end) - start) for other_end, other in running)
+        heapq.heappush(running, (end, item))
+    return pairs
+
+def describe_conflicts(pairs: List[Tuple[str, str, int]], activities: List[dict]) -> List[dict]:
+    by_id = {activity["id"]: activity for activity in activities}
+    return [
+        {
+            "ids": [first, second],
+            "titles": [by_id[first].get("title"), by_id[second].get("title")],
+            "day_ids": [by_id[first]["day_id"], by_id[second]["day_id"]],
+            "overlap_minutes": minutes,
+        }
+        for first, second, minutes in pairs
+    ]
+
+async def load_schedule(trip_id: str) -> Tuple[List[dict], List[dict]]:
+    """Just the fields the conflict engine needs for a trip's days and activities"""
+    days, activities = await asyncio.gather(
+        db.days.find({"trip_id": trip_id}, {"_id": 0, "id": 1, "date": 1, "index": 1}).to_list(None),
+        db.activities.find(
+            {"trip_id": trip_id}, {"_id": 0, "id": 1, "day_id": 1, "title": 1, "start_time": 1, "end_time": 1}
+        ).to_list(None),
+    )
+    return days, activities
+
+def schedule_changes(update: BaseModel) -> dict:
+    """The fields of a create, edit or move that decide when an activity happens"""
+    return {name: getattr(update, name) for name in SCHEDULE_FIELDS if getattr(update, name, None) is not None}
+
+async def ensure_schedule_fits(trip_id: str, changed: Dict[str, dict]) -> None:
+    """Refuse a write with 409 when CONFLICT_CHECK=reject and it would create new overlaps.
+
+    changed maps activity ids, new ones included, to the schedule fields the
+    write sets. Overlaps the trip already had do not block unrelated writes.
+    The check reads before the write, so two racing writes can still overlap;
+    /conflicts reports any that do.
+    """
+    if CONFLICT_CHECK != "reject" or not changed:
+        return
+    days, stored = await load_schedule(trip_id)
+    planned = [{**activity, **changed.get(activity["id"], {})} for activity in stored]
+    stored_ids = {activity["id"] for activity in stored}
+    planned += [{"id": activity_id, **fields} for activity_id, fields in changed.items() if activity_id not in stored_ids]
+
+    existing = {frozenset(pair[:2]) for pair in find_overlaps(trip_timeline(days, stored))}
+    introduced = [pair for pair in find_overlaps(trip_timeline(days, planned)) if frozenset(pair[:2]) not in existing]
+    if introduced:
+        raise HTTPException(status_code=409, detail={
+            "message": "Activities would overlap",
+            "conflicts": describe_conflicts(introduced, planned),
+        })
+
+async def ensure_edits_fit(changed: Dict[str, dict]) -> None:
+    """ensure_schedule_fits for edits addressed by activity id alone"""
+    if CONFLICT_CHECK != "reject" or not changed:
+        return
+    by_trip = defaultdict(dict)
+    for activity in await db.activities.find(
+        {"id": {"$in": list(changed)}}, {"_id": 0, "id": 1, "trip_id": 1}
+    ).to_list(None):
+        by_trip[activity["trip_id"]][activity["id"]] = changed[activity["id"]]
+    for trip_id, trip_changes in by_trip.items():
+        await ensure_schedule_fits(trip_id, trip_changes)
+
+# Budget rollups: cost sums and activity counts per trip, day and category,
+# one document per (trip_id, scope, key), kept current with $inc deltas
+BUDGET_FIELDS = ("cost", "day_id", "category")
+BUDGET_PROJECTION = {"_id": 0, "id": 1, "trip_id": 1, "day_id": 1, "cost": 1, "category": 1}
+ROLLUP_TOLERANCE = 1e-6
+
+def budget_keys(activity: dict) -> List[Tuple[str, str]]:
+    trip_id = activity["trip_id"]
+    return [("trip", trip_id), ("day", activity["day_id"]), ("category", activity.get("category") or "general")]
+
+async def update_budget(changes: List[Tuple[Optional[dict], Optional[dict]]]) -> None:
+    """Fold (before, after) activity states into the rollups with $inc, in one bulk_write.
+
+    None stands for an activity that does not exist on that side, so creates
+    are (None, activity) and deletes (activity, None).
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for before, after in changes:
+        for activity, sign in ((before, -1), (after, 1)):
+            if activity is None:
+                continue
+            for scope, key in budget_keys(activity):
+                delta = deltas[(activity["trip_id"], scope, key)]
+                delta[0] += (activity.get("cost") or 0.0) * sign
+                delta[1] += sign
+
+    operations = [
+        UpdateOne({"trip_id": trip_id, "scope": scope, "key": key}, {"$inc": {"total": total, "count": count}}, upsert=True)
+        for (trip_id, scope, key), (total, count) in deltas.items()
+        if total or count
+    ]
+    if operations:
+        await db.rollups.bulk_write(operations, ordered=False)
+
+async def compute_rollups(trip_id: Optional[str] = None) -> Dict[Tuple[str, str, str], Tuple[float, int]]:
+    """Rollups recomputed from the activities themselves with one aggregation"""
+    pipeline = [
+        {"$match": {"trip_id": trip_id} if trip_id is not None else {}},
+        {"$group": {
+            "_id": {"trip_id": "$trip_id", "day_id": "$day_id", "category": {"$ifNull": ["$category", "general"]}},
+            "total": {"$sum": {"$ifNull": ["$cost", 0]}},
+            "count": {"$sum": 1},
+        }},
+    ]
+    rollups = defaultdict(lambda: [0.0, 0])
+    async for group in db.activities.aggregate(pipeline):
+        keys = group["_id"]
+        for scope, key in budget_keys(keys):
+            rollup = rollups[(keys["trip_id"], scope, key)]
+            rollup[0] += group["total"]
+            rollup[1] += group["count"]
+    return {key: (total, count) for key, (total, count) in rollups.items()}
+
+async def reconcile_rollups(trip_id: Optional[str] = None, repair: bool = True) -> List[dict]:
+    """Compare the rollups with a fresh aggregation, returning (and by default repairing) any drift.
+
+    Each repair is a compare-and-set on the total and count that were read,
+    so the job never blocks writers and a correction that races a write's
+    $inc misses instead of counting that write twice. Missed corrections
+    are logged and left for the next pass. Only a write whose activity is
+    already visible to the aggregation but whose $inc lands after the
+    correction can still slip through.
+    """
+    scope = {"trip_id": trip_id} if trip_id is not None else {}
+    stored = {
+        (rollup["trip_id"], rollup["scope"], rollup["key"]): (rollup.get("total", 0.0), rollup.get("count", 0))
+        for rollup in await db.rollups.find(scope, {"_id": 0}).to_list(None)
+    }
+    expected = await compute_rollups(trip_id)
+
+    drift = []
+    operations = []
+    for key in expected.keys() | stored.keys():
+        want = expected.get(key, (0.0, 0))
+        have = stored.get(key, (0.0, 0))
+        selector = dict(zip(("trip_id", "scope", "key"), key))
+        unchanged = {**selector, "total": have[0], "count": have[1]}
+        if abs(want[0] - have[0]) > ROLLUP_TOLERANCE or want[1] != have[1]:
+            drift.append((*key, want, have))
+        if key not in expected:
+            # Nothing is left to count under this key
+            operations.append(DeleteOne(unchanged))
+        elif drift and drift[-1][:3] == key:
+            if key in stored:
+                operations.append(UpdateOne(unchanged, {"$set": {"total": want[0], "count": want[1]}}))
+            else:
+                # A write that creates the rollup first wins; its $inc already counts it
+                operations.append(UpdateOne(
+                    selector, {"$setOnInsert": {"total": want[0], "count": want[1]}}, upsert=True
+                ))
+
+    if repair and operations:
+        try:
+            result = (await db.rollups.bulk_write(operations, ordered=False)).bulk_api_result
+        except BulkWriteError as error:
+            # Concurrent upserts of the same key lose on the unique index
+            result = error.details
+        applied = result["nModified"] + result["nUpserted"] + result["nRemoved"]
+        if applied < len(operations):
+            logger.warning("%d budget rollup corrections raced a write and were skipped",
+                           len(operations) - applied)
+    return [
+        {"trip_id": trip_id, "scope": scope, "key": key,
+         "expected": {"total": want[0], "count": want[1]}, "stored": {"total": have[0], "count": have[1]}}
+        for trip_id, scope, key, want, have in drift
+    ]
+
+async def reconcile_rollups_periodically() -> None:
+    while True:
+        await asyncio.sleep(ROLLUP_RECONCILE_SECONDS)
+        try:
+            drift = await reconcile_rollups()
+            if drift:
+                logger.warning("Repaired %d drifted budget rollups", len(drift))
+        except Exception:
+            logger.exception("Budget rollup reconciliation failed")
+
+async def budget_summary(limit: int) -> dict:
+    """Totals per currency and category over every trip, and the costliest trips, from the rollups alone"""
+    pipeline = [
+        {"$match": {"scope": {"$in": ["trip", "category"]}, "count": {"$gt": 0}}},
+        {"$lookup": {"from": "trips", "localField": "trip_id", "foreignField": "id", "as": "trip"}},
+        {"$unwind": "$trip"},
+        {"$match": {"trip.deleted_at": None}},
+        {"$facet": {
+            "currencies": [
+                {"$match": {"scope": "trip"}},
+                {"$group": {"_id": "$trip.currency", "total": {"$sum": "$total"},
+                            "activities": {"$sum": "$count"}, "trips": {"$sum": 1}}},
+                {"$sort": {"total": -1}},
+            ],
+            "categories": [
+                {"$match": {"scope": "category"}},
+                {"$group": {"_id": {"currency": "$trip.currency", "category": "$key"},
+                            "total": {"$sum": "$total"}, "activities": {"$sum": "$count"}}},
+                {"$sort": {"total": -1}},
+            ],
+            "trips": [
+                {"$match": {"scope": "trip"}},
+                {"$sort": {"total": -1}},
+                {"$limit": limit},
+            ],
+        }},
+    ]
+    facets = (await db.rollups.aggregate(pipeline).to_list(1))[0]
+    return {
+        "currencies": [
+            {"currency": group["_id"], "total": group["total"], "activities": group["activities"], "trips": group["trips"]}
+            for group in facets["currencies"]
+        ],
+        "categories": [
+            {**group["_id"], "total": group["total"], "activities": group["activities"]}
+            for group in facets["categories"]
+        ],
+        "trips": [
+            {"trip_id": rollup["trip_id"], "title": rollup["trip"].get("title"), "currency": rollup["trip"].get("currency"),
+             "total": rollup["total"], "activities": rollup["count"]}
+            for rollup in facets["trips"]
+        ],
+    }
+
+# Day route optimizer (the solver itself lives in routing.py)
+def propose_route(activities: List[dict]) -> dict:
+    """solve_route for a day's activities, with their time windows taken from start and end times"""
+    return solve_route(activities, [activity_interval(activity, 0) for activity in activities], ROUTE_SPEED_KMH)
+
+async def load_day_stops(trip_id: str, day_id: str) -> List[dict]:
+    """A day's activities in their current order, with what the route optimizer needs"""
+    await require_live_trip(trip_id)
+    sort_key = "rank" if ACTIVITY_ORDERING == "rank" else "order_index"
+    day, activities = await asyncio.gather(
+        db.days.find_one({"id": day_id, "trip_id": trip_id}, {"_id": 1}),
+        db.activities.find(
+            {"trip_id": trip_id, "day_id": day_id},
+            {"_id": 0, "id": 1, "day_id": 1, "title": 1, "start_time": 1, "end_time": 1, "location": 1, "order_index": 1},
+        ).sort(sort_key, 1).to_list(None),
+    )
+    if day is None:
+        raise HTTPException(status_code=404, detail="Day not found")
+    return order_activities(activities)
+
+# Optimistic concurrency for activity edits
+def revision_guard(revision: Optional[int]) -> dict:
+    """Filter that only matches an activity still at the revision an edit was based on"""
+    if revision is None:
+        return {}
+    if revision == 0:
+        # Activities stored before revisions existed are at revision 0
+        return {"revision": {"$in": [0, None]}}
+    return {"revision": revision}
+
+def activity_changes(update: ActivityUpdate, now: datetime, rank: Optional[str] = None) -> dict:
+    """Update document for a partial edit; every edit moves the revision on by one"""
+    changes = {k: v for k, v in update.dict(exclude={"id", "revision"}).items() if v is not None}
+    changes["updated_at"] = now
+    if rank is not None:
+        changes["rank"] = rank
+    return {"$set": ACTIVITY_CODEC.to_mongo(changes), "$inc": {"revision": 1}}
+
+async def ranks_for_moves(moves: Dict[str, str], background_tasks: Optional[BackgroundTasks] = None) -> Dict[str, str]:
+    """Rank keys that append activities to the days an edit moves them into.
+
+    moves maps activity ids to their new day; activities moving into the
+    same day are appended in the order given. Empty unless in rank mode.
+    """
+    if ACTIVITY_ORDERING != "rank":
+        return {}
+    last_ranks = {}
+    ranks = {}
+    for activity_id, day_id in moves.items():
+        if day_id not in last_ranks:
+            last_activity = await db.activities.find_one({"day_id": day_id}, {"_id": 0, "rank": 1}, sort=[("rank", -1)])
+            last_ranks[day_id] = last_activity.get("rank") if last_activity else None
+        ranks[activity_id] = last_ranks[day_id] = rank_between(last_ranks[day_id])
+        if len(ranks[activity_id]) > MAX_RANK_LENGTH and background_tasks is not None:
+            background_tasks.add_task(rebalance_day_ranks, day_id)
+    return ranks
+
+async def ensure_trip_days(trip_id: str, day_ids: List[str]) -> None:
+    """Reject day ids that do not belong to the trip"""
+    if not day_ids:
+        return
+    known = {
+        day["id"] for day in await db.days.find(
+            {"id": {"$in": day_ids}, "trip_id": trip_id}, {"_id": 0, "id": 1}
+        ).to_list(None)
+    }
+    unknown = sorted(set(day_ids) - known)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Days not found in trip: {', '.join(unknown)}")
+
+async def patch_activities(trip_id: str, patches: List[ActivityPatch],
+                           background_tasks: Optional[BackgroundTasks] = None) -> Tuple[List[dict], List[dict], List[str]]:
+    """Apply partial edits to a trip's activities, each one a guarded find_one_and_update.
+
+    Returns the post-images of the edits that landed, the current state of
+    the activities whose edits were stale, and the ids that were not found.
+    Up to PATCH_CONCURRENCY edits run at once; each write's own result
+    says whether it landed, and its pre-image is what the rollups need.
+    """
+    now = datetime.now(timezone.utc)
+    in_flight = asyncio.Semaphore(PATCH_CONCURRENCY)
+    ranks = {}
+    if ACTIVITY_ORDERING == "rank" and any(patch.day_id for patch in patches):
+        # Activities moved to another day go to its end instead of keeping a rank from the day they left
+        current_days = {
+            activity["id"]: activity["day_id"]
+            for activity in await db.activities.find(
+                {"id": {"$in": [patch.id for patch in patches if patch.day_id]}, "trip_id": trip_id},
+                {"_id": 0, "id": 1, "day_id": 1},
+            ).to_list(None)
+        }
+        ranks = await ranks_for_moves({
+            patch.id: patch.day_id for patch in patches
+            if patch.day_id and patch.id in current_days and current_days[patch.id] != patch.day_id
+        }, background_tasks)
+
+    async def apply(patch: ActivityPatch) -> Optional[Tuple[dict, dict]]:
+        changes = activity_changes(patch, now, ranks.get(patch.id))
+        async with in_flight:
+            previous = await db.activities.find_one_and_update(
+                {"id": patch.id, "trip_id": trip_id, **revision_guard(patch.revision)},
+                changes,
+                projection=ACTIVITY_CODEC.projection,
+                return_document=ReturnDocument.BEFORE,
+            )
+        if previous is None:
+            return None
+        return previous, {**previous, **changes["$set"], "revision": previous.get("revision", 0) + 1}
+
+    results = await asyncio.gather(*(apply(patch) for patch in patches))
+    landed = [result for result in results if result is not None]
+    rejected = [patch.id for patch, result in zip(patches, results) if result is None]
+    current = {
+        activity["id"]: activity
+        for activity in await db.activities.find(
+            {"id": {"$in": rejected}, "trip_id": trip_id}, ACTIVITY_CODEC.projection
+        ).to_list(None)
+    } if rejected else {}
+
+    updated = [after for _, after in landed]
+    conflicts = [current[activity_id] for activity_id in rejected if activity_id in current]
+    missing = [activity_id for activity_id in rejected if activity_id not in current]
+    if landed:
+        await update_budget(landed)
+        await touch_trips(trip_id, change="activities.updated", ids=[activity["id"] for activity in updated])
+    return updated, conflicts, missing
+
+# Reorder engine
+async def _reorder_dense(updates: List[ActivityOrderUpdate], trip_id: Optional[str]) -> int:
+    """Diff the requested positions against the stored order_index values"""
+    scope = {"id": {"$in": [update.id for update in updates]}}
+    if trip_id is not None:
+        scope["trip_id"] = trip_id
+
+    stored = {
+        activity["id"]: activity
+        for activity in await db.activities.find(
+            scope, {**BUDGET_PROJECTION, "order_index": 1}
+        ).to_list(None)
+    }
+
+    if trip_id is not None:
+        missing = [update.id for update in updates if update.id not in stored]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Activities not found in trip: {', '.join(missing)}")
+
+    now = datetime.now(timezone.utc)
+    operations = []
+    moved = []
+    day_moves = []
+    for update in updates:
+        current = stored.get(update.id)
+        if current is None:
+            continue
+
+        changes = {}
+        if update.order_index != current.get("order_index"):
+            changes["order_index"] = update.order_index
+        if update.day_id and update.day_id != current.get("day_id"):
+            changes["day_id"] = update.day_id
+            day_moves.append((current, {**current, "day_id": update.day_id}))
+        if not changes:
+            continue
+
+        changes["updated_at"] = now
+        operations.append(UpdateOne({"id": update.id}, {"$set": changes, "$inc": {"revision": 1}}))
+        moved.append(update.id)
+
+    if operations:
+        await db.activities.bulk_write(operations, ordered=False)
+        await update_budget(day_moves)
+        await touch_trips(*(activity["trip_id"] for activity in stored.values()),
+                          change="activities.reordered", ids=moved)
+    return len(operations)
+
+async def _reorder_ranked(updates: List[ActivityOrderUpdate], trip_id: Optional[str],
+                          background_tasks: Optional[BackgroundTasks]) -> int:
+    """Rewrite rank keys only for activities that left the longest already-ordered run"""
+    moved_ids = [update.id for update in updates]
+    payload = {"id": {"$in": moved_ids}}
+    if trip_id is not None:
+        payload["trip_id"] = trip_id
+    stored_moved = {
+        activity["id"]: activity
+        for activity in await db.activities.find(
+            payload, {**BUDGET_PROJECTION, "rank": 1}
+        ).to_list(None)
+    }
+
+    if trip_id is not None:
+        missing = [activity_id for activity_id in moved_ids if activity_id not in stored_moved]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Activities not found in trip: {', '.join(missing)}")
+
+    requested = defaultdict(list)
+    for update in updates:
+        current = stored_moved.get(update.id)
+        if current is None:
+            continue
+        requested[update.day_id or current["day_id"]].append(update)
+
+    residents = defaultdict(list)
+    for activity in await db.activities.find(
+        {"day_id": {"$in": list(requested)}}, {"_id": 0, "id": 1, "day_id": 1, "rank": 1}
+    ).sort("rank", 1).to_list(None):
+        residents[activity["day_id"]].append(activity)
+
+    now = datetime.now(timezone.utc)
+    operations = []
+    moved = []
+    day_moves = []
+    # Each activity is placed only in the day its update names, so one that moves
+    # away is not also kept as a resident of the day it left
+    placed = {update.id for day_updates in requested.values() for update in day_updates}
+    for day_id, day_updates in requested.items():
+        # Activities the client did not mention keep their relative order;
+        # mentioned ones are slotted in at their requested positions
+        sequence = [activity for activity in residents[day_id] if activity["id"] not in placed]
+        for update in sorted(day_updates, key=lambda update: update.order_index):
+            sequence.insert(min(update.order_index, len(sequence)), stored_moved[update.id])
+
+        keys = [activity.get("rank") if activity["day_id"] == day_id else None for activity in sequence]
+        kept = longest_increasing_run(keys)
+        previous_rank = None
+        for position, activity in enumerate(sequence):
+            if position in kept:
+                previous_rank = activity["rank"]
+                continue
+            next_rank = next((keys[later] for later in range(position + 1, len(sequence)) if later in kept), None)
+            previous_rank = rank_between(previous_rank, next_rank)
+            operations.append(UpdateOne(
+                {"id": activity["id"]},
+                {"$set": {"rank": previous_rank, "day_id": day_id, "updated_at": now}, "$inc": {"revision": 1}}
+            ))
+            moved.append(activity["id"])
+            if activity["day_id"] != day_id:
+                day_moves.append((activity, {**activity, "day_id": day_id}))
+            if len(previous_rank) > MAX_RANK_LENGTH and background_tasks is not None:
+                background_tasks.add_task(rebalance_day_ranks, day_id)
+
+    if operations:
+        await db.activities.bulk_write(operations, ordered=False)
+        await update_budget(day_moves)
+        await touch_trips(*(activity["trip_id"] for activity in stored_moved.values()),
+                          change="activities.reordered", ids=moved)
+    return len(operations)
+
+async def apply_activity_reorder(updates: List[ActivityOrderUpdate], trip_id: Optional[str] = None,
+                                 background_tasks: Optional[BackgroundTasks] = None) -> int:
+    """Diff the requested positions against the stored ones and write only the changed rows.
+
+    All changed rows go out in a single unordered bulk_write, so a drop costs a
+    fixed number of round trips no matter how many activities the client sends.
+    Returns the number of activities that were rewritten.
+    """
+    if not updates:
+        return 0
+    if ACTIVITY_ORDERING == "rank":
+        return await _reorder_ranked(updates, trip_id, background_tasks)
+    return await _reorder_dense(updates, trip_id)
+
+async def rebalance_day_ranks(day_id: str) -> None:
+    """Respace the rank keys of one day once repeated inserts have made them long"""
+    activities = await db.activities.find(
+        {"day_id": day_id}, {"_id": 0, "id": 1, "trip_id": 1}
+    ).sort("rank", 1).to_list(None)
+    operations = [
+        UpdateOne({"id": activity["id"]}, {"$set": {"rank": rank}})
+        for activity, rank in zip(activities, spaced_ranks(len(activities)))
+    ]
+    if operations:
+        await db.activities.bulk_write(operations, ordered=False)
+        await touch_trips(*(activity["trip_id"] for activity in activities), change="activities.reordered")
+    logger.info("Rebalanced %d rank keys for day %s", len(operations), day_id)
+
+async def migrate_activity_ranks(trip_id: Optional[str] = None) -> int:
+    """Give every day that still has unranked activities fresh rank keys.
+
+    Existing dense order_index values decide the order, so switching a
+    deployment to rank mode keeps every day in the order it had before.
+    """
+    unranked = {"rank": None}
+    if trip_id is not None:
+        unranked["trip_id"] = trip_id
+    day_ids = await db.activities.distinct("day_id", unranked)
+    migrated = 0
+    for day_id in day_ids:
+        activities = await db.activities.find(
+            {"day_id": day_id}, {"_id": 0, "id": 1}
+        ).sort([("order_index", 1), ("created_at", 1)]).to_list(None)
+        operations = [
+            UpdateOne({"id": activity["id"]}, {"$set": {"rank": rank}})
+            for activity, rank in zip(activities, spaced_ranks(len(activities)))
+        ]
+        if operations:
+            await db.activities.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+    return migrated
+
+# Indexes backing every query the handlers issue
+INDEXES = {
+    "trips": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel(
+            [("deleted_at", ASCENDING)], name="deleted_at_pending",
+            partialFilterExpression={"deleted_at": {"$type": "date"}},
+        ),
+    ],
+    "days": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("trip_id", ASCENDING), ("index", ASCENDING)], name="trip_id_index"),
+        IndexModel([("trip_id", ASCENDING), ("updated_at", ASCENDING)], name="trip_id_updated_at"),
+    ],
+    "activities": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("trip_id", ASCENDING), ("order_index", ASCENDING)], name="trip_id_order_index"),
+        IndexModel([("day_id", ASCENDING), ("order_index", ASCENDING)], name="day_id_order_index"),
+        IndexModel([("trip_id", ASCENDING), ("rank", ASCENDING)], name="trip_id_rank"),
+        IndexModel([("day_id", ASCENDING), ("rank", ASCENDING)], name="day_id_rank"),
+        IndexModel([("trip_id", ASCENDING), ("updated_at", ASCENDING)], name="trip_id_updated_at"),
+        IndexModel(
+            [("title", TEXT), ("location_text", TEXT), ("notes", TEXT)],
+            weights={"title": 10, "location_text": 5, "notes": 1}, name="search_text",
+        ),
+        IndexModel([("location", GEOSPHERE)], name="location_2dsphere"),
+    ],
+    "rollups": [
+        IndexModel([("trip_id", ASCENDING), ("scope", ASCENDING), ("key", ASCENDING)], unique=True, name="trip_id_scope_key"),
+        IndexModel([("scope", ASCENDING), ("total", DESCENDING)], name="scope_total"),
+    ],
+    "templates": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("created_at", DESCENDING)], name="created_at"),
+    ],
+    "tombstones": [
+        IndexModel([("trip_id", ASCENDING), ("deleted_at", ASCENDING)], name="trip_id_deleted_at"),
+        IndexModel([("deleted_at", ASCENDING)], expireAfterSeconds=SYNC_TOMBSTONE_TTL, name="deleted_at_ttl"),
+    ],
+}
+
+# (collection, filter, sort) shapes of the hot queries, checked with explain()
+HOT_QUERIES = [
+    ("trips", {"id": ""}, None),
+    ("trips", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("days", {"trip_id": ""}, [("index", ASCENDING)]),
+    ("activities", {"id": ""}, None),
+    ("activities", {"trip_id": ""}, [("order_index", ASCENDING)]),
+    ("activities", {"day_id": ""}, [("order_index", ASCENDING)]),
+    ("activities", {"trip_id": ""}, [("rank", ASCENDING)]),
+    ("activities", {"day_id": ""}, [("rank", ASCENDING)]),
+    ("days", {"trip_id": "", "updated_at": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("activities", {"trip_id": "", "updated_at": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("tombstones", {"trip_id": "", "deleted_at": {"$gte": datetime(2000, 1, 1)}}, None),
+    ("rollups", {"trip_id": ""}, None),
+    ("trips", {"deleted_at": {"$type": "date"}}, None),
+    ("templates", {"id": ""}, None),
+    ("templates", {}, [("created_at", DESCENDING)]),
+    ("activities", {"$text": {"$search": "museum"}}, None),
+    ("activities", {"trip_id": "", "location": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [0, 0]}}}}, None),
+]
+
+async def ensure_indexes() -> None:
+    """Create any declared index that does not exist yet (a no-op when they all do)"""
+    for collection, indexes in INDEXES.items():
+        await db[collection].create_indexes(indexes)
+
+def plan_stages(plan: dict) -> List[str]:
+    """Flatten the stage names of an explain() plan tree"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for child in ("inputStage", "queryPlan"):
+        if child in plan:
+            stages.extend(plan_stages(plan[child]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+async def verify_query_plans() -> List[str]:
+    """Explain every hot query and return a description of each one that scans its collection"""
+    scans = []
+    for collection, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        if "COLLSCAN" in plan_stages(explanation["queryPlanner"]["winningPlan"]):
+            scans.append(f"{collection}.find({list(query)}) sort={sort}")
+    return scans
+
 # API Routes
 
 # Root endpoint for health checks (Render deployment)
@@ -159,9 +2576,55 @@ async def api_root():
     return {"message": "Tripflow API is running!", "status": "healthy"}
 
 @api_router.get("/health")
+@api_router.get("/health/live")
 async def health_check():
+    """Liveness: the process is serving requests; deliberately does not touch the database"""
     return {"status": "healthy", "service": "tripflow-backend"}
 
+@api_router.get("/health/ready")
+async def readiness_check():
+    """Readiness: warm-up has finished and MongoDB answers a ping"""
+    if not getattr(app.state, "ready", False):
+        return FastJSONResponse({"status": "starting"}, status_code=503)
+    started = clock.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), READINESS_TIMEOUT_SECONDS)
+    except Exception as error:
+        return FastJSONResponse({"status": "unavailable", "mongo": type(error).__name__}, status_code=503)
+    return {"status": "ready", "mongo_ping_ms": round((clock.perf_counter() - started) * 1000, 2)}
+
+@api_router.get("/cache/stats")
+async def cache_stats():
+    return trip_cache.stats()
+
+@api_router.get("/budget/summary")
+async def get_budget_summary(limit: int = Query(20, ge=1, le=500)):
+    """Dashboard totals over every trip, read from the rollups instead of the activities"""
+    return await budget_summary(limit)
+
+@api_router.post("/budget/reconcile")
+async def reconcile_budget(trip_id: Optional[str] = None, repair: bool = True):
+    """Recompute rollups from the activities and report any drift, repairing it unless repair=false"""
+    drift = await reconcile_rollups(trip_id, repair)
+    return {"drift": drift, "repaired": repair and bool(drift)}
+
+@api_router.get("/reaper/stats")
+async def reaper_status():
+    """Deleted trips still being purged, with how much of each is gone so far"""
+    pending = await db.trips.find(
+        {"deleted_at": {"$type": "date"}}, {"_id": 0, "id": 1, "deleted_at": 1, "purged": 1}
+    ).to_list(None)
+    return {**reaper_stats, "pending": pending}
+
+@api_router.get("/events/stats")
+async def event_stats():
+    return change_hub.stats()
+
+@api_router.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @api_router.options("/{full_path:path}")
 async def options_handler(full_path: str):
     """Handle CORS preflight requests"""
@@ -172,44 +2635,330 @@ async def options_handler(full_path: str):
 async def create_trip(trip_data: TripCreate):
     trip_dict = trip_data.dict()
     trip_obj = Trip(**trip_dict)
-    trip_mongo = prepare_for_mongo(trip_obj.dict())
+    trip_mongo = TRIP_CODEC.to_mongo(trip_obj)
     await db.trips.insert_one(trip_mongo)
+    await bump_trip_listing_version()
     return trip_obj
 
+@api_router.post("/trips/provision", response_model=TripWithDays)
+async def create_trip_with_days(trip_data: TripCreate):
+    """Create a trip together with one day per date in its range"""
+    trip_obj = Trip(**trip_data.dict())
+    days = expand_trip_days(trip_obj)
+    await provision_trip(trip_obj, days)
+    return TripWithDays(trip=trip_obj, days=days, activities=[])
+
 @api_router.get("/trips", response_model=List[Trip])
-async def get_trips():
-    trips = await db.trips.find().to_list(1000)
-    return [Trip(**parse_from_mongo(trip)) for trip in trips]
+async def get_trips(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    if_none_match: Optional[str] = Header(None),
+):
+    """List trips newest first, one keyset page at a time.
+
+    The cursor for the next page is returned in the X-Next-Cursor header.
+    With stream=true every trip after the cursor is streamed as NDJSON and
+    limit is ignored, so memory stays flat however many trips exist.
+    """
+    counter = await db.counters.find_one({"_id": "trips"})
+    etag = trip_listing_etag(counter["version"] if counter else 0)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    if stream:
+        listing_filter(cursor)  # Reject a bad cursor before the response starts
+        return StreamingResponse(
+            stream_trips(cursor, None), media_type="application/x-ndjson", headers={"ETag": etag}
+        )
+
+    # One extra row tells whether another page follows
+    trips = await db.trips.find(
+        {**listing_filter(cursor), **LIVE_TRIP}, TRIP_LISTING_PROJECTION
+    ).sort(TRIP_LISTING_ORDER).to_list(limit + 1)
+    headers = {"ETag": etag}
+    if len(trips) > limit:
+        trips = trips[:limit]
+        headers["X-Next-Cursor"] = encode_listing_cursor(trips[-1])
+    return FastJSONResponse([listed_trip(trip) for trip in trips], headers=headers)
+
+@api_router.get("/search")
+async def search_activities(
+    q: str = Query(..., min_length=1, max_length=200),
+    trip_id: Optional[str] = None,
+    category: Optional[str] = None,
+    priority: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """Activities across all trips matching q in their title, location or notes, most relevant first.
+
+    Title matches weigh most, then location, then notes. The cursor for the
+    next page is returned in the X-Next-Cursor header.
+    """
+    filters = {name: value for name, value in zip(SEARCH_FILTERS, (trip_id, category, priority)) if value is not None}
+    # One extra result tells whether another page follows
+    results = await db.activities.aggregate(search_pipeline(q, filters, cursor, limit + 1)).to_list(None)
+    headers = {}
+    if len(results) > limit:
+        results = results[:limit]
+        headers["X-Next-Cursor"] = encode_search_cursor(results[-1])
+
+    trips = {
+        trip["id"]: trip
+        for trip in await db.trips.find(
+            {"id": {"$in": list({result["trip_id"] for result in results})}, **LIVE_TRIP}, {"_id": 0, "id": 1, "title": 1}
+        ).to_list(None)
+    }
+    body = []
+    for result in results:
+        if result["trip_id"] not in trips:
+            # Its trip was deleted and is waiting for the reaper
+            continue
+        score = result.pop("score")
+        body.append({
+            "activity": ACTIVITY_CODEC.document(result),
+            "score": score,
+            "trip_title": trips.get(result["trip_id"], {}).get("title"),
+        })
+    return FastJSONResponse(body, headers=headers)
 
 @api_router.get("/trips/{trip_id}", response_model=TripWithDays)
-async def get_trip_with_details(trip_id: str):
-    # Get trip
-    trip = await db.trips.find_one({"id": trip_id})
+async def get_trip_with_details(trip_id: str, if_none_match: Optional[str] = Header(None)):
+    snapshot = await trip_cache.get(trip_id)
+    if snapshot is not None:
+        etag, body = snapshot
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        return Response(body, media_type="application/json", headers={"ETag": etag})
+
+    if if_none_match:
+        # Only the version is needed to answer a conditional request
+        trip = await db.trips.find_one({"id": trip_id, **LIVE_TRIP}, {"_id": 0, "version": 1})
+        if trip is None:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        etag = trip_etag(trip.get("version", 0))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+    token = await trip_cache.reserve(trip_id)
+    details = await load_trip_details(trip_id)
+    if details is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    etag = trip_etag(details["trip"]["version"])
+    # Returned directly so FastAPI does not validate the trusted documents again
+    response = FastJSONResponse(details, headers={"ETag": etag})
+    await trip_cache.set(trip_id, etag, response.body, token)
+    return response
+
+@api_router.get("/trips/{trip_id}/changes")
+async def get_trip_changes(trip_id: str, since: Optional[str] = None):
+    """Days and activities changed since a sync cursor, or a full snapshot when the cursor is missing or too old"""
+    changes = await load_trip_changes(trip_id, since)
+    if changes is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return FastJSONResponse(changes)
+
+@api_router.get("/trips/{trip_id}/events")
+async def trip_events(trip_id: str):
+    """Server-sent change events for one trip; on each, fetch /changes with your sync cursor"""
+    await require_live_trip(trip_id)
+    return StreamingResponse(
+        stream_trip_events(trip_id), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.websocket("/trips/{trip_id}/ws")
+async def trip_events_socket(websocket: WebSocket, trip_id: str):
+    """The same change events as /events, one JSON text frame each, with a ping frame as heartbeat"""
+    await websocket.accept()
+    subscription = change_hub.subscribe(trip_id)
+
+    async def read_until_closed():
+        # Clients only listen; reading is how their disconnect is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    reader = asyncio.create_task(read_until_closed())
+    try:
+        while True:
+            # Stop as soon as the client goes away instead of at the next event or heartbeat
+            getter = asyncio.create_task(subscription.get(EVENT_HEARTBEAT_SECONDS))
+            await asyncio.wait({getter, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if reader.done():
+                getter.cancel()
+                break
+            await websocket.send_text(dump_json(getter.result() or {"type": "ping", "trip_id": trip_id}).decode())
+    except (WebSocketDisconnect, OSError):
+        pass  # Closed while sending
+    finally:
+        reader.cancel()
+        subscription.close()
+
+@api_router.get("/trips/{trip_id}/conflicts")
+async def get_trip_conflicts(trip_id: str):
+    """Every pair of overlapping activities in a trip, including ones that run past midnight"""
+    await require_live_trip(trip_id)
+    days, activities = await load_schedule(trip_id)
+    pairs = find_overlaps(trip_timeline(days, activities))
+    return {
+        "conflicts": describe_conflicts(pairs, activities),
+        "activity_ids": sorted({activity_id for pair in pairs for activity_id in pair[:2]}),
+    }
+
+@api_router.get("/trips/{trip_id}/budget")
+async def get_trip_budget(trip_id: str):
+    """Cost totals and activity counts for a trip, per day and per category"""
+    trip, days, rollups = await asyncio.gather(
+        db.trips.find_one({"id": trip_id, **LIVE_TRIP}, {"_id": 0, "currency": 1}),
+        db.days.find({"trip_id": trip_id}, {"_id": 0, "id": 1, "date": 1, "index": 1}).sort("index", 1).to_list(None),
+        db.rollups.find({"trip_id": trip_id}, {"_id": 0}).to_list(None),
+    )
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
 
-    # Get days for this trip
-    days = await db.days.find({"trip_id": trip_id}).sort("index", 1).to_list(1000)
+    by_scope = defaultdict(dict)
+    for rollup in rollups:
+        by_scope[rollup["scope"]][rollup["key"]] = rollup
+    empty = {"total": 0.0, "count": 0}
+    total = by_scope["trip"].get(trip_id, empty)
+    return {
+        "trip_id": trip_id,
+        "currency": trip.get("currency"),
+        "total": total["total"],
+        "count": total["count"],
+        "days": [
+            {"day_id": day["id"], "date": day["date"], "index": day["index"],
+             "total": by_scope["day"].get(day["id"], empty)["total"], "count": by_scope["day"].get(day["id"], empty)["count"]}
+            for day in days
+        ],
+        "categories": sorted(
+            ({"category": key, "total": rollup["total"], "count": rollup["count"]}
+             for key, rollup in by_scope["category"].items() if rollup["count"]),
+            key=lambda category: -category["total"],
+        ),
+    }
+
+@api_router.get("/trips/{trip_id}/nearby")
+async def nearby_activities(
+    trip_id: str,
+    lng: float = Query(..., ge=-180, le=180),
+    lat: float = Query(..., ge=-90, le=90),
+    max_km: float = Query(5, gt=0, le=1000),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """A trip's activities with coordinates within max_km of a point, nearest first"""
+    await require_live_trip(trip_id)
+    near = {"$geometry": {"type": "Point", "coordinates": [lng, lat]}, "$maxDistance": max_km * 1000}
+    activities = await db.activities.find(
+        {"trip_id": trip_id, "location": {"$nearSphere": near}}, ACTIVITY_CODEC.projection
+    ).limit(limit).to_list(None)
+    return FastJSONResponse([ACTIVITY_CODEC.document(activity) for activity in activities])
+
+@api_router.get("/trips/{trip_id}/days/{day_id}/route")
+async def propose_day_route(trip_id: str, day_id: str):
+    """Suggested visit order for a day's activities with coordinates, keeping to their time windows"""
+    return propose_route(await load_day_stops(trip_id, day_id))
 
-    # Get activities for this trip
-    activities = await db.activities.find({"trip_id": trip_id}).sort("order_index", 1).to_list(1000)
+@api_router.post("/trips/{trip_id}/days/{day_id}/route")
+async def apply_day_route(trip_id: str, day_id: str, background_tasks: BackgroundTasks):
+    """Solve the day's route and write the new order through the reorder engine"""
+    proposal = propose_route(await load_day_stops(trip_id, day_id))
+    updates = [
+        ActivityOrderUpdate(id=activity_id, day_id=day_id, order_index=position)
+        for position, activity_id in enumerate(proposal["order"])
+    ]
+    proposal["changed"] = await apply_activity_reorder(updates, trip_id=trip_id, background_tasks=background_tasks)
+    return proposal
+
+@api_router.get("/trips/{trip_id}/export")
+async def export_trip(trip_id: str, format: str = Query("ndjson", pattern="^(ndjson|csv|ics)$")):
+    """Stream a trip with its days and activities as NDJSON, CSV or iCalendar"""
+    trip = await db.trips.find_one({"id": trip_id, **LIVE_TRIP}, TRIP_CODEC.projection)
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    days = await db.days.find({"trip_id": trip_id}, DAY_CODEC.projection).sort("index", 1).to_list(None)
 
-    return TripWithDays(
-        trip=Trip(**parse_from_mongo(trip)),
-        days=[Day(**parse_from_mongo(day)) for day in days],
-        activities=[Activity(**parse_from_mongo(activity)) for activity in activities]
+    exporter, media_type = EXPORT_FORMATS[format]
+    filename = f"trip-{trip_id}.{format}"
+    return StreamingResponse(
+        exporter(trip, days), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
-@api_router.delete("/trips/{trip_id}")
-async def delete_trip(trip_id: str):
-    # Delete all activities and days for this trip first
-    await db.activities.delete_many({"trip_id": trip_id})
-    await db.days.delete_many({"trip_id": trip_id})
+@api_router.post("/trips/import")
+async def import_trip_records(request: Request):
+    """Create a trip from an NDJSON body in the export format"""
+    trip, day_count, activity_count = await import_trip(request)
+    await reconcile_rollups(trip.id)
+    return {"trip": trip, "days": day_count, "activities": activity_count}
+
+@api_router.post("/trips/{trip_id}/clone")
+async def clone_trip(trip_id: str, copy: TripCopy):
+    """Copy a trip with all its days and activities, optionally moved to a new date_start"""
+    itinerary = await load_itinerary(trip_id)
+    if itinerary is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return await instantiate_itinerary(itinerary, copy)
+
+# Template endpoints
+@api_router.post("/templates")
+async def create_template(template_data: TemplateCreate):
+    """Freeze a trip's current itinerary as a reusable template"""
+    itinerary = await load_itinerary(template_data.trip_id)
+    if itinerary is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    template = {
+        "id": str(uuid.uuid4()),
+        "name": template_data.name,
+        "description": template_data.description,
+        "source_trip_id": template_data.trip_id,
+        "day_count": len(itinerary["days"]),
+        "activity_count": len(itinerary["activities"]),
+        "created_at": datetime.now(timezone.utc),
+        "snapshot": itinerary,
+    }
+    await db.templates.insert_one(dict(template))
+    template.pop("snapshot")
+    return template
 
-    # Delete the trip
-    result = await db.trips.delete_one({"id": trip_id})
+@api_router.get("/templates")
+async def list_templates(limit: int = Query(100, ge=1, le=1000)):
+    """Templates newest first, without their snapshots"""
+    return await db.templates.find({}, TEMPLATE_SUMMARY_PROJECTION).sort("created_at", DESCENDING).to_list(limit)
+
+@api_router.get("/templates/{template_id}")
+async def get_template(template_id: str):
+    body = await load_template(template_id)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return Response(body, media_type="application/json")
+
+@api_router.post("/templates/{template_id}/instantiate")
+async def instantiate_template(template_id: str, copy: TripCopy):
+    """Create a trip from a template in one request"""
+    body = await load_template(template_id)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return await instantiate_itinerary(orjson.loads(body)["snapshot"], copy)
+
+@api_router.delete("/templates/{template_id}")
+async def delete_template(template_id: str):
+    result = await db.templates.delete_one({"id": template_id})
     if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Template not found")
+    await template_cache.delete(template_id)
+    return {"message": "Template deleted successfully"}
+
+@api_router.delete("/trips/{trip_id}")
+async def delete_trip(trip_id: str, background_tasks: BackgroundTasks):
+    """Tombstone the trip and return; its days and activities are purged in the background"""
+    result = await db.trips.update_one({"id": trip_id, **LIVE_TRIP}, {"$set": {"deleted_at": datetime.now(timezone.utc)}})
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Trip not found")
+    await asyncio.gather(touch_trips(trip_id, change="trip.deleted", ids=[trip_id]), bump_trip_listing_version())
+    # Reap right away; the periodic pass finishes the job if this worker stops first
+    background_tasks.add_task(reap_trip, trip_id)
     return {"message": "Trip deleted successfully"}
 
 # Day endpoints
@@ -218,70 +2967,124 @@ async def create_day(trip_id: str, day_data: DayCreate):
     day_dict = day_data.dict()
     day_dict["trip_id"] = trip_id
     day_obj = Day(**day_dict)
-    day_mongo = prepare_for_mongo(day_obj.dict())
+    day_mongo = DAY_CODEC.to_mongo(day_obj)
     await db.days.insert_one(day_mongo)
+    await touch_trips(trip_id, change="day.created", ids=[day_obj.id])
     return day_obj
 
 # Activity endpoints
 @api_router.post("/trips/{trip_id}/days/{day_id}/activities", response_model=Activity)
-async def create_activity(trip_id: str, day_id: str, activity_data: ActivityCreate):
-    # Get current max order_index for this day
-    existing_activities = await db.activities.find({"day_id": day_id}).to_list(1000)
-    max_order = max([act.get("order_index", 0) for act in existing_activities], default=-1)
+async def create_activity(trip_id: str, day_id: str, activity_data: ActivityCreate,
+                          background_tasks: BackgroundTasks):
+    # Only the last activity of the day is needed to append after it
+    sort_key = "rank" if ACTIVITY_ORDERING == "rank" else "order_index"
+    last_activity = await db.activities.find_one(
+        {"day_id": day_id}, {"_id": 0, "order_index": 1, "rank": 1}, sort=[(sort_key, -1)]
+    )
 
     activity_dict = activity_data.dict()
     activity_dict["trip_id"] = trip_id
     activity_dict["day_id"] = day_id
-    activity_dict["order_index"] = max_order + 1
+    activity_dict["order_index"] = last_activity.get("order_index", 0) + 1 if last_activity else 0
+    if ACTIVITY_ORDERING == "rank":
+        activity_dict["rank"] = rank_between(last_activity.get("rank") if last_activity else None)
+        if len(activity_dict["rank"]) > MAX_RANK_LENGTH:
+            background_tasks.add_task(rebalance_day_ranks, day_id)
 
     activity_obj = Activity(**activity_dict)
-    activity_mongo = prepare_for_mongo(activity_obj.dict())
+    await ensure_schedule_fits(trip_id, {activity_obj.id: {**schedule_changes(activity_obj), "title": activity_obj.title}})
+    activity_mongo = ACTIVITY_CODEC.to_mongo(activity_obj)
     await db.activities.insert_one(activity_mongo)
+    await update_budget([(None, activity_mongo)])
+    await touch_trips(trip_id, change="activity.created", ids=[activity_obj.id])
     return activity_obj
 
 @api_router.put("/activities/{activity_id}", response_model=Activity)
-async def update_activity(activity_id: str, activity_data: ActivityUpdate):
-    update_dict = {k: v for k, v in activity_data.dict().items() if v is not None}
-    update_dict["updated_at"] = datetime.now(timezone.utc)
-
-    update_mongo = prepare_for_mongo(update_dict)
-    result = await db.activities.update_one(
-        {"id": activity_id},
-        {"$set": update_mongo}
+async def update_activity(activity_id: str, activity_data: ActivityUpdate, background_tasks: BackgroundTasks):
+    rank = None
+    if activity_data.day_id is not None:
+        current = await db.activities.find_one({"id": activity_id}, {"_id": 0, "trip_id": 1, "day_id": 1})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Activity not found")
+        await ensure_trip_days(current["trip_id"], [activity_data.day_id])
+        if activity_data.day_id != current["day_id"]:
+            rank = (await ranks_for_moves({activity_id: activity_data.day_id}, background_tasks)).get(activity_id)
+    rescheduled = schedule_changes(activity_data)
+    if rescheduled:
+        await ensure_edits_fit({activity_id: rescheduled})
+    # The pre-image is what the rollups need; the post-image follows from it and the update
+    changes = activity_changes(activity_data, datetime.now(timezone.utc), rank)
+    previous = await db.activities.find_one_and_update(
+        {"id": activity_id, **revision_guard(activity_data.revision)},
+        changes,
+        projection=ACTIVITY_CODEC.projection,
+        return_document=ReturnDocument.BEFORE,
     )
 
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Activity not found")
+    if previous is None:
+        current = await db.activities.find_one({"id": activity_id}, {"_id": 0, "revision": 1})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Activity not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Activity is at revision {current.get('revision', 0)}, not {activity_data.revision}",
+        )
+
+    updated_activity = {**previous, **changes["$set"], "revision": previous.get("revision", 0) + 1}
+    await update_budget([(previous, updated_activity)])
+    await touch_trips(updated_activity["trip_id"], change="activity.updated", ids=[activity_id])
+    # Returned directly so FastAPI does not validate the trusted document again
+    return FastJSONResponse(ACTIVITY_CODEC.document(updated_activity))
+
+@api_router.patch("/trips/{trip_id}/activities")
+async def patch_trip_activities(trip_id: str, batch: ActivityPatchRequest, background_tasks: BackgroundTasks):
+    """Apply many partial activity edits in one request.
+
+    Edits based on a stale revision are not applied; they come back under
+    "conflicts" with the activity's current state, and the response is a 409.
+    """
+    ids = [patch.id for patch in batch.updates]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Each activity may only be patched once per request")
+    if not ids:
+        return {"activities": [], "conflicts": [], "missing": []}
 
-    updated_activity = await db.activities.find_one({"id": activity_id})
-    return Activity(**parse_from_mongo(updated_activity))
+    await ensure_trip_days(trip_id, list({patch.day_id for patch in batch.updates if patch.day_id}))
+    await ensure_schedule_fits(trip_id, {
+        patch.id: schedule_changes(patch) for patch in batch.updates if schedule_changes(patch)
+    })
+    updated, conflicts, missing = await patch_activities(trip_id, batch.updates, background_tasks)
+    body = {
+        "activities": [ACTIVITY_CODEC.document(activity) for activity in updated],
+        "conflicts": [ACTIVITY_CODEC.document(activity) for activity in conflicts],
+        "missing": missing,
+    }
+    return FastJSONResponse(body, status_code=409 if conflicts or missing else 200)
 
 @api_router.delete("/activities/{activity_id}")
 async def delete_activity(activity_id: str):
-    result = await db.activities.delete_one({"id": activity_id})
-    if result.deleted_count == 0:
+    deleted = await db.activities.find_one_and_delete({"id": activity_id}, BUDGET_PROJECTION)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Activity not found")
+    await update_budget([(deleted, None)])
+    await record_tombstones(deleted["trip_id"], "activities", [activity_id])
+    await touch_trips(deleted["trip_id"], change="activity.deleted", ids=[activity_id])
     return {"message": "Activity deleted successfully"}
 
+@api_router.post("/trips/{trip_id}/activities/reorder")
+async def reorder_trip_activities(trip_id: str, reorder: ReorderRequest, background_tasks: BackgroundTasks):
+    """Apply drag-and-drop positions for one trip, writing only the rows that moved"""
+    await ensure_trip_days(trip_id, list({update.day_id for update in reorder.updates if update.day_id}))
+    await ensure_schedule_fits(trip_id, {update.id: schedule_changes(update) for update in reorder.updates if update.day_id})
+    changed = await apply_activity_reorder(reorder.updates, trip_id=trip_id, background_tasks=background_tasks)
+    return {"message": "Activities reordered successfully", "changed": changed}
+
 @api_router.post("/activities/reorder")
-async def reorder_activities(updates: List[dict]):
+async def reorder_activities(updates: List[ActivityOrderUpdate], background_tasks: BackgroundTasks):
     """Bulk update activity orders and day assignments for drag-and-drop"""
-    for update in updates:
-        activity_id = update.get("id")
-        new_order = update.get("order_index")
-        new_day_id = update.get("day_id")
-
-        update_data = {"order_index": new_order}
-        if new_day_id:
-            update_data["day_id"] = new_day_id
-        update_data["updated_at"] = datetime.now(timezone.utc)
-
-        await db.activities.update_one(
-            {"id": activity_id},
-            {"$set": update_data}
-        )
-
-    return {"message": "Activities reordered successfully"}
+    await ensure_edits_fit({update.id: schedule_changes(update) for update in updates if update.day_id})
+    changed = await apply_activity_reorder(updates, background_tasks=background_tasks)
+    return {"message": "Activities reordered successfully", "changed": changed}
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -293,6 +3096,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def bootstrap_indexes():
+    await ensure_indexes()
+    if INDEX_CHECK == "off":
+        return
+    scans = await verify_query_plans()
+    for scan in scans:
+        logger.warning("Hot query scans its whole collection: %s", scan)
+    if scans and INDEX_CHECK == "strict":
+        raise RuntimeError(f"{len(scans)} hot queries fall back to COLLSCAN")
+
+async def migrate_ordering():
+    if ACTIVITY_ORDERING == "rank":
+        migrated = await migrate_activity_ranks()
+        if migrated:
+            logger.info("Assigned rank keys to %d activities", migrated)
+
+async def bootstrap_rollups():
+    # The first start after rollups were introduced builds them from the existing activities.
+    # Every worker starts up, so only the one whose marker insert wins does the build
+    if await db.rollups.find_one({}, {"_id": 1}) or not await db.activities.find_one({}, {"_id": 1}):
+        return
+    try:
+        await db.migrations.insert_one({"_id": "rollups.bootstrap", "started_at": datetime.now(timezone.utc)})
+    except DuplicateKeyError:
+        return
+    drift = await reconcile_rollups()
+    logger.info("Built %d budget rollups", len(drift))
+
+async def warm_up() -> None:
+    """Open pool connections and load the most recent trips before taking traffic.
+
+    Concurrent pings each check out their own connection, so the pool holds
+    WARM_CONNECTIONS sockets afterwards; loading recent trips pages their
+    indexes into the server's cache and fills the snapshot cache.
+    """
+    started = clock.perf_counter()
+    await asyncio.gather(*(db.command("ping") for _ in range(max(WARM_CONNECTIONS, 1))))
+    trips = await db.trips.find(LIVE_TRIP, {"_id": 0, "id": 1}).sort(TRIP_LISTING_ORDER).to_list(WARM_TRIPS)
+    for trip in trips:
+        await get_trip_with_details(trip["id"], if_none_match=None)
+    logger.info("Warmed %d connections and %d trips in %.0f ms",
+                WARM_CONNECTIONS, len(trips), (clock.perf_counter() - started) * 1000)
+
+def check_worker_backends() -> None:
+    # Per-process backends only see their own worker's writes
+    if WEB_CONCURRENCY > 1:
+        if MEMORY_CACHE_DISABLED:
+            logger.warning("TRIP_CACHE_BACKEND=memory is per process; trip caching is off with %d workers "
+                           "(set TRIP_CACHE_BACKEND=redis to cache)", WEB_CONCURRENCY)
+        if CHANGE_BROKER == "memory":
+            logger.warning("CHANGE_BROKER=memory with several workers misses other workers' change events; use redis")
+
+async def start_up(app: FastAPI) -> None:
+    global client, db
+    app.state.ready = False
+    if db is None:
+        client = AsyncIOMotorClient(mongo_url, **mongo_client_options())
+        db = client[db_name]
+    check_worker_backends()
+    await bootstrap_indexes()
+    await migrate_ordering()
+    await bootstrap_rollups()
+    await change_hub.broker.start()
+    await warm_up()
+    app.state.background_tasks = []
+    if ROLLUP_RECONCILE_SECONDS > 0:
+        app.state.background_tasks.append(asyncio.create_task(reconcile_rollups_periodically()))
+    if REAPER_INTERVAL_SECONDS > 0:
+        app.state.background_tasks.append(asyncio.create_task(reap_periodically()))
+    if ORPHAN_SWEEP_SECONDS > 0:
+        app.state.background_tasks.append(asyncio.create_task(sweep_orphans_periodically()))
+    app.state.ready = True
+
+async def shut_down(app: FastAPI) -> None:
+    app.state.ready = False
+    for task in getattr(app.state, "background_tasks", []):
+        task.cancel()
+    await change_hub.broker.stop()
+    if client is not None:
+        client.close()
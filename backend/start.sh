@@ -1,4 +1,12 @@
 #!/bin/bash
 
 # Start script for Render deployment
-uvicorn server:app --host 0.0.0.0 --port $PORT
\ No newline at end of file
+# WEB_CONCURRENCY > 1 runs that many worker processes under gunicorn; each opens
+# its own Mongo pool, so size MONGO_MAX_POOL_SIZE x WEB_CONCURRENCY to the cluster
+WORKERS=${WEB_CONCURRENCY:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    exec gunicorn server:app --worker-class uvicorn.workers.UvicornWorker --workers "$WORKERS" \
+        --bind 0.0.0.0:$PORT --timeout ${WORKER_TIMEOUT:-60} --graceful-timeout 30 --keep-alive 5
+else
+    exec uvicorn server:app --host 0.0.0.0 --port $PORT
+fi
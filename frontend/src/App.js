@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import { BrowserRouter, Routes, Route, useNavigate, useParams } from 'react-router-dom';
 import {
   DndContext,
@@ -54,6 +54,17 @@ import './App.css';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Reads shed by the server's admission control (429/503) are retried once after Retry-After
+axios.interceptors.response.use(undefined, async (error) => {
+  const { config, response } = error;
+  if (!config || config.__retried || config.method !== 'get' || ![429, 503].includes(response?.status)) {
+    throw error;
+  }
+  const seconds = Math.min(Number(response.headers['retry-after']) || 1, 5);
+  await new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+  return axios({ ...config, __retried: true });
+});
+
 // Currency symbol mapping
 const getCurrencySymbol = (currency) => {
   const symbols = {
@@ -207,30 +218,12 @@ function SortableActivityCard({ activity, onEdit, onDelete, showConflict = false
 }
 
 // Enhanced Day Column Component
-function DayColumn({ day, activities, onAddActivity, onEditActivity, onDeleteActivity, currency = 'USD' }) {
+function DayColumn({ day, activities, conflictIds, onAddActivity, onEditActivity, onDeleteActivity, currency = 'USD' }) {
   const dayActivities = activities.filter(activity => activity.day_id === day.id);
   const totalCost = dayActivities.reduce((sum, activity) => sum + (activity.cost || 0), 0);
   const activityCount = dayActivities.length;
   const currencySymbol = getCurrencySymbol(currency);
 
-  // Check for time conflicts
-  const hasConflicts = useMemo(() => {
-    const conflicts = new Set();
-    const sortedActivities = [...dayActivities].sort((a, b) => a.start_time.localeCompare(b.start_time));
-    
-    for (let i = 0; i < sortedActivities.length - 1; i++) {
-      const current = sortedActivities[i];
-      const next = sortedActivities[i + 1];
-      
-      if (current.end_time > next.start_time) {
-        conflicts.add(current.id);
-        conflicts.add(next.id);
-      }
-    }
-    
-    return conflicts;
-  }, [dayActivities]);
-
   const formatDate = (dateStr) => {
     const date = parseISO(dateStr);
     return format(date, 'EEE, MMM d');
@@ -276,7 +269,7 @@ function DayColumn({ day, activities, onAddActivity, onEditActivity, onDeleteAct
                 activity={activity}
                 onEdit={onEditActivity}
                 onDelete={onDeleteActivity}
-                showConflict={hasConflicts.has(activity.id)}
+                showConflict={conflictIds.has(activity.id)}
                 currency={currency}
               />
             ))}
@@ -639,6 +632,7 @@ function TripPlanner() {
   const [tripData, setTripData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [activities, setActivities] = useState([]);
+  const [conflictIds, setConflictIds] = useState(new Set());
   const [days, setDays] = useState([]);
   const [activeId, setActiveId] = useState(null);
   const [activityDialogOpen, setActivityDialogOpen] = useState(false);
@@ -660,18 +654,62 @@ function TripPlanner() {
     })
   );
 
+  const syncCursorRef = useRef(null);
+
   useEffect(() => {
+    syncCursorRef.current = null;
     loadTripData();
   }, [tripId]);
 
+  // Collaborators' edits arrive as change events; each one pulls just the delta
+  useEffect(() => {
+    const events = new EventSource(`${API}/trips/${tripId}/events`);
+    events.onmessage = () => {
+      if (syncCursorRef.current !== null) loadTripData();
+    };
+    return () => events.close();
+  }, [tripId]);
+
+  const mergeById = (items, upserted, deletedIds) => {
+    const byId = new Map(items.map(item => [item.id, item]));
+    deletedIds.forEach(id => byId.delete(id));
+    upserted.forEach(item => byId.set(item.id, item));
+    return Array.from(byId.values());
+  };
+
+  // Overlaps are worked out on the server across the whole trip, including activities past midnight.
+  // They are fetched once a sync has brought in new data, not while a drag rearranges local state
+  const loadConflicts = () => {
+    axios.get(`${API}/trips/${tripId}/conflicts`)
+      .then(response => setConflictIds(new Set(response.data.activity_ids)))
+      .catch(error => console.error('Error loading conflicts:', error));
+  };
+
+  // Fetches a full snapshot on first load, then only what changed since the last sync
   const loadTripData = async () => {
+    const initialLoad = syncCursorRef.current === null;
     try {
-      setLoading(true);
-      const response = await axios.get(`${API}/trips/${tripId}`);
+      if (initialLoad) setLoading(true);
+      const response = await axios.get(`${API}/trips/${tripId}/changes`, {
+        params: initialLoad ? {} : { since: syncCursorRef.current },
+      });
       const data = response.data;
       setTripData(data.trip);
-      setDays(data.days);
-      setActivities(data.activities);
+      if (data.full) {
+        setDays(data.days);
+        setActivities(data.activities);
+      } else {
+        setDays(prevDays => mergeById(prevDays, data.days, data.deleted.days)
+          .sort((a, b) => a.index - b.index));
+        setActivities(prevActivities => mergeById(prevActivities, data.activities, data.deleted.activities)
+          .map(activity => data.positions && activity.id in data.positions
+            ? { ...activity, order_index: data.positions[activity.id] }
+            : activity));
+      }
+      syncCursorRef.current = data.cursor;
+      const changed = data.full || data.days.length > 0 || data.activities.length > 0
+        || data.deleted.days.length > 0 || data.deleted.activities.length > 0;
+      if (changed) loadConflicts();
     } catch (error) {
       console.error('Error loading trip data:', error);
       toast({
@@ -680,7 +718,7 @@ function TripPlanner() {
         variant: "destructive",
       });
     } finally {
-      setLoading(false);
+      if (initialLoad) setLoading(false);
     }
   };
 
@@ -760,7 +798,7 @@ function TripPlanner() {
         order_index: activity.order_index
       }));
       
-      await axios.post(`${API}/activities/reorder`, updates);
+      await axios.post(`${API}/trips/${tripId}/activities/reorder`, { updates });
       toast({
         title: "Success",
         description: "Activities reordered successfully",
@@ -772,6 +810,8 @@ function TripPlanner() {
         description: "Failed to reorder activities",
         variant: "destructive",
       });
+      // Local order no longer matches the server, so resync from a full snapshot
+      syncCursorRef.current = null;
       loadTripData();
     }
   };
@@ -791,7 +831,11 @@ function TripPlanner() {
   const handleSaveActivity = async (formData) => {
     try {
       if (editingActivity) {
-        await axios.put(`${API}/activities/${editingActivity.id}`, formData);
+        // The revision makes the server reject the edit if someone else saved first
+        await axios.put(`${API}/activities/${editingActivity.id}`, {
+          ...formData,
+          revision: editingActivity.revision,
+        });
         toast({
           title: "Success",
           description: "Activity updated successfully",
@@ -808,11 +852,21 @@ function TripPlanner() {
       loadTripData();
     } catch (error) {
       console.error('Error saving activity:', error);
+      const conflict = error.response?.status === 409;
+      const overlaps = conflict ? error.response.data.detail?.conflicts : undefined;
       toast({
         title: "Error",
-        description: "Failed to save activity",
+        description: overlaps
+          ? `Overlaps with ${overlaps.flatMap(pair => pair.titles).filter(title => title !== formData.title).join(', ')}`
+          : conflict
+            ? "This activity was changed by someone else. Showing the latest version."
+            : "Failed to save activity",
         variant: "destructive",
       });
+      if (conflict && !overlaps) {
+        setActivityDialogOpen(false);
+        loadTripData();
+      }
     }
   };
 
@@ -1069,6 +1123,7 @@ function TripPlanner() {
                       key={day.id}
                       day={day}
                       activities={filteredActivities}
+                      conflictIds={conflictIds}
                       onAddActivity={handleAddActivity}
                       onEditActivity={handleEditActivity}
                       onDeleteActivity={handleDeleteActivity}
@@ -1214,8 +1269,15 @@ function Home() {
 
   const loadTrips = async () => {
     try {
-      const response = await axios.get(`${API}/trips`);
-      setTrips(response.data);
+      // Trips come back newest first, one keyset page at a time
+      const allTrips = [];
+      let cursor = null;
+      do {
+        const response = await axios.get(`${API}/trips`, { params: cursor ? { cursor } : {} });
+        allTrips.push(...response.data);
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor);
+      setTrips(allTrips);
     } catch (error) {
       console.error('Error loading trips:', error);
     } finally {
@@ -1229,23 +1291,9 @@ function Home() {
     
     setIsCreating(true);
     try {
-      const response = await axios.post(`${API}/trips`, newTrip);
-      const tripId = response.data.id;
-      
-      const startDate = new Date(newTrip.date_start);
-      const endDate = new Date(newTrip.date_end);
-      const dayCount = Math.ceil((endDate - startDate) / (1000 * 60 * 60 * 24)) + 1;
-      
-      for (let i = 0; i < dayCount; i++) {
-        const dayDate = new Date(startDate);
-        dayDate.setDate(startDate.getDate() + i);
-        
-        await axios.post(`${API}/trips/${tripId}/days`, {
-          date: dayDate.toISOString().split('T')[0],
-          index: i + 1,
-          notes: null
-        });
-      }
+      // The server creates the trip and one day per date in a single request
+      const response = await axios.post(`${API}/trips/provision`, newTrip);
+      const tripId = response.data.trip.id;
       
       setCreateDialogOpen(false);
       setNewTrip({
@@ -1272,6 +1320,25 @@ function Home() {
     }
   };
 
+  const duplicateTrip = async (trip) => {
+    try {
+      // The server copies every day and activity in one request
+      const response = await axios.post(`${API}/trips/${trip.id}/clone`, { title: `${trip.title} (copy)` });
+      toast({
+        title: "Success!",
+        description: "Trip duplicated successfully",
+      });
+      navigate(`/trip/${response.data.trip.id}`);
+    } catch (error) {
+      console.error('Error duplicating trip:', error);
+      toast({
+        title: "Error",
+        description: "Failed to duplicate trip",
+        variant: "destructive",
+      });
+    }
+  };
+
   const deleteTrip = async () => {
     if (!tripToDelete) return;
     
@@ -1442,6 +1509,19 @@ function Home() {
               >
                 <div className="h-2 bg-gradient-to-r from-blue-500 to-purple-600" />
                 
+                {/* Duplicate button */}
+                <Button
+                  variant="ghost"
+                  size="sm"
+                  className="absolute top-3 right-12 h-8 w-8 p-0 opacity-100 md:opacity-0 md:group-hover:opacity-100 transition-opacity hover:bg-blue-50 z-10"
+                  onClick={(e) => {
+                    e.stopPropagation();
+                    duplicateTrip(trip);
+                  }}
+                >
+                  <Copy className="h-4 w-4 text-blue-600" />
+                </Button>
+
                 {/* Delete button */}
                 <Button
                   variant="ghost"
@@ -0,0 +1,32 @@
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database wired into the server module"""
+    database = AsyncMongoMockClient()["tripflow_test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "trip_cache", server.SnapshotCache())
+    return database
+
+
+@pytest.fixture
+async def api(db):
+    """HTTP client talking to the ASGI app in process (the lifespan does not run)"""
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as client:
+        yield client
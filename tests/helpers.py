@@ -0,0 +1,52 @@
+"""Request helpers shared by the API tests"""
+
+import functools
+
+
+async def provision(api, days=2, **fields):
+    """Create a trip with one day per date and return (trip_id, [day ids])"""
+    response = await api.post("/trips/provision", json={
+        "title": "Test trip", "date_start": "2025-01-01", "date_end": f"2025-01-{days:02d}", **fields,
+    })
+    assert response.status_code == 200
+    body = response.json()
+    return body["trip"]["id"], [day["id"] for day in body["days"]]
+
+
+async def add_activity(api, trip_id, day_id, title, start="09:00", end="10:00", **fields):
+    response = await api.post(f"/trips/{trip_id}/days/{day_id}/activities", json={
+        "title": title, "start_time": start, "end_time": end, **fields,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def intercept(monkeypatch, collection, method, around):
+    """Route collection.method calls through around(call, *args, **kwargs).
+
+    The in-memory driver hands out a new collection object on every attribute
+    access, so the method is patched on the class and filtered by name.
+    """
+    cls = type(collection)
+    original = getattr(cls, method)
+
+    async def intercepted(self, *args, **kwargs):
+        call = functools.partial(original, self)
+        if self.name != collection.name:
+            return await call(*args, **kwargs)
+        return await around(call, *args, **kwargs)
+    monkeypatch.setattr(cls, method, intercepted)
+
+
+def record_reads(monkeypatch, collection) -> list:
+    """Collect the names of the collections queried from now on"""
+    cls = type(collection)
+    queried = []
+    for method in ("find", "find_one", "aggregate", "count_documents"):
+        original = getattr(cls, method)
+
+        def recorded(self, *args, _original=original, **kwargs):
+            queried.append(self.name)
+            return _original(self, *args, **kwargs)
+        monkeypatch.setattr(cls, method, recorded)
+    return queried
@@ -0,0 +1,28 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def rate_limit(monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_PER_SECOND", 0.01)
+    monkeypatch.setattr(server, "RATE_LIMIT_BURST", 1.0)
+    monkeypatch.setattr(server.admission, "buckets", server.OrderedDict())
+
+
+async def test_forged_forwarded_for_does_not_reset_the_bucket(api, rate_limit):
+    statuses = [
+        (await api.get("/trips", headers={"x-forwarded-for": f"10.0.0.{n}"})).status_code for n in range(3)
+    ]
+    assert statuses == [200, 429, 429]
+
+
+async def test_forwarded_for_is_used_once_trusted(api, rate_limit, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_CLIENT_HEADER", "x-forwarded-for")
+    first = await api.get("/trips", headers={"x-forwarded-for": "203.0.113.5, 10.0.0.1"})
+    again = await api.get("/trips", headers={"x-forwarded-for": "203.0.113.5, 10.0.0.1"})
+    other = await api.get("/trips", headers={"x-forwarded-for": "203.0.113.5, 10.0.0.2"})
+    assert (first.status_code, again.status_code, other.status_code) == (200, 429, 200)
+    assert int(again.headers["retry-after"]) >= 1
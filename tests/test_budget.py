@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import server
+from tests.helpers import add_activity, provision
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rollups_follow_edits_without_drift(api, db):
+    trip_id, (first, second) = await provision(api)
+    museum = await add_activity(api, trip_id, first, "museum", cost=12.5, category="culture")
+    lunch = await add_activity(api, trip_id, first, "lunch", "12:00", "13:00", cost=20, category="food")
+    await api.put(f"/activities/{museum['id']}", json={"cost": 15, "day_id": second})
+    await api.delete(f"/activities/{lunch['id']}")
+
+    assert await server.reconcile_rollups(trip_id, repair=False) == []
+    budget = (await api.get(f"/trips/{trip_id}/budget")).json()
+    assert (budget["total"], budget["count"]) == (15, 1)
+
+
+async def test_reconcile_reports_and_repairs_drift(api, db):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "museum", cost=10, category="culture")
+    await db.rollups.update_one({"trip_id": trip_id, "scope": "trip"}, {"$inc": {"total": 5, "count": 1}})
+    await db.rollups.insert_one({"trip_id": trip_id, "scope": "day", "key": "ghost", "total": 3.0, "count": 1})
+
+    drift = await server.reconcile_rollups(trip_id, repair=False)
+    assert len(drift) == 2
+    assert await db.rollups.count_documents({"key": "ghost"}) == 1
+
+    assert len(await server.reconcile_rollups(trip_id)) == 2
+    assert await server.reconcile_rollups(trip_id, repair=False) == []
+    assert await db.rollups.count_documents({"key": "ghost"}) == 0
+    budget = (await api.get(f"/trips/{trip_id}/budget")).json()
+    assert (budget["total"], budget["count"]) == (10, 1)
+
+
+async def test_reconcile_correction_that_races_a_write_does_not_double_count(api, db, monkeypatch):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "museum", cost=10)
+    await db.rollups.update_one({"trip_id": trip_id, "scope": "trip"}, {"$inc": {"total": 5}})
+
+    original = server.compute_rollups
+
+    async def write_while_reconciling(*args, **kwargs):
+        # Lands after the stored rollups were read and before the correction
+        await add_activity(api, trip_id, day, "lunch", "12:00", "13:00", cost=7)
+        return await original(*args, **kwargs)
+    monkeypatch.setattr(server, "compute_rollups", write_while_reconciling)
+    await server.reconcile_rollups(trip_id)
+    monkeypatch.setattr(server, "compute_rollups", original)
+
+    trip_rollup = await db.rollups.find_one({"trip_id": trip_id, "scope": "trip"})
+    # The stale correction missed: the injected drift is still there, the write is counted once
+    assert (trip_rollup["total"], trip_rollup["count"]) == (22, 2)
+    await server.reconcile_rollups(trip_id)
+    budget = (await api.get(f"/trips/{trip_id}/budget")).json()
+    assert (budget["total"], budget["count"]) == (17, 2)
+
+
+async def test_only_one_worker_bootstraps_rollups(api, db):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "museum", cost=10, category="culture")
+    await add_activity(api, trip_id, day, "lunch", "12:00", "13:00", cost=20, category="food")
+    await db.rollups.delete_many({})
+
+    await asyncio.gather(*(server.bootstrap_rollups() for _ in range(4)))
+    assert await db.migrations.count_documents({}) == 1
+    assert await server.reconcile_rollups(trip_id, repair=False) == []
+
+    # Once the marker exists a later start leaves the rollups alone
+    await db.rollups.delete_many({})
+    await server.bootstrap_rollups()
+    assert await db.rollups.count_documents({}) == 0
@@ -0,0 +1,49 @@
+import pytest
+
+from tests.helpers import add_activity, provision, record_reads
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_trip_detail_answers_304_from_the_version_alone(api, db, monkeypatch):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "museum")
+    etag = (await api.get(f"/trips/{trip_id}")).headers["etag"]
+
+    queried = record_reads(monkeypatch, db.trips)
+    response = await api.get(f"/trips/{trip_id}", headers={"if-none-match": etag})
+    assert response.status_code == 304
+    assert queried == ["trips"]
+
+    await add_activity(api, trip_id, day, "lunch", "12:00", "13:00")
+    changed = await api.get(f"/trips/{trip_id}", headers={"if-none-match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+
+async def test_trip_listing_answers_304_without_reading_trips_days_or_activities(api, db, monkeypatch):
+    trip_id, (day, _) = await provision(api)
+    listing = await api.get("/trips")
+    etag = listing.headers["etag"]
+    assert "version" not in listing.json()[0]
+
+    # Activity writes leave the listing, and its entity tag, alone
+    await add_activity(api, trip_id, day, "museum")
+    queried = record_reads(monkeypatch, db.trips)
+    response = await api.get("/trips", headers={"if-none-match": etag})
+    assert response.status_code == 304
+    assert queried == ["counters"]
+    assert await db.counters.find_one({"_id": "trips"}) == {"_id": "trips", "version": 1}
+
+
+async def test_trip_listing_tag_moves_when_trips_come_and_go(api, db):
+    trip_id, _ = await provision(api)
+    first = (await api.get("/trips")).headers["etag"]
+
+    await provision(api)
+    created = await api.get("/trips", headers={"if-none-match": first})
+    assert created.status_code == 200 and len(created.json()) == 2
+
+    await api.delete(f"/trips/{trip_id}")
+    deleted = await api.get("/trips", headers={"if-none-match": created.headers["etag"]})
+    assert deleted.status_code == 200 and len(deleted.json()) == 1
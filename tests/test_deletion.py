@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.helpers import add_activity, provision
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_deleted_trip_disappears_at_once_and_is_purged(api, db, monkeypatch):
+    monkeypatch.setattr(server, "REAPER_BATCH_SIZE", 2)
+    trip_id, (day, _) = await provision(api)
+    for i in range(5):
+        await add_activity(api, trip_id, day, f"stop {i}", cost=1)
+
+    assert (await api.delete(f"/trips/{trip_id}")).status_code == 200
+    assert (await api.get(f"/trips/{trip_id}")).status_code == 404
+    assert (await api.delete(f"/trips/{trip_id}")).status_code == 404
+    for collection in ("trips", "days", "activities", "rollups"):
+        assert await db[collection].count_documents({}) == 0
+
+
+async def test_orphan_sweep_spares_young_children_and_live_trips(api, db):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "kept")
+    old = datetime.now(timezone.utc) - timedelta(seconds=server.ORPHAN_GRACE_SECONDS + 60)
+    await db.activities.insert_many([
+        {"id": "old-orphan", "trip_id": "gone", "day_id": "gone-day", "created_at": old},
+        {"id": "young-orphan", "trip_id": "importing", "day_id": "new-day", "created_at": datetime.now(timezone.utc)},
+    ])
+    await db.days.insert_one({"id": "gone-day", "trip_id": "gone", "created_at": old})
+
+    assert await server.sweep_orphans() == 2
+    remaining = {activity["id"] for activity in await db.activities.find({}).to_list(None)}
+    assert "old-orphan" not in remaining and "young-orphan" in remaining
+    assert await db.activities.count_documents({"trip_id": trip_id}) == 1
+    assert await db.days.count_documents({"trip_id": trip_id}) == 2
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+import orjson
+import pytest
+
+import server
+
+
+class ScriptedPubSub:
+    """Stands in for a redis.asyncio PubSub: yields its events, then fails or waits forever"""
+
+    def __init__(self, events, then_fail):
+        self.events = events
+        self.then_fail = then_fail
+        self.closed = False
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        yield {"type": "subscribe", "data": 1}
+        for event in self.events:
+            yield {"type": "message", "data": orjson.dumps(event)}
+        if self.then_fail:
+            raise ConnectionError("Connection reset by peer")
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+class ScriptedRedis:
+    def __init__(self, *pubsubs):
+        self.pubsubs = list(pubsubs)
+
+    def pubsub(self):
+        return self.pubsubs.pop(0)
+
+
+@pytest.mark.anyio
+async def test_redis_broker_resubscribes_after_the_connection_drops(monkeypatch, caplog):
+    monkeypatch.setattr(server, "CHANGE_BROKER_RETRY_SECONDS", 0.01)
+    dropping = ScriptedPubSub([{"type": "activity.created", "trip_id": "trip-a", "ids": ["one"]}], then_fail=True)
+    steady = ScriptedPubSub([{"type": "activity.created", "trip_id": "trip-a", "ids": ["two"]}], then_fail=False)
+    # Built without __init__, which needs the redis package
+    broker = server.RedisChangeBroker.__new__(server.RedisChangeBroker)
+    server.ChangeBroker.__init__(broker)
+    broker.redis = ScriptedRedis(dropping, steady)
+    broker._listener = None
+    hub = server.ChangeHub(broker, 8)
+    subscription = hub.subscribe("trip-a")
+
+    with caplog.at_level(logging.INFO):
+        await broker.start()
+        events = [await subscription.get(1) for _ in range(3)]
+        await broker.stop()
+
+    assert [(event["type"], event["ids"]) for event in events] == [
+        ("activity.created", ["one"]), ("resync", []), ("activity.created", ["two"]),
+    ]
+    assert dropping.closed
+    assert "lost its Redis subscription" in caplog.text and "resubscribed" in caplog.text
+
+
+class SocketClient:
+    """Drives the WebSocket route at the ASGI level, so the test controls when the client leaves"""
+
+    def __init__(self, trip_id, fail_sends=False):
+        self.scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": f"/api/trips/{trip_id}/ws",
+            "raw_path": f"/api/trips/{trip_id}/ws".encode(), "query_string": b"", "root_path": "",
+            "headers": [], "client": ("127.0.0.1", 50000), "server": ("test", 80), "subprotocols": [],
+        }
+        self.incoming = asyncio.Queue()
+        self.incoming.put_nowait({"type": "websocket.connect"})
+        self.accepted = asyncio.Event()
+        self.fail_sends = fail_sends
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif self.fail_sends:
+            raise OSError("Broken pipe")
+        self.sent.append(message)
+
+    def leave(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1001})
+
+
+@pytest.mark.anyio
+async def test_websocket_handler_ends_as_soon_as_the_client_leaves(db, monkeypatch):
+    monkeypatch.setattr(server, "EVENT_HEARTBEAT_SECONDS", 30)
+    client = SocketClient("trip-a")
+    handler = asyncio.create_task(server.app(client.scope, client.receive, client.send))
+    await asyncio.wait_for(client.accepted.wait(), 1)
+    assert server.change_hub.stats()["subscribers"] == 1
+
+    client.leave()
+    # Used to sit in subscription.get until the next event or heartbeat
+    await asyncio.wait_for(handler, 1)
+    assert server.change_hub.stats()["subscribers"] == 0
+
+
+@pytest.mark.anyio
+async def test_websocket_send_to_a_vanished_client_ends_quietly(db):
+    client = SocketClient("trip-a", fail_sends=True)
+    handler = asyncio.create_task(server.app(client.scope, client.receive, client.send))
+    await asyncio.wait_for(client.accepted.wait(), 1)
+
+    server.change_hub.deliver({"type": "activity.created", "trip_id": "trip-a", "ids": ["one"]})
+    await asyncio.wait_for(handler, 1)
+    assert handler.exception() is None
+    assert server.change_hub.stats()["subscribers"] == 0
@@ -0,0 +1,112 @@
+import orjson
+import pytest
+
+import server
+from tests.helpers import add_activity, provision
+
+pytestmark = pytest.mark.anyio
+
+MUSEUM_POINT = {"type": "Point", "coordinates": [2.3376, 48.8606]}
+
+
+def ndjson(*records):
+    return b"".join(orjson.dumps(record) + b"\n" for record in records)
+
+
+async def day_layout(api, trip_id):
+    details = (await api.get(f"/trips/{trip_id}")).json()
+    return [
+        [(activity["title"], activity["location_text"], activity["location"])
+         for activity in sorted(details["activities"], key=lambda a: a["order_index"]) if activity["day_id"] == day["id"]]
+        for day in details["days"]
+    ]
+
+
+async def test_ndjson_export_imports_back_with_order_and_location(api, db):
+    trip_id, (first, second) = await provision(api)
+    museum = await add_activity(api, trip_id, first, "museum", location_text="Louvre", location=MUSEUM_POINT)
+    lunch = await add_activity(api, trip_id, first, "lunch", "12:00", "13:00")
+    hike = await add_activity(api, trip_id, second, "hike")
+    await api.post(f"/trips/{trip_id}/activities/reorder", json={"updates": [
+        {"id": lunch["id"], "day_id": first, "order_index": 0},
+        {"id": museum["id"], "day_id": first, "order_index": 1},
+        {"id": hike["id"], "day_id": second, "order_index": 0},
+    ]})
+
+    export = await api.get(f"/trips/{trip_id}/export", params={"format": "ndjson"})
+    response = await api.post("/trips/import", content=export.content)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["days"], body["activities"]) == (2, 3)
+    copy_id = body["trip"]["id"]
+    assert copy_id != trip_id
+
+    assert await day_layout(api, copy_id) == await day_layout(api, trip_id) == [
+        [("lunch", None, None), ("museum", "Louvre", MUSEUM_POINT)],
+        [("hike", None, None)],
+    ]
+    assert await server.reconcile_rollups(copy_id, repair=False) == []
+
+
+async def test_import_reports_the_line_of_a_bad_record(api, db):
+    response = await api.post("/trips/import", content=ndjson(
+        {"type": "trip", "title": "Imported", "date_start": "2025-01-01", "date_end": "2025-01-01"},
+        {"type": "day", "id": "d1", "date": "2025-01-01", "index": 0},
+        {"type": "activity", "day_id": "d1", "title": "ok", "start_time": "09:00", "end_time": "10:00"},
+        {"type": "activity", "day_id": "d1", "start_time": "11:00", "end_time": "12:00"},
+    ))
+    assert response.status_code == 422
+    assert [(problem["line"], problem["field"]) for problem in response.json()["detail"]] == [(4, "title")]
+
+
+async def test_import_reports_the_line_of_an_unknown_day(api, db):
+    response = await api.post("/trips/import", content=ndjson(
+        {"type": "trip", "title": "Imported", "date_start": "2025-01-01", "date_end": "2025-01-01"},
+        {"type": "day", "id": "d1", "date": "2025-01-01", "index": 0},
+        {"type": "activity", "day_id": "elsewhere", "title": "lost", "start_time": "09:00", "end_time": "10:00"},
+    ))
+    assert response.status_code == 422
+    assert response.json()["detail"] == [{"line": 3, "field": "day_id", "error": "Unknown day"}]
+
+
+async def test_failed_import_removes_what_it_already_wrote(api, db, monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_BATCH_SIZE", 2)
+    records = [
+        {"type": "trip", "title": "Imported", "date_start": "2025-01-01", "date_end": "2025-01-03"},
+        *({"type": "day", "id": f"d{n}", "date": f"2025-01-0{n + 1}", "index": n} for n in range(3)),
+        *({"type": "activity", "day_id": "d0", "title": f"a{n}", "start_time": "09:00", "end_time": "10:00"}
+          for n in range(5)),
+        {"type": "activity", "day_id": "d0", "title": "broken", "start_time": "09:00"},
+    ]
+    response = await api.post("/trips/import", content=ndjson(*records))
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["line"] == len(records)
+    assert (await db.trips.count_documents({}), await db.days.count_documents({}),
+            await db.activities.count_documents({})) == (0, 0, 0)
+
+
+async def export_ics(api, trip_id):
+    response = await api.get(f"/trips/{trip_id}/export", params={"format": "ics"})
+    assert response.status_code == 200
+    return response.content.decode()
+
+
+async def test_ics_event_past_midnight_ends_the_next_day(api, db):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "night train", "23:00", "01:30")
+    calendar = await export_ics(api, trip_id)
+    assert "DTSTART:20250101T230000\r\n" in calendar
+    assert "DTEND:20250102T013000\r\n" in calendar
+
+
+async def test_ics_folds_long_lines_without_splitting_characters(api, db):
+    trip_id, (day, _) = await provision(api)
+    notes = "Dégustation de fromages, puis promenade le long de la Seine jusqu'à Notre-Dame " * 3
+    await add_activity(api, trip_id, day, "tasting", notes=notes)
+    calendar = await export_ics(api, trip_id)
+
+    lines = calendar.split("\r\n")
+    assert all(len(line.encode()) <= 75 for line in lines)
+    unfolded = calendar.replace("\r\n ", "")
+    assert f"DESCRIPTION:{server.ics_escape(notes)}\r\n" in unfolded
+    assert calendar.startswith("BEGIN:VCALENDAR\r\n") and calendar.endswith("END:VCALENDAR\r\n")
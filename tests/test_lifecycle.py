@@ -0,0 +1,101 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+@pytest.fixture
+def lifespan_config(monkeypatch, db):
+    # mongomock cannot explain() queries
+    monkeypatch.setattr(server, "INDEX_CHECK", "off")
+    monkeypatch.setattr(server, "REAPER_INTERVAL_SECONDS", 3600)
+    monkeypatch.setattr(server, "ROLLUP_RECONCILE_SECONDS", 3600)
+    monkeypatch.setattr(server, "ORPHAN_SWEEP_SECONDS", 3600)
+
+
+async def test_ready_only_between_start_up_and_shut_down(api, lifespan_config):
+    assert (await api.get("/health/ready")).status_code == 503
+    async with server.lifespan(server.app):
+        ready = await api.get("/health/ready")
+        assert ready.status_code == 200 and ready.json()["status"] == "ready"
+        tasks = list(server.app.state.background_tasks)
+        assert len(tasks) == 3 and not any(task.done() for task in tasks)
+    await asyncio.sleep(0)
+    assert all(task.cancelled() for task in tasks)
+    assert (await api.get("/health/ready")).status_code == 503
+    assert (await api.get("/health/live")).status_code == 200
+
+
+async def test_not_ready_when_mongo_stops_answering(api, db, lifespan_config, monkeypatch):
+    async with server.lifespan(server.app):
+        async def unreachable(*args, **kwargs):
+            raise ConnectionError("no primary")
+        monkeypatch.setattr(db, "command", unreachable)
+        response = await api.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()["mongo"] == "ConnectionError"
+
+
+def test_several_workers_never_use_the_per_process_cache():
+    probe = "import server; print(server.TRIP_CACHE_BACKEND, type(server.trip_cache).__name__)"
+    env = {**os.environ, "WEB_CONCURRENCY": "2", "TRIP_CACHE_BACKEND": "memory"}
+    output = subprocess.run([sys.executable, "-c", probe], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["off", "SnapshotCache"]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_MONGO_URL"), reason="needs a mongod at TEST_MONGO_URL")
+def test_multi_worker_start_serves_consistent_reads():
+    pytest.importorskip("gunicorn")
+    port = free_port()
+    env = {
+        **os.environ, "PORT": str(port), "WEB_CONCURRENCY": "2",
+        "MONGO_URL": os.environ["TEST_MONGO_URL"], "DB_NAME": f"tripflow_test_{port}",
+    }
+    process = subprocess.Popen(["bash", "start.sh"], cwd=BACKEND_DIR, env=env, start_new_session=True)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}/api", timeout=10) as client:
+            deadline = time.monotonic() + 60
+            while True:
+                assert process.poll() is None, "start.sh exited"
+                try:
+                    if client.get("/health/ready").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                assert time.monotonic() < deadline, "workers never became ready"
+                time.sleep(0.25)
+
+            trip = client.post("/trips/provision", json={
+                "title": "v0", "date_start": "2025-01-01", "date_end": "2025-01-02",
+            }).json()["trip"]
+            day_id = client.get(f"/trips/{trip['id']}").json()["days"][0]["id"]
+            for round_number in range(20):
+                # A new connection per request lets either worker answer
+                headers = {"Connection": "close"}
+                client.post(f"/trips/{trip['id']}/days/{day_id}/activities", headers=headers, json={
+                    "title": f"stop {round_number}", "start_time": "09:00", "end_time": "09:30",
+                })
+                details = client.get(f"/trips/{trip['id']}", headers=headers).json()
+                assert len(details["activities"]) == round_number + 1
+    finally:
+        os.killpg(process.pid, 15)
+        process.wait(timeout=30)
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.helpers import provision
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_trips(db, count):
+    # Pairs of trips share a created_at, so the id has to break ties
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    trips = [{
+        "id": f"trip-{index:03d}", "title": f"Trip {index}", "date_start": "2025-01-01", "date_end": "2025-01-02",
+        "created_at": base + timedelta(minutes=index // 2), "updated_at": base,
+    } for index in range(count)]
+    await db.trips.insert_many([dict(trip) for trip in trips])
+    return sorted(trips, key=lambda trip: (trip["created_at"], trip["id"]), reverse=True)
+
+
+async def list_all(api, limit):
+    seen, cursor = [], None
+    while True:
+        response = await api.get("/trips", params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        seen.extend(trip["id"] for trip in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return seen
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7, 50])
+async def test_pages_cover_every_trip_once_in_order(api, db, limit):
+    expected = [trip["id"] for trip in await seed_trips(db, 23)]
+    assert await list_all(api, limit) == expected
+
+
+async def test_trips_created_while_paging_do_not_shift_later_pages(api, db):
+    expected = [trip["id"] for trip in await seed_trips(db, 6)]
+    first = await api.get("/trips", params={"limit": 3})
+    await provision(api)  # Newest trip, lands before the cursor
+    rest = await api.get("/trips", params={"limit": 3, "cursor": first.headers["x-next-cursor"]})
+    assert [trip["id"] for trip in first.json() + rest.json()] == expected
+
+
+async def test_malformed_cursor_is_rejected(api, db):
+    assert (await api.get("/trips", params={"cursor": "not-a-cursor"})).status_code == 400
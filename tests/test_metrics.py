@@ -0,0 +1,40 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def call(app, path):
+    scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+    await server.MetricsMiddleware(app)(scope, receive, send)
+
+
+def responding_with(content_type):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+@pytest.fixture
+def latency(monkeypatch):
+    histogram = server.Histogram("test_latency", "Test.", server.REQUEST_LABELS, [1.0])
+    monkeypatch.setattr(server, "request_latency", histogram)
+    return histogram
+
+
+async def test_event_streams_are_left_out_of_request_metrics(latency):
+    await call(responding_with(b"text/event-stream; charset=utf-8"), "/api/trips/t/events")
+    assert latency.series == {}
+
+
+async def test_other_responses_are_recorded(latency):
+    await call(responding_with(b"application/json"), "/api/trips")
+    assert sum(series["count"] for series in latency.series.values()) == 1
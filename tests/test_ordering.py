@@ -0,0 +1,160 @@
+import random
+
+import pytest
+
+import server
+from tests.helpers import add_activity, provision
+
+pytestmark = pytest.mark.anyio
+
+
+def test_rank_between_stays_strictly_between():
+    generator = random.Random(7)
+    keys = [server.rank_between()]
+    for _ in range(500):
+        position = generator.randint(0, len(keys))
+        before = keys[position - 1] if position > 0 else None
+        after = keys[position] if position < len(keys) else None
+        key = server.rank_between(before, after)
+        assert (before is None or before < key) and (after is None or key < after)
+        keys.insert(position, key)
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 61, 62, 63, 1000, 4000])
+def test_spaced_ranks_are_ascending_and_leave_room(count):
+    ranks = server.spaced_ranks(count)
+    assert len(ranks) == count
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == count
+    if ranks:
+        # Room for an insert before the first key and after the last
+        assert server.rank_between(None, ranks[0]) < ranks[0]
+        assert server.rank_between(ranks[-1]) > ranks[-1]
+
+
+@pytest.fixture
+def rank_mode(monkeypatch):
+    monkeypatch.setattr(server, "ACTIVITY_ORDERING", "rank")
+
+
+async def day_titles(api, trip_id, day_id):
+    details = (await api.get(f"/trips/{trip_id}")).json()
+    activities = sorted((a for a in details["activities"] if a["day_id"] == day_id), key=lambda a: a["rank"])
+    return [activity["title"] for activity in activities]
+
+
+async def test_cross_day_move_writes_one_document(api, db, rank_mode):
+    trip_id, (day_a, day_b) = await provision(api)
+    first = [await add_activity(api, trip_id, day_a, f"a{i}", f"{8 + i:02d}:00", f"{8 + i:02d}:30") for i in range(3)]
+    second = [await add_activity(api, trip_id, day_b, f"b{i}", f"{8 + i:02d}:00", f"{8 + i:02d}:30") for i in range(2)]
+
+    # The planner sends the whole trip: a1 goes to the top of day B and day A is renumbered
+    updates = [
+        {"id": first[0]["id"], "day_id": day_a, "order_index": 0},
+        {"id": first[2]["id"], "day_id": day_a, "order_index": 1},
+        {"id": first[1]["id"], "day_id": day_b, "order_index": 0},
+        {"id": second[0]["id"], "day_id": day_b, "order_index": 1},
+        {"id": second[1]["id"], "day_id": day_b, "order_index": 2},
+    ]
+    response = await api.post(f"/trips/{trip_id}/activities/reorder", json={"updates": updates})
+    assert response.json()["changed"] == 1
+
+    moved = await db.activities.find_one({"id": first[1]["id"]})
+    assert moved["day_id"] == day_b
+    assert moved["revision"] == 1
+    assert await day_titles(api, trip_id, day_a) == ["a0", "a2"]
+    assert await day_titles(api, trip_id, day_b) == ["a1", "b0", "b1"]
+
+
+async def test_random_reorders_match_requested_order(api, db, rank_mode):
+    trip_id, days = await provision(api, days=3)
+    activities = [
+        await add_activity(api, trip_id, days[i % 3], f"t{i}", f"{6 + i // 3:02d}:00", f"{6 + i // 3:02d}:10")
+        for i in range(12)
+    ]
+    layout = {day_id: [a["id"] for a in activities if a["day_id"] == day_id] for day_id in days}
+    generator = random.Random(3)
+    for _ in range(25):
+        source = generator.choice([day_id for day_id in days if layout[day_id]])
+        card = layout[source].pop(generator.randrange(len(layout[source])))
+        target = generator.choice(days)
+        layout[target].insert(generator.randint(0, len(layout[target])), card)
+        updates = [
+            {"id": activity_id, "day_id": day_id, "order_index": position}
+            for day_id in days for position, activity_id in enumerate(layout[day_id])
+        ]
+        response = await api.post(f"/trips/{trip_id}/activities/reorder", json={"updates": updates})
+        assert response.json()["changed"] <= 1 or source == target
+
+        stored = await db.activities.find({"trip_id": trip_id}).sort("rank", 1).to_list(None)
+        for day_id in days:
+            assert [a["id"] for a in stored if a["day_id"] == day_id] == layout[day_id]
+
+
+async def test_dense_reorder_writes_only_moved_rows(api, db):
+    trip_id, (day_a, day_b) = await provision(api)
+    activities = [await add_activity(api, trip_id, day_a, f"a{i}", f"{8 + i:02d}:00", f"{8 + i:02d}:30") for i in range(4)]
+    ids = [activity["id"] for activity in activities]
+
+    # Swap the middle two; the first and last keep their order_index
+    order = [ids[0], ids[2], ids[1], ids[3]]
+    updates = [{"id": activity_id, "day_id": day_a, "order_index": position} for position, activity_id in enumerate(order)]
+    response = await api.post(f"/trips/{trip_id}/activities/reorder", json={"updates": updates})
+    assert response.json()["changed"] == 2
+
+    stored = {activity["id"]: activity for activity in await db.activities.find({"trip_id": trip_id}).to_list(None)}
+    assert [stored[activity_id]["revision"] for activity_id in ids] == [0, 1, 1, 0]
+    assert sorted(stored, key=lambda activity_id: stored[activity_id]["order_index"]) == order
+
+
+async def test_reorder_rejects_a_day_from_another_trip(api, db):
+    trip_id, (day, _) = await provision(api)
+    _, (other_day, _) = await provision(api)
+    activity = await add_activity(api, trip_id, day, "museum")
+
+    response = await api.post(f"/trips/{trip_id}/activities/reorder", json={"updates": [
+        {"id": activity["id"], "day_id": other_day, "order_index": 0},
+    ]})
+    assert response.status_code == 400
+    stored = await db.activities.find_one({"id": activity["id"]})
+    assert (stored["day_id"], stored["revision"]) == (day, 0)
+
+
+@pytest.mark.parametrize("method", ["put", "patch"])
+async def test_edit_that_moves_an_activity_appends_it_to_the_new_day(api, db, rank_mode, method):
+    trip_id, (day_a, day_b) = await provision(api)
+    moving = await add_activity(api, trip_id, day_a, "moving")
+    resident = await add_activity(api, trip_id, day_b, "resident")
+    assert moving["rank"] == resident["rank"]
+
+    if method == "put":
+        response = await api.put(f"/activities/{moving['id']}", json={"day_id": day_b})
+    else:
+        response = await api.patch(f"/trips/{trip_id}/activities", json={"updates": [{"id": moving["id"], "day_id": day_b}]})
+    assert response.status_code == 200
+
+    assert await day_titles(api, trip_id, day_b) == ["resident", "moving"]
+    stored = await db.activities.find_one({"id": moving["id"]})
+    assert stored["rank"] > resident["rank"]
+
+
+async def test_edit_within_the_same_day_keeps_the_rank(api, db, rank_mode):
+    trip_id, (day, _) = await provision(api)
+    first = await add_activity(api, trip_id, day, "first")
+    await add_activity(api, trip_id, day, "second", "11:00", "12:00")
+    await api.put(f"/activities/{first['id']}", json={"day_id": day, "notes": "same day"})
+    assert await day_titles(api, trip_id, day) == ["first", "second"]
+
+
+async def test_put_rejects_a_day_from_another_trip(api, db):
+    trip_id, (day, _) = await provision(api)
+    _, (other_day, _) = await provision(api)
+    activity = await add_activity(api, trip_id, day, "museum")
+
+    response = await api.put(f"/activities/{activity['id']}", json={"day_id": other_day})
+    assert response.status_code == 400
+    assert (await db.activities.find_one({"id": activity["id"]}))["day_id"] == day
+    missing = await api.put("/activities/no-such-activity", json={"day_id": day})
+    assert missing.status_code == 404
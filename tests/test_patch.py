@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import server
+from tests.helpers import add_activity, intercept, provision
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_patch_classifies_landed_stale_and_missing(api, db):
+    trip_id, (day, _) = await provision(api)
+    fresh = await add_activity(api, trip_id, day, "fresh", cost=10)
+    stale = await add_activity(api, trip_id, day, "stale", "11:00", "12:00")
+    await api.put(f"/activities/{stale['id']}", json={"notes": "edited elsewhere"})
+
+    response = await api.patch(f"/trips/{trip_id}/activities", json={"updates": [
+        {"id": fresh["id"], "revision": 0, "cost": 25},
+        {"id": stale["id"], "revision": 0, "title": "lost edit"},
+        {"id": "no-such-activity", "title": "x"},
+    ]})
+    assert response.status_code == 409
+    body = response.json()
+    assert [(a["id"], a["cost"], a["revision"]) for a in body["activities"]] == [(fresh["id"], 25, 1)]
+    assert [(a["id"], a["title"], a["revision"]) for a in body["conflicts"]] == [(stale["id"], "stale", 1)]
+    assert body["missing"] == ["no-such-activity"]
+    assert (await db.activities.find_one({"id": stale["id"]}))["title"] == "stale"
+    assert await server.reconcile_rollups(trip_id, repair=False) == []
+
+
+async def test_patch_that_landed_is_reported_even_if_rewritten_straight_after(api, db, monkeypatch):
+    trip_id, (day, _) = await provision(api)
+    activity = await add_activity(api, trip_id, day, "museum", cost=5)
+
+    async def then_another_writer(call, *args, **kwargs):
+        result = await call(*args, **kwargs)
+        await db.activities.update_one({"id": activity["id"]}, {"$set": {"notes": "later edit"}, "$inc": {"revision": 1}})
+        return result
+    intercept(monkeypatch, db.activities, "find_one_and_update", then_another_writer)
+
+    response = await api.patch(f"/trips/{trip_id}/activities", json={"updates": [
+        {"id": activity["id"], "revision": 0, "cost": 40},
+    ]})
+    assert response.status_code == 200
+    assert response.json()["activities"][0]["cost"] == 40
+    budget = (await api.get(f"/trips/{trip_id}/budget")).json()
+    assert budget["total"] == 40
+
+
+async def test_patch_rejects_a_day_from_another_trip(api, db):
+    trip_id, (day, _) = await provision(api)
+    other_trip_id, (other_day, _) = await provision(api)
+    activity = await add_activity(api, trip_id, day, "museum")
+
+    response = await api.patch(f"/trips/{trip_id}/activities", json={"updates": [
+        {"id": activity["id"], "day_id": other_day},
+    ]})
+    assert response.status_code == 400
+    assert (await db.activities.find_one({"id": activity["id"]}))["day_id"] == day
+
+
+async def test_patch_batches_are_capped(api, db):
+    trip_id, _ = await provision(api)
+    response = await api.patch(f"/trips/{trip_id}/activities", json={"updates": [
+        {"id": f"activity-{n}", "title": "x"} for n in range(server.PATCH_MAX_UPDATES + 1)
+    ]})
+    assert response.status_code == 422
+
+
+async def test_patch_bounds_the_writes_in_flight(api, db, monkeypatch):
+    trip_id, (day, _) = await provision(api)
+    activities = [await add_activity(api, trip_id, day, f"a{n}", f"{8 + n:02d}:00", f"{8 + n:02d}:30") for n in range(6)]
+    monkeypatch.setattr(server, "PATCH_CONCURRENCY", 2)
+
+    in_flight, peak = 0, 0
+
+    async def counted(call, *args, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            in_flight -= 1
+    intercept(monkeypatch, db.activities, "find_one_and_update", counted)
+
+    response = await api.patch(f"/trips/{trip_id}/activities", json={"updates": [
+        {"id": activity["id"], "cost": 5} for activity in activities
+    ]})
+    assert response.status_code == 200
+    assert len(response.json()["activities"]) == 6
+    assert peak == 2
+
+
+def test_patch_route_is_gated():
+    gate = server.admission.gate_for("PATCH", "/api/trips/some-trip/activities")
+    assert gate is not None and gate.name == "activity_patch"
@@ -0,0 +1,56 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.helpers import intercept
+
+pytestmark = pytest.mark.anyio
+
+
+def trip(start, end):
+    return server.Trip(title="Trip", date_start=start, date_end=end)
+
+
+def test_days_cover_the_date_range_inclusively():
+    days = server.expand_trip_days(trip("2024-02-27", "2024-03-01"))
+    assert [(day.date, day.index) for day in days] == [
+        ("2024-02-27", 1), ("2024-02-28", 2), ("2024-02-29", 3), ("2024-03-01", 4),
+    ]
+    assert [day.date for day in server.expand_trip_days(trip("2025-05-05", "2025-05-05"))] == ["2025-05-05"]
+
+
+def test_reversed_dates_are_rejected():
+    with pytest.raises(HTTPException) as error:
+        server.expand_trip_days(trip("2025-01-10", "2025-01-09"))
+    assert error.value.status_code == 400
+
+
+def test_trips_are_limited_to_max_trip_days(monkeypatch):
+    monkeypatch.setattr(server, "MAX_TRIP_DAYS", 3)
+    assert len(server.expand_trip_days(trip("2025-01-01", "2025-01-03"))) == 3
+    with pytest.raises(HTTPException) as error:
+        server.expand_trip_days(trip("2025-01-01", "2025-01-04"))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("start, end", [("01/02/2025", "2025-01-05"), ("2025-01-01", "next friday"), ("2025-1-1", "2025-1-2")])
+def test_non_iso_dates_are_rejected(start, end):
+    with pytest.raises(HTTPException) as error:
+        server.expand_trip_days(trip(start, end))
+    assert error.value.status_code == 400
+
+
+async def test_provision_rejects_bad_dates_without_writing(api, db):
+    response = await api.post("/trips/provision", json={"title": "Trip", "date_start": "2025-01-10", "date_end": "2025-01-01"})
+    assert response.status_code == 400
+    assert (await db.trips.count_documents({}), await db.days.count_documents({})) == (0, 0)
+
+
+async def test_failed_trip_insert_removes_the_days_already_written(api, db, monkeypatch):
+    async def failing(call, *args, **kwargs):
+        raise RuntimeError("primary stepped down")
+    intercept(monkeypatch, db.trips, "insert_one", failing)
+
+    with pytest.raises(RuntimeError):
+        await api.post("/trips/provision", json={"title": "Trip", "date_start": "2025-01-01", "date_end": "2025-01-05"})
+    assert (await db.trips.count_documents({}), await db.days.count_documents({})) == (0, 0)
@@ -0,0 +1,106 @@
+import random
+
+import numpy as np
+import pytest
+
+from routing import haversine_matrix, nearest_neighbour_route, route_length, solve_route, two_opt
+from tests.helpers import add_activity, provision
+
+SPEED_KMH = 30
+ALL_DAY = (9 * 60, 20 * 60)
+
+
+def stop(stop_id, lng, lat):
+    return {"id": stop_id, "location": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+def test_haversine_matrix_matches_known_distances():
+    distances = haversine_matrix(np.array([[2.3522, 48.8566], [-0.1276, 51.5072], [2.3522, 48.8566]]))
+    assert distances[0, 1] == pytest.approx(343.6, abs=0.5)
+    assert np.allclose(distances, distances.T)
+    assert np.allclose(np.diag(distances), 0) and distances[0, 2] == pytest.approx(0)
+
+
+def test_a_stop_that_closes_early_is_visited_first():
+    stops = [stop("near", 2.30, 48.85), stop("next door", 2.31, 48.85), stop("far", 2.90, 48.85)]
+    intervals = [ALL_DAY, ALL_DAY, (9 * 60, 9 * 60 + 30)]
+
+    proposal = solve_route(stops, intervals, SPEED_KMH)
+    assert proposal["order"][0] == "far"
+    assert proposal["current"]["late_minutes"] > 0
+    assert proposal["proposed"]["late_minutes"] == 0
+
+
+def test_unlocated_stops_keep_their_slots():
+    activities = [
+        stop("c", 2.40, 48.85), {"id": "call home"}, stop("a", 2.30, 48.85),
+        {"id": "rest", "location": None}, stop("b", 2.35, 48.85),
+    ]
+    proposal = solve_route(activities, [None] * len(activities), SPEED_KMH)
+    assert proposal["order"][1] == "call home" and proposal["order"][3] == "rest"
+    assert [proposal["order"][slot] for slot in (0, 2, 4)] in (["a", "b", "c"], ["c", "b", "a"])
+    assert proposal["unlocated"] == ["call home", "rest"]
+    assert proposal["proposed"]["distance_km"] < proposal["current"]["distance_km"]
+
+
+def test_an_order_that_cannot_improve_is_kept():
+    activities = [stop("a", 2.30, 48.85), stop("b", 2.35, 48.85), stop("c", 2.40, 48.85)]
+    proposal = solve_route(activities, [None] * 3, SPEED_KMH)
+    assert proposal["order"] == ["a", "b", "c"]
+    assert proposal["proposed"] == proposal["current"]
+    assert solve_route(activities[:1], [None], SPEED_KMH)["order"] == ["a"]
+
+
+def test_two_opt_untangles_a_route_along_a_line():
+    points = np.array([[2.30 + 0.01 * position, 48.85] for position in range(8)])
+    distances = haversine_matrix(points)
+    travel = (distances / SPEED_KMH * 60).tolist()
+    windows = [[-np.inf, np.inf]] * 8
+    tangled = [0, 5, 2, 7, 4, 1, 6, 3]
+
+    improved = two_opt(tangled, distances, travel, windows)
+    assert sorted(improved) == list(range(8))
+    assert route_length(improved, distances) == pytest.approx(route_length(list(range(8)), distances))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_proposals_are_never_worse_than_the_current_order(seed):
+    rng = random.Random(seed)
+    activities, intervals = [], []
+    for number in range(rng.randint(2, 7)):
+        activities.append(stop(f"s{number}", 2.25 + rng.random() * 0.2, 48.81 + rng.random() * 0.1))
+        opens = rng.randint(8 * 60, 18 * 60)
+        intervals.append((opens, opens + rng.randint(30, 180)) if rng.random() < 0.7 else None)
+
+    proposal = solve_route(activities, intervals, SPEED_KMH)
+    assert sorted(proposal["order"]) == sorted(activity["id"] for activity in activities)
+    current, proposed = proposal["current"], proposal["proposed"]
+    assert (proposed["late_minutes"], proposed["distance_km"]) <= (current["late_minutes"], current["distance_km"])
+
+
+def test_nearest_neighbour_never_strands_a_stop_that_closes_first():
+    rng = random.Random(11)
+    for _ in range(50):
+        count = rng.randint(2, 6)
+        points = np.array([[2.25 + rng.random() * 0.2, 48.81 + rng.random() * 0.1] for _ in range(count)])
+        windows = [[opens, opens + 60] for opens in (rng.randint(8 * 60, 12 * 60) for _ in range(count))]
+        order = nearest_neighbour_route(haversine_matrix(points), windows)
+        assert sorted(order) == list(range(count))
+        # Every step goes to a stop that opens before the earliest deadline still ahead
+        for position in range(1, count):
+            assert windows[order[position]][0] <= min(windows[stop][1] for stop in order[position:])
+
+
+@pytest.mark.anyio
+async def test_day_route_endpoint_applies_the_proposal(api, db):
+    trip_id, (day, _) = await provision(api)
+    for title, lng in (("c", 2.40), ("a", 2.30), ("b", 2.35)):
+        await add_activity(api, trip_id, day, title, location={"type": "Point", "coordinates": [lng, 48.85]})
+
+    proposal = (await api.get(f"/trips/{trip_id}/days/{day}/route")).json()
+    applied = (await api.post(f"/trips/{trip_id}/days/{day}/route")).json()
+    assert applied["order"] == proposal["order"] and applied["changed"] > 0
+
+    details = (await api.get(f"/trips/{trip_id}")).json()
+    stored = [a["id"] for a in sorted(details["activities"], key=lambda activity: activity["order_index"])]
+    assert stored == proposal["order"]
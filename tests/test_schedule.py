@@ -0,0 +1,51 @@
+import itertools
+import random
+
+import pytest
+
+import server
+from tests.helpers import add_activity, provision
+
+pytestmark = pytest.mark.anyio
+
+
+def brute_force(intervals):
+    pairs = set()
+    for (start_a, end_a, a), (start_b, end_b, b) in itertools.combinations(intervals, 2):
+        overlap = min(end_a, end_b) - max(start_a, start_b)
+        if overlap > 0 and end_a > start_a and end_b > start_b:
+            pairs.add((frozenset((a, b)), overlap))
+    return pairs
+
+
+def test_find_overlaps_matches_brute_force():
+    generator = random.Random(11)
+    for _ in range(200):
+        intervals = []
+        for item in range(generator.randint(0, 12)):
+            start = generator.randint(0, 3 * server.MINUTES_PER_DAY)
+            intervals.append((start, start + generator.randint(0, 300), f"a{item}"))
+        found = server.find_overlaps(intervals)
+        assert len(found) == len(brute_force(intervals))
+        assert {(frozenset((a, b)), minutes) for a, b, minutes in found} == brute_force(intervals)
+
+
+def test_activity_past_midnight_runs_into_the_next_day():
+    days = [{"id": "d1", "date": "2025-01-01"}, {"id": "d2", "date": "2025-01-02"}]
+    activities = [
+        {"id": "late", "day_id": "d1", "start_time": "23:00", "end_time": "01:00"},
+        {"id": "early", "day_id": "d2", "start_time": "00:30", "end_time": "01:30"},
+        {"id": "after", "day_id": "d2", "start_time": "01:30", "end_time": "02:00"},
+    ]
+    assert server.find_overlaps(server.trip_timeline(days, activities)) == [("late", "early", 30)]
+
+
+async def test_conflicts_endpoint_reports_past_midnight_overlap(api):
+    trip_id, (first, second) = await provision(api)
+    late = await add_activity(api, trip_id, first, "night train", "23:00", "01:00")
+    early = await add_activity(api, trip_id, second, "arrival", "00:30", "01:30")
+    await add_activity(api, trip_id, second, "breakfast", "08:00", "09:00")
+
+    body = (await api.get(f"/trips/{trip_id}/conflicts")).json()
+    assert sorted(body["activity_ids"]) == sorted([late["id"], early["id"]])
+    assert len(body["conflicts"]) == 1
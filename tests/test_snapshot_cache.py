@@ -0,0 +1,58 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def memory_cache():
+    return server.MemorySnapshotCache(ttl=60, max_bytes=1 << 20)
+
+
+def redis_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Lua scripting in fakeredis
+    cache = server.RedisSnapshotCache("redis://localhost:6379/0", ttl=60)
+    cache.redis = fakeredis.aioredis.FakeRedis()
+    cache._set_if_current = cache.redis.register_script(server.REDIS_SET_IF_CURRENT)
+    return cache
+
+
+@pytest.fixture(params=[memory_cache, redis_cache], ids=["memory", "redis"])
+def cache(request):
+    return request.param()
+
+
+async def test_fill_reserved_before_an_invalidation_is_dropped(cache):
+    token = await cache.reserve("trip-a")
+    await cache.delete("trip-a")
+    await cache.set("trip-a", '"trip-1"', b"stale", token)
+    assert await cache.get("trip-a") is None
+
+    token = await cache.reserve("trip-a")
+    await cache.set("trip-a", '"trip-2"', b"fresh", token)
+    assert await cache.get("trip-a") == ('"trip-2"', b"fresh")
+
+
+async def test_invalidating_one_trip_keeps_fills_of_others(cache):
+    token = await cache.reserve("trip-a")
+    await cache.delete("trip-b")
+    await cache.set("trip-a", '"trip-1"', b"body", token)
+    assert await cache.get("trip-a") == ('"trip-1"', b"body")
+
+
+async def test_fill_older_than_the_ttl_is_dropped(cache, monkeypatch):
+    token = await cache.reserve("trip-a")
+    now = server.clock.monotonic()
+    monkeypatch.setattr(server.clock, "monotonic", lambda: now + 61)
+    await cache.set("trip-a", '"trip-1"', b"late", token)
+    assert await cache.get("trip-a") is None
+
+
+async def test_memory_invalidation_records_expire_after_the_ttl(monkeypatch):
+    cache = memory_cache()
+    now = server.clock.monotonic()
+    await cache.delete("trip-a")
+    monkeypatch.setattr(server.clock, "monotonic", lambda: now + 61)
+    await cache.delete("trip-b")
+    assert list(cache._generations) == ["trip-b"]
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.helpers import add_activity, provision, record_reads
+
+pytestmark = pytest.mark.anyio
+
+
+async def changes(api, trip_id, since=None):
+    response = await api.get(f"/trips/{trip_id}/changes", params={"since": since} if since else {})
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_first_sync_is_a_full_snapshot(api, db):
+    trip_id, days = await provision(api)
+    museum = await add_activity(api, trip_id, days[0], "museum")
+
+    snapshot = await changes(api, trip_id)
+    assert snapshot["full"] is True
+    assert [day["id"] for day in snapshot["days"]] == days
+    assert [activity["id"] for activity in snapshot["activities"]] == [museum["id"]]
+
+
+async def test_delta_carries_upserts_and_tombstoned_deletions(api, db):
+    trip_id, (day, _) = await provision(api)
+    museum = await add_activity(api, trip_id, day, "museum")
+    cursor = (await changes(api, trip_id))["cursor"]
+
+    lunch = await add_activity(api, trip_id, day, "lunch", "12:00", "13:00")
+    await api.delete(f"/activities/{museum['id']}")
+    delta = await changes(api, trip_id, cursor)
+
+    assert delta["full"] is False
+    assert [activity["id"] for activity in delta["activities"]] == [lunch["id"]]
+    assert delta["deleted"] == {"days": [], "activities": [museum["id"]]}
+    assert delta["cursor"] != cursor
+
+
+async def test_unchanged_version_reads_only_the_trip(api, db, monkeypatch):
+    trip_id, (day, _) = await provision(api)
+    await add_activity(api, trip_id, day, "museum")
+    cursor = (await changes(api, trip_id))["cursor"]
+
+    queried = record_reads(monkeypatch, db.trips)
+    delta = await changes(api, trip_id, cursor)
+    assert queried == ["trips"]
+    assert (delta["full"], delta["days"], delta["activities"]) == (False, [], [])
+    assert delta["deleted"] == {"days": [], "activities": []}
+
+
+@pytest.mark.parametrize("since", ["not-a-cursor", "3", "x.y"])
+async def test_malformed_cursor_falls_back_to_a_snapshot(api, db, since):
+    trip_id, _ = await provision(api)
+    assert (await changes(api, trip_id, since))["full"] is True
+
+
+async def test_cursor_older_than_the_tombstones_falls_back_to_a_snapshot(api, db):
+    trip_id, (day, _) = await provision(api)
+    museum = await add_activity(api, trip_id, day, "museum")
+    stale_at = datetime.now(timezone.utc) - timedelta(seconds=server.SYNC_TOMBSTONE_TTL + 60)
+    stale = server.sync_cursor(0, stale_at)
+
+    snapshot = await changes(api, trip_id, stale)
+    assert snapshot["full"] is True
+    assert [activity["id"] for activity in snapshot["activities"]] == [museum["id"]]
+
+
+async def test_rank_mode_delta_reports_positions_of_touched_days(api, db, monkeypatch):
+    monkeypatch.setattr(server, "ACTIVITY_ORDERING", "rank")
+    trip_id, (day, _) = await provision(api)
+    activities = [await add_activity(api, trip_id, day, f"a{n}", f"{8 + n:02d}:00", f"{8 + n:02d}:30") for n in range(3)]
+    cursor = (await changes(api, trip_id))["cursor"]
+
+    order = [activities[2]["id"], activities[0]["id"], activities[1]["id"]]
+    await api.post(f"/trips/{trip_id}/activities/reorder", json={"updates": [
+        {"id": activity_id, "day_id": day, "order_index": position} for position, activity_id in enumerate(order)
+    ]})
+    delta = await changes(api, trip_id, cursor)
+
+    assert delta["positions"] == {activity_id: position for position, activity_id in enumerate(order)}
+    for activity in delta["activities"]:
+        assert activity["order_index"] == delta["positions"][activity["id"]]
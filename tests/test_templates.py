@@ -0,0 +1,89 @@
+import pytest
+
+import server
+from tests.helpers import add_activity, provision
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_source(api):
+    trip_id, (first, second) = await provision(api, currency="EUR")
+    await add_activity(api, trip_id, first, "museum", cost=12, category="culture")
+    await add_activity(api, trip_id, first, "lunch", "12:00", "13:00", cost=20, category="food")
+    await add_activity(api, trip_id, second, "hike", cost=5)
+    return trip_id
+
+
+async def itinerary(api, trip_id):
+    details = (await api.get(f"/trips/{trip_id}")).json()
+    day_dates = {day["id"]: day["date"] for day in details["days"]}
+    activities = sorted(details["activities"], key=lambda a: (day_dates[a["day_id"]], a["order_index"]))
+    return details, [(day_dates[activity["day_id"]], activity["title"]) for activity in activities]
+
+
+async def test_clone_remaps_ids_and_shifts_dates(api, db):
+    source_id = await seed_source(api)
+    response = await api.post(f"/trips/{source_id}/clone", json={"title": "Again", "date_start": "2025-03-10"})
+    assert response.status_code == 200
+    assert (response.json()["days"], response.json()["activities"]) == (2, 3)
+    clone_id = response.json()["trip"]["id"]
+
+    source, source_plan = await itinerary(api, source_id)
+    clone, clone_plan = await itinerary(api, clone_id)
+    assert (clone["trip"]["title"], clone["trip"]["currency"]) == ("Again", "EUR")
+    assert (clone["trip"]["date_start"], clone["trip"]["date_end"]) == ("2025-03-10", "2025-03-11")
+    assert clone_plan == [("2025-03-10", "museum"), ("2025-03-10", "lunch"), ("2025-03-11", "hike")]
+    assert [title for _, title in source_plan] == [title for _, title in clone_plan]
+
+    source_ids = {source_id} | {d["id"] for d in source["days"]} | {a["id"] for a in source["activities"]}
+    clone_ids = {clone_id} | {d["id"] for d in clone["days"]} | {a["id"] for a in clone["activities"]}
+    assert not source_ids & clone_ids
+    assert {a["day_id"] for a in clone["activities"]} <= {d["id"] for d in clone["days"]}
+    assert all(a["trip_id"] == clone_id for a in clone["activities"])
+
+
+async def test_clone_builds_rollups_for_the_copy(api, db):
+    source_id = await seed_source(api)
+    clone_id = (await api.post(f"/trips/{source_id}/clone", json={})).json()["trip"]["id"]
+
+    assert await server.reconcile_rollups(clone_id, repair=False) == []
+    budget = (await api.get(f"/trips/{clone_id}/budget")).json()
+    assert (budget["total"], budget["count"]) == (37, 3)
+    clone, plan = await itinerary(api, clone_id)
+    assert plan[0][0] == "2025-01-01"
+
+
+async def test_clone_rejects_a_bad_date_start(api, db):
+    source_id = await seed_source(api)
+    trips_before = await db.trips.count_documents({})
+    response = await api.post(f"/trips/{source_id}/clone", json={"date_start": "10/03/2025"})
+    assert response.status_code == 400
+    assert await db.trips.count_documents({}) == trips_before
+
+
+async def test_clone_of_an_unknown_trip_is_404(api, db):
+    assert (await api.post("/trips/no-such-trip/clone", json={})).status_code == 404
+
+
+async def test_template_is_frozen_and_instantiates(api, db):
+    source_id = await seed_source(api)
+    created = await api.post("/templates", json={"trip_id": source_id, "name": "Weekend"})
+    template = created.json()
+    assert (template["day_count"], template["activity_count"]) == (2, 3)
+    assert "snapshot" not in template
+    assert [summary["id"] for summary in (await api.get("/templates")).json()] == [template["id"]]
+
+    # Later edits to the source trip do not reach the template
+    source, _ = await itinerary(api, source_id)
+    await add_activity(api, source_id, source["days"][0]["id"], "late addition", "20:00", "21:00")
+
+    response = await api.post(f"/templates/{template['id']}/instantiate", json={"date_start": "2025-06-01"})
+    assert response.status_code == 200
+    trip_id = response.json()["trip"]["id"]
+    _, plan = await itinerary(api, trip_id)
+    assert plan == [("2025-06-01", "museum"), ("2025-06-01", "lunch"), ("2025-06-02", "hike")]
+    assert await server.reconcile_rollups(trip_id, repair=False) == []
+
+    assert (await api.delete(f"/templates/{template['id']}")).status_code == 200
+    gone = await api.post(f"/templates/{template['id']}/instantiate", json={})
+    assert gone.status_code == 404